@@ -1,4 +1,13 @@
-import synthnav
+import os
+import sys
 
 if __name__ == "__main__":
+    if os.environ.get("IMPORT_TIME_REPORT") and "importtime" not in sys._xoptions:
+        # run the app like always, with python timing its imports
+        from synthnav.importtime import run_with_report
+
+        sys.exit(run_with_report(__file__, sys.argv[1:]))
+
+    import synthnav
+
     synthnav.main()
@@ -1 +1,6 @@
+import time
+
+# startup times are measured from here, so they include imports
+IMPORT_STARTED_AT = time.monotonic()
+
 from .main import main
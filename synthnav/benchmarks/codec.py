@@ -0,0 +1,119 @@
+"""Compare storage codecs by file size and load throughput.
+
+    python -m synthnav.benchmarks.codec --nodes 100000
+"""
+import time
+import random
+import asyncio
+import argparse
+import logging
+import tempfile
+from pathlib import Path
+from uuid import UUID
+from ..codec import Codec
+from ..database import Database
+from ..generation import Generation, GenerationState
+
+log = logging.getLogger(__name__)
+
+WORDS = (
+    "the a she he they it was were had looked walked said into from over "
+    "under night morning door window house forest river sword letter king "
+    "queen stranger old young quiet loud slowly quickly never always again"
+).split()
+
+
+def synthetic_story(node_amount: int, *, seed: int = 0, base_texts: int = 50):
+    """Random-parent tree where texts are mutations of a small set of base
+    paragraphs, mimicking near-identical sibling continuations."""
+    rng = random.Random(seed)
+    bases = [
+        [rng.choice(WORDS) for _ in range(rng.randint(80, 200))]
+        for _ in range(base_texts)
+    ]
+
+    def text():
+        words = list(rng.choice(bases))
+        for _ in range(rng.randint(1, 10)):
+            words[rng.randrange(len(words))] = rng.choice(WORDS)
+        return " ".join(words)
+
+    ids = []
+    for index in range(node_amount):
+        generation = Generation(
+            id=UUID(int=rng.getrandbits(128)),
+            state=GenerationState.GENERATED,
+            text=text(),
+            parent=rng.choice(ids) if ids else None,
+        )
+        ids.append(generation.id)
+        yield generation
+
+
+async def run_codec(codec: Codec, node_amount: int, directory: Path, seed: int):
+    db = Database(codec=codec)
+    await db.init()
+
+    start = time.monotonic()
+    for generation in synthetic_story(node_amount, seed=seed):
+        await db.insert_generation(generation.snapshot())
+    insert_seconds = time.monotonic() - start
+
+    path = directory / f"{codec.name.lower()}.synthnav"
+    await db.open_on(path, new=True, wipe_memory=False)
+    await db.close()
+
+    db = Database(codec=codec)
+    await db.init()
+    await db.open_on(path)
+    start = time.monotonic()
+    loaded = 0
+    async for _generation in db.iter_generations():
+        loaded += 1
+    load_seconds = time.monotonic() - start
+    await db.close()
+
+    assert loaded == node_amount
+    return {
+        "codec": codec.name,
+        "file_bytes": path.stat().st_size,
+        "insert_seconds": insert_seconds,
+        "load_seconds": load_seconds,
+        "load_rows_per_second": loaded / load_seconds,
+    }
+
+
+async def async_main(args):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for codec in Codec:
+            log.info("benchmarking %s with %d nodes", codec.name, args.nodes)
+            results.append(
+                await run_codec(codec, args.nodes, Path(directory), args.seed)
+            )
+
+    raw_size = results[0]["file_bytes"]
+    print(
+        f"{'codec':<10} {'size':>12} {'ratio':>7} {'insert s':>9} {'load rows/s':>12}"
+    )
+    for result in results:
+        print(
+            f"{result['codec']:<10} {result['file_bytes']:>12} "
+            f"{result['file_bytes'] / raw_size:>7.2f} "
+            f"{result['insert_seconds']:>9.2f} "
+            f"{result['load_rows_per_second']:>12.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("aiosqlite").setLevel(logging.INFO)
+    asyncio.run(async_main(args))
+
+
+if __name__ == "__main__":
+    main()
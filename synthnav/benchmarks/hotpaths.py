@@ -0,0 +1,274 @@
+"""Time controller, database and layout hot paths, without a display.
+
+    python -m synthnav.benchmarks.hotpaths --shape random --nodes 1000 100000 \\
+        --output results.json --baseline previous-results.json
+"""
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import dataclasses
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+from ..experiment_treetest import GenerationTreeController
+from ..headless import HeadlessApp
+from ..layout import layout_tree
+from ..metrics import write_metrics
+from ..store import GenerationStore
+from .trees import Shape, TreeShape, generations_for, story_texts, tree_shape
+
+log = logging.getLogger(__name__)
+
+# how many times the per-generation benchmarks (prompt_from, add_child)
+# run, no matter the size of the tree
+SAMPLES = 1000
+# how many distinct texts generations share
+TEXT_POOL_SIZE = 500
+# how much slower than the baseline a benchmark can get before it's
+# reported as a regression
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+
+@dataclass
+class BenchmarkResult:
+    benchmark: str
+    shape: str
+    nodes: int
+    seconds: float
+    operations: int
+
+    @property
+    def key(self) -> Tuple[str, str, int]:
+        return (self.benchmark, self.shape, self.nodes)
+
+    @property
+    def microseconds_per_operation(self) -> float:
+        return self.seconds / self.operations * 1_000_000
+
+
+class BenchmarkRun:
+    """Holds a generated tree, and a headless app with a database that is
+    filled with it by the insert_generation benchmark. Benchmarks run in
+    the order they're registered, as later ones use what earlier ones
+    made."""
+
+    def __init__(self, shape: Shape, node_amount: int, seed: int, directory: Path):
+        self.shape = shape
+        self.node_amount = node_amount
+        self.rng = random.Random(seed)
+        self.directory = directory
+        self.tree: TreeShape = tree_shape(shape, node_amount, seed=seed)
+        self.texts = story_texts(TEXT_POOL_SIZE, seed=seed)
+        self.app = HeadlessApp()
+        self.store: Optional[GenerationStore] = None
+
+    def close(self):
+        self.app.close()
+
+    def controller(self) -> GenerationTreeController:
+        root = self.store[self.tree[0][0]]
+        return GenerationTreeController(self.app, root, None, store=self.store)
+
+    def sample_ids(self):
+        return [self.rng.choice(self.tree)[0] for _ in range(SAMPLES)]
+
+
+# name -> function returning (seconds, operations)
+BENCHMARKS: Dict[str, Callable[[BenchmarkRun], Tuple[float, int]]] = {}
+
+
+def benchmark(name: str):
+    def wrapper(function):
+        BENCHMARKS[name] = function
+        return function
+
+    return wrapper
+
+
+@benchmark("insert_generation")
+def bench_insert_generation(run: BenchmarkRun):
+    snapshots = [
+        generation.snapshot()
+        for generation in generations_for(run.tree, run.texts, seed=0)
+    ]
+
+    async def insert_all():
+        for snapshot in snapshots:
+            await run.app.db.insert_generation(snapshot)
+
+    start = time.monotonic()
+    run.app.task.cast(insert_all())
+    return time.monotonic() - start, len(snapshots)
+
+
+@benchmark("save")
+def bench_save(run: BenchmarkRun):
+    path = run.directory / f"{run.shape.value}-{run.node_amount}.synthnav"
+    start = time.monotonic()
+    run.app.task.cast(run.app.db.open_on(path, new=True, wipe_memory=False))
+    return time.monotonic() - start, 1
+
+
+@benchmark("fetch_all_generations")
+def bench_fetch_all_generations(run: BenchmarkRun):
+    """Load the whole story like RealUIWindow does."""
+    store = GenerationStore(bulk=True)
+
+    def on_event(_reply_id, data):
+        match data[0]:
+            case "generation":
+                store.add(data[1])
+            case "done":
+                store.finish_bulk_load()
+
+    start = time.monotonic()
+    run.app.task.call(run.app.db.fetch_all_generations, on_event)
+    seconds = time.monotonic() - start
+
+    assert len(store) == run.node_amount
+    run.store = store
+    return seconds, len(store)
+
+
+@benchmark("layout")
+def bench_layout(run: BenchmarkRun):
+    start = time.monotonic()
+    placements, _height = layout_tree(run.store, run.store.indices[run.tree[0][0]])
+    return time.monotonic() - start, len(placements)
+
+
+@benchmark("prompt_from")
+def bench_prompt_from(run: BenchmarkRun):
+    controller = run.controller()
+    sample_ids = run.sample_ids()
+    start = time.monotonic()
+    for generation_id in sample_ids:
+        controller.prompt_from(generation_id)
+    return time.monotonic() - start, len(sample_ids)
+
+
+@benchmark("add_child")
+def bench_add_child(run: BenchmarkRun):
+    controller = run.controller()
+    sample_ids = run.sample_ids()
+    start = time.monotonic()
+    for generation_id in sample_ids:
+        controller.add_child(generation_id, run.rng.choice(run.texts))
+    return time.monotonic() - start, len(sample_ids)
+
+
+def run_benchmarks(
+    shape: Shape, node_amount: int, seed: int, names: List[str]
+) -> List[BenchmarkResult]:
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        run = BenchmarkRun(shape, node_amount, seed, Path(directory))
+        try:
+            for name, function in BENCHMARKS.items():
+                log.info("%s on %s tree of %d", name, shape.value, node_amount)
+                seconds, operations = function(run)
+                if name in names:
+                    results.append(
+                        BenchmarkResult(
+                            name, shape.value, node_amount, seconds, operations
+                        )
+                    )
+        finally:
+            run.close()
+    return results
+
+
+def load_results(path: Path) -> Dict[Tuple[str, str, int], BenchmarkResult]:
+    with path.open() as fd:
+        data = json.load(fd)
+    results = (BenchmarkResult(**result) for result in data["results"])
+    return {result.key: result for result in results}
+
+
+def write_results(path: Path, results: List[BenchmarkResult]):
+    data = {
+        "python": sys.version,
+        "platform": platform.platform(),
+        "created_at": int(time.time()),
+        "results": [dataclasses.asdict(result) for result in results],
+    }
+    with path.open("w") as fd:
+        json.dump(data, fd, indent=2)
+
+
+def print_results(
+    results: List[BenchmarkResult],
+    baseline: Dict[Tuple[str, str, int], BenchmarkResult],
+    threshold: float,
+) -> int:
+    """Print results next to their baseline, returning how many of them
+    regressed."""
+    regressions = 0
+    print(
+        f"{'benchmark':<22} {'shape':<7} {'nodes':>8} {'seconds':>9} "
+        f"{'us/op':>10} {'baseline':>10} {'change':>8}"
+    )
+    for result in results:
+        line = (
+            f"{result.benchmark:<22} {result.shape:<7} {result.nodes:>8} "
+            f"{result.seconds:>9.3f} {result.microseconds_per_operation:>10.1f}"
+        )
+        previous = baseline.get(result.key)
+        if previous:
+            change = result.seconds / previous.seconds - 1
+            line += f" {previous.microseconds_per_operation:>10.1f} {change:>+8.0%}"
+            if change > threshold:
+                regressions += 1
+                line += " REGRESSION"
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--shape",
+        choices=[shape.value for shape in Shape],
+        action="append",
+        help="can be given many times, defaults to all shapes",
+    )
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1000, 10_000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--only", choices=list(BENCHMARKS), action="append", help="only report these"
+    )
+    parser.add_argument("--output", type=Path, help="write results as json here")
+    parser.add_argument("--baseline", type=Path, help="results to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+    parser.add_argument(
+        "--metrics",
+        type=Path,
+        help="write collected metrics here, as prometheus text if it ends in .prom",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("aiosqlite").setLevel(logging.INFO)
+
+    shapes = [Shape(shape) for shape in args.shape or [s.value for s in Shape]]
+    names = args.only or list(BENCHMARKS)
+    results = []
+    for shape in shapes:
+        for node_amount in args.nodes:
+            results.extend(run_benchmarks(shape, node_amount, args.seed, names))
+
+    if args.output:
+        write_results(args.output, results)
+    if args.metrics:
+        write_metrics(args.metrics)
+    baseline = load_results(args.baseline) if args.baseline else {}
+    regressions = print_results(results, baseline, args.threshold)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Compare GenerationStore against a dict of Generation objects.
+
+    python -m synthnav.benchmarks.store --nodes 100000
+"""
+import gc
+import time
+import argparse
+import logging
+import tracemalloc
+from uuid import UUID
+from typing import Dict
+from ..generation import Generation, GenerationState
+from ..store import GenerationStore
+from .trees import Shape, TreeShape, tree_shape
+
+log = logging.getLogger(__name__)
+
+
+def build_dict(shape: TreeShape) -> Dict[UUID, Generation]:
+    """How the window used to hold a loaded story."""
+    generation_map = {}
+    for generation_id, parent_id in shape:
+        generation_map[generation_id] = Generation(
+            id=generation_id,
+            state=GenerationState.GENERATED,
+            text="",
+            parent=parent_id,
+        )
+        if parent_id is not None:
+            generation_map[parent_id].children.append(generation_id)
+    return generation_map
+
+
+def build_store(shape: TreeShape) -> GenerationStore:
+    """How the window loads a story."""
+    store = GenerationStore(bulk=True)
+    for generation_id, parent_id in shape:
+        store.add(
+            Generation(
+                id=generation_id,
+                state=GenerationState.GENERATED,
+                text="",
+                parent=parent_id,
+            )
+        )
+    store.finish_bulk_load()
+    return store
+
+
+def walk_dict(generation_map: Dict[UUID, Generation], root_id: UUID) -> int:
+    visited = 0
+    stack = [root_id]
+    while stack:
+        generation = generation_map[stack.pop()]
+        visited += 1
+        stack.extend(reversed(generation.children))
+    return visited
+
+
+def walk_store(store: GenerationStore, _root_id: UUID) -> int:
+    visited = 0
+    for _index in store.walk():
+        visited += 1
+    return visited
+
+
+def measure(build, walk, shape: TreeShape):
+    # tracemalloc slows allocations down a lot, so build twice
+    gc.collect()
+    tracemalloc.start()
+    structure = build(shape)
+    memory_bytes, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del structure
+
+    start = time.monotonic()
+    structure = build(shape)
+    build_seconds = time.monotonic() - start
+
+    start = time.monotonic()
+    visited = walk(structure, shape[0][0])
+    walk_seconds = time.monotonic() - start
+    assert visited == len(shape)
+
+    return {
+        "memory_bytes": memory_bytes,
+        "build_seconds": build_seconds,
+        "walk_seconds": walk_seconds,
+    }
+
+
+def run(shape: Shape, node_amount: int, seed: int):
+    tree = tree_shape(shape, node_amount, seed=seed)
+    return {
+        "dict": measure(build_dict, walk_dict, tree),
+        "store": measure(build_store, walk_store, tree),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--shape", choices=[shape.value for shape in Shape], default="random"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    log.info("benchmarking with %d nodes", args.nodes)
+    results = run(Shape(args.shape), args.nodes, args.seed)
+    print(f"{'structure':<10} {'bytes/node':>11} {'build s':>8} {'walk s':>8}")
+    for name, result in results.items():
+        print(
+            f"{name:<10} {result['memory_bytes'] / args.nodes:>11.1f} "
+            f"{result['build_seconds']:>8.3f} {result['walk_seconds']:>8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
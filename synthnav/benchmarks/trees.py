@@ -0,0 +1,64 @@
+"""Tree shapes for benchmarks, generated from a seed."""
+import enum
+import random
+from uuid import UUID
+from typing import Iterator, List, Optional, Tuple
+from ..generation import Generation, GenerationState
+from ..synthetic import WORDS
+
+# (id, parent id), parents always before their children
+TreeShape = List[Tuple[UUID, Optional[UUID]]]
+
+# children per generation in wide trees
+WIDE_FANOUT = 100
+# chance of a deep tree's generation not continuing the latest one
+DEEP_BRANCH_CHANCE = 0.05
+
+
+class Shape(enum.Enum):
+    # few levels, many siblings
+    WIDE = "wide"
+    # long chains with the occasional branch, like a story that mostly
+    # keeps going forward
+    DEEP = "deep"
+    # every generation picks its parent at random
+    RANDOM = "random"
+
+
+def tree_shape(shape: Shape, node_amount: int, *, seed: int = 0) -> TreeShape:
+    rng = random.Random(seed)
+    ids = [UUID(int=rng.getrandbits(128)) for _ in range(node_amount)]
+    tree = [(ids[0], None)]
+    for index in range(1, node_amount):
+        match shape:
+            case Shape.WIDE:
+                parent_index = (index - 1) // WIDE_FANOUT
+            case Shape.DEEP:
+                if rng.random() < DEEP_BRANCH_CHANCE:
+                    parent_index = rng.randrange(index)
+                else:
+                    parent_index = index - 1
+            case Shape.RANDOM:
+                parent_index = rng.randrange(index)
+        tree.append((ids[index], ids[parent_index]))
+    return tree
+
+
+def story_texts(amount: int, *, seed: int = 0, words: int = 60) -> List[str]:
+    """A pool of texts for generations to take from, so big trees don't
+    need a distinct string per generation."""
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(WORDS, k=words)) for _ in range(amount)]
+
+
+def generations_for(
+    tree: TreeShape, texts: List[str], *, seed: int = 0
+) -> Iterator[Generation]:
+    rng = random.Random(seed)
+    for generation_id, parent_id in tree:
+        yield Generation(
+            id=generation_id,
+            state=GenerationState.GENERATED,
+            text=rng.choice(texts),
+            parent=parent_id,
+        )
@@ -0,0 +1,127 @@
+import enum
+import zlib
+import hashlib
+import logging
+from collections import Counter
+from typing import Iterable, Optional, Tuple, Union
+
+log = logging.getLogger(__name__)
+
+# zlib can only look back 32KB, so a bigger preset dictionary is useless
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+# compressing tiny texts makes them bigger, keep those as-is
+MIN_COMPRESSIBLE_LENGTH = 64
+
+COMPRESSION_LEVEL = 6
+
+
+class Codec(enum.IntEnum):
+    """How the `data` column of a generation row is encoded.
+
+    The value is persisted in the `codec` column of every row, so
+    existing values must never be renumbered."""
+
+    RAW = 0
+    ZLIB = 1
+    # zlib with the story's shared preset dictionary (codec_dictionary table)
+    ZLIB_DICT = 2
+
+    @classmethod
+    def from_name(cls, name: str) -> "Codec":
+        return cls[name.strip().upper().replace("-", "_")]
+
+
+def encode_text(
+    text: str, codec: Codec, zdict: Optional[bytes] = None
+) -> Tuple[Codec, Union[str, bytes]]:
+    """Encode text for storage, returning the codec that was actually used
+    alongside the encoded data."""
+    if codec == Codec.RAW or len(text) < MIN_COMPRESSIBLE_LENGTH:
+        return Codec.RAW, text
+
+    if codec == Codec.ZLIB_DICT and not zdict:
+        # no dictionary trained yet for this story
+        codec = Codec.ZLIB
+
+    if codec == Codec.ZLIB_DICT:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL)
+
+    data = compressor.compress(text.encode()) + compressor.flush()
+    return codec, data
+
+
+def decode_text(
+    codec: Codec, data: Union[str, bytes], zdict: Optional[bytes] = None
+) -> str:
+    match codec:
+        case Codec.RAW:
+            return data
+        case Codec.ZLIB:
+            return zlib.decompress(data).decode()
+        case Codec.ZLIB_DICT:
+            if not zdict:
+                raise ValueError("generation requires codec dictionary, none loaded")
+            decompressor = zlib.decompressobj(zdict=zdict)
+            return (decompressor.decompress(data) + decompressor.flush()).decode()
+        case _:
+            raise ValueError(f"unknown codec {codec!r}")
+
+
+def decode_preview(
+    codec: Codec, data: Union[str, bytes], length: int, zdict: Optional[bytes] = None
+) -> str:
+    """Decode only the first `length` characters of stored text, without
+    inflating the rest of it."""
+    match codec:
+        case Codec.RAW:
+            return data[:length]
+        case Codec.ZLIB | Codec.ZLIB_DICT:
+            if codec == Codec.ZLIB_DICT:
+                if not zdict:
+                    raise ValueError(
+                        "generation requires codec dictionary, none loaded"
+                    )
+                decompressor = zlib.decompressobj(zdict=zdict)
+            else:
+                decompressor = zlib.decompressobj()
+            # utf-8 is at most 4 bytes per character
+            data = decompressor.decompress(data, length * 4)
+            return data.decode(errors="ignore")[:length]
+        case _:
+            raise ValueError(f"unknown codec {codec!r}")
+
+
+def text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+def train_dictionary(
+    samples: Iterable[str], *, size: int = MAX_DICTIONARY_SIZE, ngram: int = 4
+) -> bytes:
+    """Build a zlib preset dictionary out of the word n-grams that repeat
+    the most across the given samples.
+
+    zlib prefers matches that are closer to the end of the dictionary, so
+    the most common n-grams are placed last."""
+    counts = Counter()
+    for sample in samples:
+        words = sample.split()
+        for index in range(max(len(words) - ngram + 1, 0)):
+            counts[" ".join(words[index : index + ngram])] += 1
+
+    chosen = []
+    total_size = 0
+    for phrase, count in counts.most_common():
+        if count < 2:
+            break
+        encoded = phrase.encode() + b" "
+        if total_size + len(encoded) > size:
+            break
+        chosen.append(encoded)
+        total_size += len(encoded)
+
+    log.debug("trained dictionary with %d phrases, %d bytes", len(chosen), total_size)
+    return b"".join(reversed(chosen))
@@ -1,3 +1,6 @@
+import gc
+import asyncio
+import threading
 import tkinter as tk
 import _tkinter
 from uuid import uuid4 as new_uuid
@@ -7,6 +10,8 @@ from unittest.mock import MagicMock
 import lorem
 import pytest
 
+from .headless import HeadlessApp
+from .store import StoredGeneration
 from .experiment_treetest import (
     Generation,
     GenerationTreeController,
@@ -17,7 +22,7 @@ from .experiment_treetest import (
 
 @dataclass
 class TestTreeFixture:
-    root: Generation
+    root: StoredGeneration
     controller: GenerationTreeController
     tk_root: tk.Frame
 
@@ -53,7 +58,9 @@ def tk_root_fixture() -> TkRootFixture:
 
 @pytest.fixture(name="app")
 def app_fixture():
-    raise NotImplementedError("TODO")
+    app = HeadlessApp()
+    yield app
+    app.close()
 
 
 @pytest.fixture(name="tree")
@@ -69,7 +76,9 @@ def test_tree_fixture(tk_root, app):
     view.controller = tree_controller
     tree_controller.start()
     return TestTreeFixture(
-        root=root_generation, controller=tree_controller, tk_root=tk_root
+        root=tree_controller.root_generation,
+        controller=tree_controller,
+        tk_root=tk_root,
     )
 
 
@@ -84,7 +93,21 @@ def test_tree_fixture_mocked_gui(app):
     tree_controller = GenerationTreeController(app, root_generation, MagicMock())
     tree_controller.start()
     return TestTreeFixture(
-        root=root_generation,
+        root=tree_controller.root_generation,
         controller=tree_controller,
         tk_root=MagicMock(),
     )
+
+
+@pytest.fixture(name="loop_thread")
+def loop_thread_fixture():
+    # tcl interpreters left behind by earlier tests must not be collected
+    # by the loop thread, tcl aborts when deleted from another thread
+    gc.collect()
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="asyncio")
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
@@ -1,27 +1,60 @@
 import time
+import asyncio
 import logging
+import contextlib
 import aiosqlite
+from collections import OrderedDict
 from pathlib import Path
 from .tinytask import producer
+from .metrics import REGISTRY
 from dataclasses import dataclass
 from uuid import UUID
-from .generation import GenerationState, Generation
+from typing import Dict, List, Optional, Set, Tuple
+from .generation import GenerationState, Generation, GenerationSnapshot
+from .codec import (
+    Codec,
+    encode_text,
+    decode_text,
+    decode_preview,
+    text_hash,
+    train_dictionary,
+)
 
 log = logging.getLogger(__name__)
 
 
 def must_be_initialized(function):
-    def wrapped(self, *args, **kwargs):
+    async def wrapped(self, *args, **kwargs):
         assert self.db is not None
-        return function(self, *args, **kwargs)
+        with REGISTRY.histogram(
+            "db_operation_seconds",
+            "time database operations take",
+            operation=function.__name__,
+        ).time():
+            return await function(self, *args, **kwargs)
 
     return wrapped
 
 
 def change(function):
-    """Signal that a function changes the database."""
+    """Signal that a function changes the database. Changes are tracked
+    while they run, so that flush() can wait for them."""
     function.__changes_db = True
-    return must_be_initialized(function)
+    initialized = must_be_initialized(function)
+
+    async def wrapped(self, *args, **kwargs):
+        self.unsaved_changes = True
+        task = asyncio.current_task()
+        if task in self._writing_tasks:
+            # a change made by another change, the outer one tracks the task
+            return await initialized(self, *args, **kwargs)
+        self._writing_tasks.add(task)
+        try:
+            return await initialized(self, *args, **kwargs)
+        finally:
+            self._writing_tasks.discard(task)
+
+    return wrapped
 
 
 @dataclass
@@ -51,13 +84,120 @@ MIGRATIONS = (
         ) strict;
         """,
     ),
+    Migration(
+        2,
+        "storage codecs for generation text",
+        """
+        create table generations_v2 (
+            id text primary key,
+            state int not null,
+            codec int not null default 0,
+            data any not null
+        ) strict;
+
+        insert into generations_v2 (id, state, codec, data)
+            select id, state, 0, data from generations;
+        drop table generations;
+        alter table generations_v2 rename to generations;
+
+        create table codec_dictionary (
+            id int primary key,
+            created_at int not null,
+            data blob not null
+        ) strict;
+        """,
+    ),
+    Migration(
+        3,
+        "index generation_parents by child",
+        """
+        create index generation_parents_child_id
+            on generation_parents (child_id);
+        """,
+    ),
+    Migration(
+        4,
+        "text length and hash for preview projections",
+        """
+        alter table generations add column text_length int not null default 0;
+        alter table generations add column text_hash text not null default '';
+
+        update generations set
+            text_length = length(decode_text(codec, data)),
+            text_hash = text_hash(decode_text(codec, data));
+        """,
+    ),
+    Migration(
+        5,
+        "full text search over generations",
+        """
+        -- text is stored compressed, so the index reads it decoded through
+        -- this view instead of keeping a copy of its own. decode_text only
+        -- exists in the app, which keeps the index in sync, so other
+        -- sqlite clients can still write to generations
+        create view generation_texts as
+            select rowid as generation_rowid, decode_text(codec, data) as text
+            from generations;
+
+        create virtual table generations_fts using fts5(
+            text,
+            prefix='2 3',
+            content='generation_texts',
+            content_rowid='generation_rowid'
+        );
+
+        insert into generations_fts (generations_fts) values ('rebuild');
+        """,
+    ),
+    Migration(
+        6,
+        "generation versions",
+        """
+        alter table generations add column version int not null default 0;
+        """,
+    ),
+    Migration(
+        7,
+        "folded subtrees",
+        """
+        alter table generations add column collapsed int not null default 0;
+        """,
+    ),
+    Migration(
+        8,
+        "generated token counts",
+        """
+        alter table generations add column tokens int not null default 0;
+        """,
+    ),
 )
 
+# train the story's shared dictionary once there's enough text to learn from
+DICTIONARY_TRAINING_THRESHOLD = 256
+
+# how many full texts get_text keeps around when loading in projection mode
+TEXT_CACHE_SIZE = 512
+
+
+def fts_query_from(query: str) -> str:
+    """Turn user input into a query that can't trip on fts5 syntax, with
+    every word being matched as a prefix."""
+    words = query.split()
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
 
 class Database:
-    def __init__(self):
+    def __init__(self, *, codec: Codec = Codec.RAW):
         self.db = None
         self.path = None
+        self.codec = codec
+        self.zdict = None
+        self._inserts_without_dictionary = 0
+        self._text_cache = OrderedDict()
+        # tasks running a change right now
+        self._writing_tasks: Set[asyncio.Task] = set()
+        # whether anything changed since the story was opened or saved
+        self.unsaved_changes = False
 
     async def init(self):
         assert self.db is None  # do not call init() on already-initted db
@@ -71,9 +211,26 @@ class Database:
         # the file's db is dumped to :memory:
         self.db = await aiosqlite.connect(":memory:")
         self.db.row_factory = aiosqlite.Row
+        await self.db.create_function(
+            "decode_text", 2, self._sql_decode_text, deterministic=True
+        )
+        await self.db.create_function(
+            "decode_preview", 3, self._sql_decode_preview, deterministic=True
+        )
+        await self.db.create_function("text_hash", 1, text_hash, deterministic=True)
+        self._text_cache.clear()
 
         log.info("memory db running!")
         await self.run_migrations()
+        await self.load_codec_dictionary()
+
+    async def flush(self):
+        """Wait for changes that already started, like those cast right
+        before this was."""
+        writing = self._writing_tasks - {asyncio.current_task()}
+        if writing:
+            log.info("waiting for %d writes", len(writing))
+            await asyncio.wait(writing)
 
     async def close(self):
         if self.db:
@@ -138,8 +295,12 @@ class Database:
                 await self.db.backup(target_db)
 
             log.debug("running migrations...")
+            # older stories may need their dictionary to run migrations
+            await self.load_codec_dictionary()
             await self.run_migrations()
+            await self.load_codec_dictionary()
 
+        self.unsaved_changes = False
         log.info("done")
 
     @must_be_initialized
@@ -149,57 +310,400 @@ class Database:
             await self.db.commit()
             await target_db.commit()
             await self.db.backup(target_db)
+        self.unsaved_changes = False
         log.info("done")
 
-    @producer
+    def _sql_decode_text(self, codec, data):
+        return decode_text(codec, data, self.zdict)
+
+    def _sql_decode_preview(self, codec, data, length):
+        return decode_preview(codec, data, length, self.zdict)
+
     @must_be_initialized
-    async def fetch_all_generations(self, tt, from_pid):
+    async def load_codec_dictionary(self):
+        self.zdict = None
+        self._inserts_without_dictionary = 0
+        self._text_cache.clear()
+
         async with self.db.execute(
-            """
-            select id, state, data, parent_id
+            "select name from sqlite_master where type = 'table' and name = 'codec_dictionary'"
+        ) as cursor:
+            if not await cursor.fetchone():
+                return
+
+        async with self.db.execute(
+            "select data from codec_dictionary order by id desc limit 1"
+        ) as cursor:
+            row = await cursor.fetchone()
+        self.zdict = row["data"] if row else None
+
+    @change
+    async def train_codec_dictionary(self):
+        """Train the story's shared dictionary from the text it already has,
+        then re-encode every generation with it. Only zlib-dict has any
+        use for a dictionary, other codecs are left alone."""
+        if self.codec != Codec.ZLIB_DICT:
+            return
+        assert self.zdict is None  # dictionaries can't be replaced
+        async with self.db.execute(
+            "select decode_text(codec, data) as text from generations"
+        ) as cursor:
+            samples = [row["text"] async for row in cursor]
+
+        zdict = train_dictionary(samples)
+        if not zdict:
+            log.info("not enough repeated text to train a dictionary")
+            return
+
+        await self.db.execute_insert(
+            "insert into codec_dictionary (id, created_at, data) values (1, ?, ?)",
+            (int(time.time()), zdict),
+        )
+        self.zdict = zdict
+
+        async with self.db.execute(
+            "select id, decode_text(codec, data) as text from generations"
+        ) as cursor:
+            rows = [(row["id"], row["text"]) async for row in cursor]
+
+        await self.db.executemany(
+            "update generations set codec = ?, data = ? where id = ?",
+            (
+                (*encode_text(text, self.codec, self.zdict), generation_id)
+                for generation_id, text in rows
+            ),
+        )
+        log.info("trained %d byte dictionary from %d texts", len(zdict), len(rows))
+
+    def _encode(self, text: str):
+        return encode_text(text, self.codec, self.zdict)
+
+    async def iter_generations(self, *, preview_length: Optional[int] = None):
+        """Iterate over all generations.
+
+        When preview_length is given, only that many characters of text are
+        loaded per generation (projection mode), and the full text must be
+        fetched through get_text."""
+        if preview_length is None:
+            data_column = "data"
+        else:
+            data_column = "decode_preview(codec, data, :preview_length) as preview"
+
+        async with self.db.execute(
+            f"""
+            select id, state, version, collapsed, codec, {data_column}, text_length,
+                text_hash, tokens, parent_id
             from generations
             full outer join generation_parents
             on generation_parents.child_id = generations.id
-            """
+            """,
+            {"preview_length": preview_length},
         ) as cursor:
             async for row in cursor:
-                generation = Generation(
+                if preview_length is None:
+                    text = decode_text(row["codec"], row["data"], self.zdict)
+                    preview = None
+                else:
+                    text = None
+                    preview = row["preview"]
+
+                yield Generation(
                     id=UUID(row["id"]),
                     state=GenerationState(row["state"]),
-                    text=row["data"],
+                    text=text,
                     parent=UUID(row["parent_id"]) if row["parent_id"] else None,
+                    preview=preview,
+                    text_length=row["text_length"],
+                    text_hash=row["text_hash"],
+                    version=row["version"],
+                    collapsed=bool(row["collapsed"]),
+                    tokens=row["tokens"],
                 )
-                tt.send(from_pid, ("generation", generation))
 
-        # TODO do we need this to be a part of the result, now that we use joins?
+    @producer
+    @must_be_initialized
+    async def fetch_all_generations(
+        self, tt, from_pid, *, preview_length: Optional[int] = None
+    ):
+        async for generation in self.iter_generations(preview_length=preview_length):
+            await tt.put(from_pid, ("generation", generation))
+        tt.send(from_pid, ("done",))
+        tt.finish(from_pid)
+
+    def _cache_text(self, generation_id: UUID, text: str):
+        self._text_cache[generation_id] = text
+        self._text_cache.move_to_end(generation_id)
+        while len(self._text_cache) > TEXT_CACHE_SIZE:
+            self._text_cache.popitem(last=False)
+
+    @must_be_initialized
+    async def get_texts(self, generation_ids: List[UUID]) -> Dict[UUID, str]:
+        """Fetch full texts of the given generations, going through an LRU
+        cache so that repeated prompts from the same path stay cheap."""
+        texts = {}
+        missing = []
+        for generation_id in generation_ids:
+            if generation_id in self._text_cache:
+                self._text_cache.move_to_end(generation_id)
+                texts[generation_id] = self._text_cache[generation_id]
+            else:
+                missing.append(generation_id)
+
+        if missing:
+            placeholders = ",".join("?" * len(missing))
+            async with self.db.execute(
+                f"select id, codec, data from generations where id in ({placeholders})",
+                [str(generation_id) for generation_id in missing],
+            ) as cursor:
+                async for row in cursor:
+                    generation_id = UUID(row["id"])
+                    text = decode_text(row["codec"], row["data"], self.zdict)
+                    texts[generation_id] = text
+                    self._cache_text(generation_id, text)
+
+        return texts
+
+    async def get_text(self, generation_id: UUID) -> str:
+        texts = await self.get_texts([generation_id])
+        return texts[generation_id]
+
+    @must_be_initialized
+    async def fetch_children_map(self) -> Tuple[List[UUID], Dict[UUID, List[UUID]]]:
+        """Fetch only the shape of the tree: its roots and every
+        generation's children, in the order they were created. An empty
+        story has no roots, an imported one can have several."""
         async with self.db.execute(
-            "select parent_id, child_id from generation_parents"
+            """
+            select id from generations
+            where id not in (select child_id from generation_parents)
+            order by rowid
+            """
+        ) as cursor:
+            root_ids = [UUID(row["id"]) async for row in cursor]
+
+        children_of = {}
+        # rowid order is insertion order
+        async with self.db.execute(
+            "select parent_id, child_id from generation_parents order by rowid"
         ) as cursor:
             async for row in cursor:
-                tt.send(from_pid, ("parent", row["parent_id"], row["child_id"]))
+                children_of.setdefault(UUID(row["parent_id"]), []).append(
+                    UUID(row["child_id"])
+                )
+
+        return root_ids, children_of
+
+    @must_be_initialized
+    async def fetch_states_and_texts(
+        self, generation_ids: List[UUID]
+    ) -> Dict[UUID, Tuple[GenerationState, str]]:
+        """Like get_texts, but without going through (and evicting
+        everything from) the text cache, for one-off bulk reads."""
+        placeholders = ",".join("?" * len(generation_ids))
+        async with self.db.execute(
+            f"select id, state, codec, data from generations where id in ({placeholders})",
+            [str(generation_id) for generation_id in generation_ids],
+        ) as cursor:
+            return {
+                UUID(row["id"]): (
+                    GenerationState(row["state"]),
+                    decode_text(row["codec"], row["data"], self.zdict),
+                )
+                async for row in cursor
+            }
+
+    @producer
+    @must_be_initialized
+    async def search(self, tt, from_pid, query: str, *, limit: int = 50):
+        """Stream the generations that best match the query, each with a
+        snippet of where they matched."""
+        fts_query = fts_query_from(query)
+        if fts_query:
+            async with self.db.execute(
+                """
+                select generations.id,
+                    snippet(generations_fts, 0, '[', ']', '\N{HORIZONTAL ELLIPSIS}', 12)
+                        as snippet
+                from generations_fts
+                join generations on generations.rowid = generations_fts.rowid
+                where generations_fts match ?
+                order by rank
+                limit ?
+                """,
+                (fts_query, limit),
+            ) as cursor:
+                async for row in cursor:
+                    await tt.put(from_pid, ("hit", UUID(row["id"]), row["snippet"]))
 
         tt.send(from_pid, ("done",))
         tt.finish(from_pid)
 
     @change
-    async def update_generation(self, generation):
-        await self.db.execute_insert(
-            "update generations set state = ?, data = ? where id = ?",
+    async def update_generation(self, snapshot: GenerationSnapshot) -> bool:
+        """Write a snapshot, unless a newer one already was. Returns if the
+        snapshot was written."""
+        codec, data = self._encode(snapshot.text)
+        # the index can only forget the text that's still there
+        await self.db.execute(
+            """
+            delete from generations_fts where rowid = (
+                select rowid from generations where id = ? and version < ?
+            )
+            """,
+            (str(snapshot.id), snapshot.version),
+        )
+        async with self.db.execute(
+            """
+            update generations
+            set state = ?, version = ?, codec = ?, data = ?,
+                text_length = ?, text_hash = ?, tokens = ?
+            where id = ? and version < ?
+            """,
+            (
+                snapshot.state,
+                snapshot.version,
+                codec,
+                data,
+                len(snapshot.text),
+                text_hash(snapshot.text),
+                snapshot.tokens,
+                str(snapshot.id),
+                snapshot.version,
+            ),
+        ) as cursor:
+            written = cursor.rowcount > 0
+
+        if not written:
+            log.debug("dropped stale write of %s v%d", snapshot.id, snapshot.version)
+            return False
+        await self._index_texts([(snapshot.id, snapshot.text)])
+        self._text_cache.pop(snapshot.id, None)
+        return True
+
+    @change
+    async def set_collapsed(self, generation_id: UUID, collapsed: bool):
+        await self.db.execute(
+            "update generations set collapsed = ? where id = ?",
+            (collapsed, str(generation_id)),
+        )
+
+    @must_be_initialized
+    async def memory_used(self) -> int:
+        """Size of the in-memory database, in bytes."""
+        async with self.db.execute("pragma page_count") as cursor:
+            (page_count,) = await cursor.fetchone()
+        async with self.db.execute("pragma page_size") as cursor:
+            (page_size,) = await cursor.fetchone()
+        return page_count * page_size
+
+    @must_be_initialized
+    async def commit(self):
+        await self.db.commit()
+
+    @contextlib.asynccontextmanager
+    async def savepoint(self, name: str):
+        """Run a block of changes atomically: either all of them apply, or
+        none of them do if the block raises."""
+        await self.db.execute(f"savepoint {name}")
+        try:
+            yield
+        except BaseException:
+            await self.db.execute(f"rollback to {name}")
+            await self.db.execute(f"release {name}")
+            raise
+        else:
+            await self.db.execute(f"release {name}")
+
+    async def _index_texts(self, texts: List[Tuple[UUID, str]]):
+        """Put (generation id, text) pairs in the full text index. Texts
+        already in it must be deleted from it before they change, as that
+        is done by reading what they were."""
+        await self.db.executemany(
+            """
+            insert into generations_fts (rowid, text)
+                select rowid, ? from generations where id = ?
+            """,
+            ((text, str(generation_id)) for generation_id, text in texts),
+        )
+
+    @change
+    async def delete_all_generations(self):
+        await self.db.execute("delete from generation_parents")
+        await self.db.execute("delete from generations")
+        await self.db.execute(
+            "insert into generations_fts (generations_fts) values ('delete-all')"
+        )
+        self._text_cache.clear()
+
+    @change
+    async def insert_generations(self, snapshots: List[GenerationSnapshot]):
+        """Insert many generations at once. Parents must come before their
+        children."""
+        rows = []
+        for snapshot in snapshots:
+            codec, data = self._encode(snapshot.text)
+            rows.append(
+                (
+                    str(snapshot.id),
+                    snapshot.state.value,
+                    snapshot.version,
+                    codec,
+                    data,
+                    len(snapshot.text),
+                    text_hash(snapshot.text),
+                    snapshot.tokens,
+                )
+            )
+
+        await self.db.executemany(
+            """
+            insert into generations
+                (id,state,version,codec,data,text_length,text_hash,tokens)
+            values (?,?,?,?,?,?,?,?)
+            """,
+            rows,
+        )
+        await self.db.executemany(
+            "insert into generation_parents (parent_id,child_id) values (?,?)",
             (
-                generation.state,
-                generation.text,
-                str(generation.id),
+                (str(snapshot.parent), str(snapshot.id))
+                for snapshot in snapshots
+                if snapshot.parent
             ),
         )
+        await self._index_texts(
+            [(snapshot.id, snapshot.text) for snapshot in snapshots]
+        )
 
     @change
-    async def insert_generation(self, generation):
+    async def insert_generation(self, snapshot: GenerationSnapshot):
+        codec, data = self._encode(snapshot.text)
         await self.db.execute_insert(
-            "insert into generations (id,state,data) values (?,?,?)",
-            (str(generation.id), generation.state.value, generation.text),
+            """
+            insert into generations
+                (id,state,version,codec,data,text_length,text_hash,tokens)
+            values (?,?,?,?,?,?,?,?)
+            """,
+            (
+                str(snapshot.id),
+                snapshot.state.value,
+                snapshot.version,
+                codec,
+                data,
+                len(snapshot.text),
+                text_hash(snapshot.text),
+                snapshot.tokens,
+            ),
         )
-        if generation.parent:
+        if snapshot.parent:
             await self.db.execute_insert(
                 "insert into generation_parents (parent_id,child_id) values (?,?)",
-                (str(generation.parent), str(generation.id)),
+                (str(snapshot.parent), str(snapshot.id)),
             )
+        await self._index_texts([(snapshot.id, snapshot.text)])
+
+        if self.codec == Codec.ZLIB_DICT and self.zdict is None:
+            self._inserts_without_dictionary += 1
+            if self._inserts_without_dictionary >= DICTIONARY_TRAINING_THRESHOLD:
+                self._inserts_without_dictionary = 0
+                await self.train_codec_dictionary()
@@ -1,24 +1,58 @@
 import sys
 import os
-import traceback
+import signal
+import socket
 import time
 import queue
 import logging
+import dataclasses
 import tkinter as tk
 import asyncio
 import threading
-from typing import Any
+import tracemalloc
+from typing import Any, Dict
+from dataclasses import dataclass
 from enum import Enum
 from .tinytask import TinytaskManager
+from .metrics import REGISTRY, write_metrics_forever
+from .profiling import Profiler
+from .watchdog import StallWatchdog, format_thread_stack
+from .memory import TRACEMALLOC_FRAMES
 from .context import app_context_var
+from . import IMPORT_STARTED_AT
 
 log = logging.getLogger(__name__)
 
 
 class TkEvent(Enum):
     QUIT = "<<Quit>>"
-    NEW_MESSAGE = "<<NewMessage>>"
-    NOTHING = "<<Nothing>>"
+
+
+# tk can't watch file descriptors on windows, poll the queue there instead
+WAKEUP_POLL_INTERVAL_MS = 50
+
+# how long process_tk_message may run before letting tk redraw
+MESSAGE_SLICE_BUDGET = 0.008
+
+# shutdown phases in the order they run, with how many seconds each can
+# take before it's given up on
+SHUTDOWN_DEADLINES = {
+    "cancel_calls": 1.0,
+    "flush_writes": 3.0,
+    "checkpoint": 3.0,
+    "close_connections": 2.0,
+    "cancel_tasks": 1.0,
+}
+
+
+@dataclass
+class MessageQueueMetrics:
+    processed: int = 0
+    slices: int = 0
+    # slices that ran out of budget with messages still queued
+    yielded_slices: int = 0
+    last_slice_seconds: float = 0
+    max_slice_seconds: float = 0
 
 
 class TkAsyncApplication:
@@ -28,40 +62,120 @@ class TkAsyncApplication:
         )
         self.thread_unsafe_loop = asyncio.get_event_loop()
         self.thread_unsafe_tk = None
+        self._sweeper_task = None
+        self._metrics_task = None
+        self.profiler = None
+        self.watchdog = None
+        self._started_at = None
+        self._startup_phases = set()
         self._is_tk_setup = False
-        self._shutdown = False
+
+        # self-pipe that wakes up the tk thread, written to whenever there's
+        # a new message for it (or a signal arrived), so tk can sleep
+        # until there's something to do. a socket pair and not os.pipe, as
+        # signal.set_wakeup_fd only takes sockets on windows
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._wakeup_pending = False
+        self._drain_scheduled = False
+        self.message_metrics = MessageQueueMetrics()
         app_context_var.set(self)
 
     def tk_emit(self, tk_event: TkEvent):
-        if tk_event != TkEvent.NOTHING:
-            log.debug("tk emit %s", tk_event)
-        if self.thread_unsafe_tk:
-            self.thread_unsafe_tk.event_generate(tk_event.value, when="tail")
-        else:
-            # if calling into the async thread as part of UI startup,
-            # simply process stuff directly. whats a lock
-            self.process_tk_message()
+        log.debug("tk emit %s", tk_event)
+        self.thread_unsafe_tk.event_generate(tk_event.value, when="tail")
 
     def on_new_message_for_tk(self):
-        self.tk_emit(TkEvent.NEW_MESSAGE)
+        # messages are put in the queue before we're called, so if a wakeup
+        # is already pending, the tk thread is going to see this message
+        if self._wakeup_pending:
+            return
+        self._wakeup_pending = True
+        try:
+            self._wakeup_writer.send(b"\0")
+        except BlockingIOError:
+            # pipe is full, tk is going to wake up anyways
+            pass
+        except OSError:
+            # closed once tk stopped, there's nobody left to wake up
+            pass
+
+    def _on_wakeup(self, *_args):
+        try:
+            while self._wakeup_reader.recv(512):
+                pass
+        except BlockingIOError:
+            pass
+
+        # must be cleared before processing, so that messages coming in
+        # while we're processing issue another wakeup
+        self._wakeup_pending = False
+        self.process_tk_message()
+
+    def _poll_wakeup(self):
+        self._on_wakeup()
+        self.thread_unsafe_tk.after(WAKEUP_POLL_INTERVAL_MS, self._poll_wakeup)
+
+    def _on_signal(self, signum, _frame):
+        log.info("got signal %d", signum)
+        self.quit()
 
     def process_tk_message(self, *args, **kwargs):
-        # consume all messages and call relevant callbacks
-        # in the main thread
+        """Consume messages and call relevant callbacks in the main thread.
+
+        Only runs for MESSAGE_SLICE_BUDGET, and if there are still messages
+        after that, continues once tk had the chance to redraw and handle
+        input, so that a burst of messages can't freeze the UI."""
+        self._drain_scheduled = False
+        slice_start = time.monotonic()
+        deadline = slice_start + MESSAGE_SLICE_BUDGET
+
         while True:
             try:
-                call_info = self.task.sync_queue.get_nowait()
+                call_info = self.task.get_sync_message()
             except queue.Empty:
                 break
             try:
-                log.debug(
-                    "message: func=%r args=%r", call_info[0].__name__, call_info[1:]
-                )
-                func, args = call_info
-                func(*args)
-                self.task.sync_queue.task_done()
+                _priority, _sequence, mailbox, data = call_info
+                log.debug("message: func=%r data=%r", mailbox.function.__name__, data)
+                mailbox.deliver(data)
             except Exception:
                 log.exception("failed to process message %r", call_info)
+            finally:
+                self.task.sync_queue.task_done()
+                self.message_metrics.processed += 1
+
+            if time.monotonic() >= deadline:
+                if not self.task.sync_queue.empty():
+                    self.message_metrics.yielded_slices += 1
+                    self._schedule_drain()
+                break
+
+        slice_time = time.monotonic() - slice_start
+        REGISTRY.histogram(
+            "tk_message_slice_seconds", "time process_tk_message runs for"
+        ).record(slice_time)
+        self.message_metrics.slices += 1
+        self.message_metrics.last_slice_seconds = slice_time
+        self.message_metrics.max_slice_seconds = max(
+            self.message_metrics.max_slice_seconds, slice_time
+        )
+
+    def _schedule_drain(self):
+        if self._drain_scheduled:
+            return
+        self._drain_scheduled = True
+        self.thread_unsafe_tk.after_idle(self.process_tk_message)
+
+    def message_queue_metrics(self) -> Dict[str, Any]:
+        return {
+            **dataclasses.asdict(self.message_metrics),
+            "depth": {
+                priority.name.lower(): depth
+                for priority, depth in self.task.sync_queue_depths().items()
+            },
+        }
 
     def tk_bind(self, tk_event: TkEvent, *args, **kwargs):
         # TODO maybe use contextvars to assert tk_bind() is called from
@@ -75,12 +189,53 @@ class TkAsyncApplication:
     def quit(self, *args, **kwargs):
         self.thread_unsafe_tk.destroy()
 
+    def mark_startup(self, phase: str):
+        """Record how long it took since startup to get somewhere, only
+        the first time it's gotten to."""
+        if phase in self._startup_phases or self._started_at is None:
+            return
+        self._startup_phases.add(phase)
+        seconds = time.monotonic() - self._started_at
+        REGISTRY.gauge(
+            "startup_seconds", "time from startup to each phase", phase=phase
+        ).set(seconds)
+        log.info("startup: %s after %.3fs", phase, seconds)
+
+    def profile_label(self) -> str:
+        """Added to the name of profile files, like the size of what's
+        being profiled."""
+        return ""
+
     def start_tk(self, ctx):
         self.thread_unsafe_tk = self.setup_tk(ctx)
+        self.mark_startup("setup_tk")
         self.tk_bind(TkEvent.QUIT, self.quit)
-        self.tk_bind(TkEvent.NEW_MESSAGE, self.process_tk_message)
+
+        # signal handlers only run once the main thread runs python code,
+        # so make signals wake tk up through the same pipe as messages
+        signal.set_wakeup_fd(self._wakeup_writer.fileno())
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGTERM, self._on_signal)
+
+        watches_files = hasattr(self.thread_unsafe_tk.tk, "createfilehandler")
+        if watches_files:
+            self.thread_unsafe_tk.tk.createfilehandler(
+                self._wakeup_reader.fileno(), tk.READABLE, self._on_wakeup
+            )
+        else:
+            self._poll_wakeup()
+
         self._is_tk_setup = True
-        self.thread_unsafe_tk.mainloop()
+        self.watchdog.watch_tk(self.thread_unsafe_tk)
+        self.thread_unsafe_tk.after_idle(self.mark_startup, "first_idle")
+        try:
+            self.thread_unsafe_tk.mainloop()
+        finally:
+            signal.set_wakeup_fd(-1)
+            if watches_files:
+                self.thread_unsafe_tk.tk.deletefilehandler(self._wakeup_reader.fileno())
+            self._wakeup_reader.close()
+            self._wakeup_writer.close()
         log.info("tk stopped")
 
     def _handle_asyncio_exception(self, _loop, context):
@@ -88,47 +243,74 @@ class TkAsyncApplication:
 
     def start_asyncio(self, ctx):
         self.thread_unsafe_loop.set_exception_handler(self._handle_asyncio_exception)
+        self._sweeper_task = self.thread_unsafe_loop.create_task(
+            self.task.sweep_forever()
+        )
+        config = ctx.config
+        if config.metrics_dump:
+            self._metrics_task = self.thread_unsafe_loop.create_task(
+                write_metrics_forever(config.metrics_dump, config.metrics_dump_interval)
+            )
+        self.watchdog.watch_asyncio(self.thread_unsafe_loop)
         log.info("asyncio run_forever")
         self.thread_unsafe_loop.run_forever()
         log.info("asyncio stopped")
 
-    async def _shutdown_asyncio(self):
-        log.info("shutting down asyncio...")
-        loop = self.thread_unsafe_loop
+    async def flush_writes(self):
+        """Wait for writes asked for before shutdown."""
 
-        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+    async def checkpoint(self):
+        """Make what was written so far stick."""
 
-        try:
-            async with asyncio.timeout(30):
-                await asyncio.gather(*tasks, return_exceptions=True)
-        except TimeoutError:
-            log.warning("took longer than 30 seconds to shutdown, forcing shutdown")
+    async def close_connections(self):
+        pass
 
-        log.debug("%d tasks", len(tasks))
-        [task.cancel() for task in tasks]
+    async def _cancel_calls(self):
+        tasks = self.task.cancel_calls()
+        if tasks:
+            log.info("cancelling %d calls", len(tasks))
+            await asyncio.gather(*tasks, return_exceptions=True)
 
-        log.info("Cancelling %d outstanding tasks...", len(tasks))
+    async def _cancel_tasks(self):
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        if tasks:
+            log.info("cancelling %d outstanding tasks", len(tasks))
+        for task in tasks:
+            task.cancel()
         await asyncio.gather(*tasks, return_exceptions=True)
-        loop.call_soon_threadsafe(loop.stop)
-        # loop.stop()
 
-    def tick_tk_every_second(self):
-        """This thread makes tk check itself every 200ms.
-
-        It is a hack to make CTRL-Cs work when the window is unfocused.
-
-        The NOTHING TkEvent exists only for that purpose.
-        """
-        while True:
-            if self._shutdown:
-                break
+    async def _shutdown_phase(self, phase: str, coro):
+        deadline = SHUTDOWN_DEADLINES[phase]
+        start = time.monotonic()
+        try:
+            async with asyncio.timeout(deadline):
+                await coro
+        except TimeoutError:
+            log.warning("shutdown: %s took over %.1fs, moving on", phase, deadline)
+        except Exception:
+            log.exception("shutdown: %s failed", phase)
+        seconds = time.monotonic() - start
+        REGISTRY.gauge(
+            "shutdown_seconds", "time each shutdown phase took", phase=phase
+        ).set(seconds)
+        log.info("shutdown: %s took %.3fs", phase, seconds)
 
-            if self.thread_unsafe_tk:
-                self.tk_emit(TkEvent.NOTHING)
-                time.sleep(0.2)
-            else:
-                time.sleep(1)
-        log.info("tk ticker stopped")
+    async def _shutdown_asyncio(self):
+        """Stop generation streams and everything else the tk thread was
+        waiting on, then let writes through before closing anything."""
+        log.info("shutting down asyncio...")
+        loop = self.thread_unsafe_loop
+        # these run forever, don't wait on them
+        for task in (self._sweeper_task, self._metrics_task):
+            if task:
+                task.cancel()
+
+        await self._shutdown_phase("cancel_calls", self._cancel_calls())
+        await self._shutdown_phase("flush_writes", self.flush_writes())
+        await self._shutdown_phase("checkpoint", self.checkpoint())
+        await self._shutdown_phase("close_connections", self.close_connections())
+        await self._shutdown_phase("cancel_tasks", self._cancel_tasks())
+        loop.call_soon_threadsafe(loop.stop)
 
     def _start(self, ctx):
         # can't run tk in separate thread, from
@@ -141,19 +323,27 @@ class TkAsyncApplication:
         # the _tkinter module attempts to gain control of the main
         # thread via a polling technique when processing calls from other threads.
 
+        self._started_at = IMPORT_STARTED_AT
+        self.mark_startup("imports")
+        self.watchdog = StallWatchdog(ctx.config.stall_threshold)
+        self.profiler = Profiler(
+            self.thread_unsafe_loop, ctx.config.profile_dir, self.profile_label
+        )
+        if ctx.config.profile:
+            self.profiler.start(ctx.config.profile)
+        if ctx.config.memory_trace:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+
         threads = [
             threading.Thread(
                 target=self.__class__.start_asyncio, args=[self, ctx], name="asyncio"
             ),
-            threading.Thread(
-                target=self.__class__.tick_tk_every_second,
-                args=[self],
-                name="tk_ticker",
-            ),
         ]
         try:
             for thread in threads:
                 thread.start()
+            self.mark_startup("asyncio_thread")
+            self.watchdog.start()
 
             self.__class__.start_tk(self, ctx)
         except KeyboardInterrupt:
@@ -161,24 +351,22 @@ class TkAsyncApplication:
         except:
             log.exception("failed")
         finally:
-            self._shutdown = True
-            shutdown_callback = getattr(self, "shutdown", None)
-            if shutdown_callback:
-                shutdown_callback()
+            # tk isn't beating anymore, that's not a stall
+            self.watchdog.stop()
+            # before the loop stops, it still has to write its profile
+            self.profiler.stop()
             asyncio.run_coroutine_threadsafe(
                 self._shutdown_asyncio(), self.thread_unsafe_loop
             )
 
         log.debug("running threads:")
-        frames = sys._current_frames()
-
         for thread in threading.enumerate():
-            stack = frames.get(thread.ident)
+            stack = format_thread_stack(thread.ident)
             if stack:
                 log.debug("%s", thread.name)
 
                 if os.environ.get("DEBUG"):
-                    log.debug("stack: %s", "".join(traceback.format_stack(stack)))
+                    log.debug("stack: %s", stack)
             else:
                 log.debug("%s - No stack", thread.name)
 
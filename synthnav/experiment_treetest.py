@@ -1,4 +1,3 @@
-import random
 import os
 import math
 import enum
@@ -10,17 +9,24 @@ import lorem
 import tkinter as tk
 from pathlib import Path
 from tkinter import filedialog
-from typing import List, Tuple, Optional
+from typing import Dict, List, Set, Tuple, Optional
 from tkinter import ttk
 from uuid import UUID, uuid4 as new_uuid
 from idlelib.tooltip import Hovertip
 from .experiment_asyncio import TkAsyncApplication
-from .config import GenerationSettings, SettingsView
-from .generate import text_generator_process
+from .generate import GENERATION_RETRIES, GENERATION_TIMEOUT, text_generator_process
 from .util.widgets import CustomText
 from .context import app
 from .database import Database
+from .search import SearchView
+from .metrics_view import MetricsView
+from .memory import MemoryMonitor, MemoryReport
+from .tinytask import Priority, TaskFailed
 from .generation import GenerationState, Generation
+from .store import NO_INDEX, GenerationStore, StoredGeneration, TreeStats
+from .layout import NODE_X_SPACING, layout_tree
+from .metrics import REGISTRY, timed
+from .profiling import ProfileMode
 
 log = logging.getLogger(__name__)
 
@@ -50,40 +56,54 @@ def _canvas_xy_scroll_pixels_hackish_method(canvas, new_x, new_y):
     ) = previous_increment
 
 
-import time
-
-
-def timerlog(log_title: str):
-    def wrapper(function):
-        def wrapper_wrapper(*args, **kwargs):
-            start_timestamp = time.monotonic()
-            val = function(*args, **kwargs)
-            end_timestamp = time.monotonic()
-            total_spent = round(end_timestamp - start_timestamp, 5) * 1000
-            log.info("%s spent %.2fms", log_title, total_spent)
-            return val
-
-        return wrapper_wrapper
-
-    return wrapper
-
-
 class UIMockup(TkAsyncApplication):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, *kwargs)
         self.db = Database()
 
-    def shutdown(self):
-        self.task.cast(self.db.close())
+    async def flush_writes(self):
+        await self.db.flush()
+
+    async def checkpoint(self):
+        """Save changes to the story file it was opened from or saved to,
+        a story that never was has nowhere to keep them."""
+        if not self.db.db:
+            return
+        if not self.db.unsaved_changes:
+            await self.db.commit()
+        elif self.db.path:
+            await self.db.save()
+        else:
+            log.warning("the story was never saved, its changes are lost")
+            await self.db.commit()
+
+    async def close_connections(self):
+        await self.db.close()
 
     def setup_tk(self, ctx) -> tk.Tk:
+        self.db.codec = ctx.config.storage_codec
         self.task.cast(self.db.init())
         return RealUIWindow(ctx)
 
+    def profile_label(self) -> str:
+        if self.thread_unsafe_tk is None:
+            return ""
+        return f"{len(self.thread_unsafe_tk._generations)}gen"
+
 
 ADD_BUTTON_TEXT = "\N{HEAVY PLUS SIGN}"
 EDIT_BUTTON_TEXT = "\N{PENCIL}"
 SERIALIZE_BUTTON_TEXT = "|"
+FOLD_BUTTON_TEXT = "\N{BLACK DOWN-POINTING SMALL TRIANGLE}"
+UNFOLD_BUTTON_TEXT = "\N{BLACK RIGHT-POINTING SMALL TRIANGLE}"
+FLASH_DURATION_MS = 800
+
+# how much of its first child's text a folded subtree shows
+FOLDED_PREVIEW_LENGTH = 80
+
+# below these zoom levels, generation text isn't shown
+SOFT_HIDE_SCROLL_RATIO = 0.4
+FULL_HIDE_SCROLL_RATIO = 0.1
 
 
 class SingleGenerationView(tk.Frame):
@@ -97,6 +117,8 @@ class SingleGenerationView(tk.Frame):
         self.tree_view = tree_view
         self.parent_widget = parent_widget
         self.generation = generation
+        # streamed text that isn't on the widget yet, as it's not visible
+        self.pending_ui_chunks: List[str] = []
 
     def create_widgets(self):
         self.to_editable()
@@ -116,11 +138,24 @@ class SingleGenerationView(tk.Frame):
         )
         self.serialize_tip = Hovertip(self.serialize_button, "Serialize path into text")
 
+        self.fold_button = tk.Button(
+            self.buttons, text=self.fold_button_text, command=self.on_wanted_fold
+        )
+        self.fold_tip = Hovertip(self.fold_button, "Fold or unfold children")
+
         self.text_widget.grid(row=0, column=0)
         self.buttons.grid(row=0, column=1)
         self.edit_button.grid(row=0, column=1, sticky="w")
         self.add_button.grid(row=1, column=1, sticky="w")
         self.serialize_button.grid(row=2, column=1, sticky="w")
+        if self.generation.children:
+            self.fold_button.grid(row=3, column=1, sticky="w")
+
+    @property
+    def fold_button_text(self) -> str:
+        if self.generation.collapsed:
+            return UNFOLD_BUTTON_TEXT
+        return FOLD_BUTTON_TEXT
 
     def add_child(self, text):
         return self.tree_view.controller.add_child(self.generation.id, text)
@@ -131,6 +166,12 @@ class SingleGenerationView(tk.Frame):
         #
         # so, strip off only the last newline character from textbox_text
         # as users may want to actually submit 30 newlines.
+        #
+        # projected generations only have their preview on the textbox,
+        # which must never overwrite the full text
+        if self.generation.is_projected:
+            return
+
         textbox_text = self.text_widget.get("1.0", "end")
 
         if textbox_text:
@@ -138,7 +179,8 @@ class SingleGenerationView(tk.Frame):
                 textbox_text = textbox_text[:-1]
 
             self.generation.text = textbox_text
-            app.task.cast(app.db.update_generation(self.generation))
+            app.task.cast(app.db.update_generation(self.generation.snapshot()))
+            self.tree_view.controller.update_stats()
 
     def on_wanted_add(self):
         self.submit_text_to_generation()
@@ -150,6 +192,11 @@ class SingleGenerationView(tk.Frame):
     def on_wanted_serialize(self):
         self.tree_view.controller.serialize_from(self.generation.id)
 
+    def on_wanted_fold(self):
+        self.tree_view.controller.set_collapsed(
+            self.generation.id, not self.generation.collapsed
+        )
+
     def configure_ui(self):
         self.on_any_zoom(self.tree_view.scroll_ratio)
         self.on_state_change()
@@ -167,7 +214,9 @@ class SingleGenerationView(tk.Frame):
             self.text_widget.destroy()
 
         self.text_widget = CustomText(self, width=40, height=5, auto_select=True)
-        self.text_widget.insert(tk.INSERT, self.generation.text)
+        self.text_widget.insert(tk.INSERT, self.generation.display_text)
+        # display_text already has everything streamed so far
+        self.pending_ui_chunks = []
         self.text_widget.grid(row=0, column=0)
 
         log.debug(
@@ -186,6 +235,15 @@ class SingleGenerationView(tk.Frame):
     def on_wanted_edit(self):
         match self.generation.state:
             case GenerationState.GENERATED:
+                if self.generation.is_projected:
+                    # can only edit once we have the entire text
+                    app.task.call(
+                        app.db.get_text,
+                        self._on_fetched_full_text,
+                        args=[self.generation.id],
+                    )
+                    return
+
                 self.generation.state = GenerationState.EDITING
                 self.to_editable(destroy=True, focus=True)
                 self.on_any_zoom(self.tree_view.scroll_ratio)
@@ -193,7 +251,17 @@ class SingleGenerationView(tk.Frame):
             case GenerationState.EDITING | GenerationState.PENDING:
                 pass
 
+    def _on_fetched_full_text(self, _reply_id, text: str):
+        if isinstance(text, TaskFailed):
+            self.text_widget.winfo_toplevel().report_task_failure("fetching text", text)
+            return
+        self.generation.text = text
+        self.on_wanted_edit()
+
     def _for_all_children(self, callback):
+        if self.generation.collapsed:
+            # children of folded generations have no views
+            return
         for child_id in self.generation.children:
             callback(self.tree_view.single_generation_views[child_id])
 
@@ -202,6 +270,26 @@ class SingleGenerationView(tk.Frame):
         self.text_widget.insert(tk.END, text_to_append)
         self.text_widget.configure(state="disabled")
 
+    def sync_ui_text(self) -> None:
+        """Put streamed text that was held back on the widget."""
+        if not self.pending_ui_chunks:
+            return
+        text = "".join(self.pending_ui_chunks)
+        self.pending_ui_chunks = []
+        self.append_ui_text(text)
+
+    def flash(self):
+        """Highlight the generation for a moment, so it's easy to spot."""
+        text_widget = self.text_widget
+        previous_background = text_widget["bg"]
+        text_widget.config(bg="gold4")
+
+        def unflash():
+            if text_widget.winfo_exists():
+                text_widget.config(bg=previous_background)
+
+        text_widget.after(FLASH_DURATION_MS, unflash)
+
     def soft_hide(self):
         self.text_widget.configure(width=0, height=0)
         for button in self.buttons.winfo_children():
@@ -216,6 +304,7 @@ class SingleGenerationView(tk.Frame):
         self.edit_button.config(text=EDIT_BUTTON_TEXT)
         self.add_button.config(text=ADD_BUTTON_TEXT)
         self.serialize_button.config(text=SERIALIZE_BUTTON_TEXT)
+        self.fold_button.config(text=self.fold_button_text)
         self.buttons.grid(row=0, column=1)
 
     def on_any_zoom(self, new_scroll_ratio):
@@ -229,10 +318,10 @@ class SingleGenerationView(tk.Frame):
                 )
             )
 
-            if new_scroll_ratio < 0.1:
+            if new_scroll_ratio < FULL_HIDE_SCROLL_RATIO:
                 self.full_hide()
                 return
-            elif new_scroll_ratio < 0.4:
+            elif new_scroll_ratio < SOFT_HIDE_SCROLL_RATIO:
                 self.soft_hide()
                 return
             else:
@@ -246,6 +335,38 @@ class SingleGenerationView(tk.Frame):
                 button.config(font=("Arial", new_font_size))
 
 
+class FoldedSubtreeView(tk.Frame):
+    """Stands in for all the descendants of a folded generation."""
+
+    def __init__(self, parent_widget, tree_view, generation: Generation):
+        super().__init__(parent_widget)
+        self.tree_view = tree_view
+        self.generation = generation
+
+    def create_widgets(self):
+        descendants = self.generation.subtree_size - 1
+        first_child = self.tree_view.controller.generation_map[
+            self.generation.children[0]
+        ]
+        preview = first_child.display_text[:FOLDED_PREVIEW_LENGTH].replace("\n", " ")
+
+        self.label = tk.Label(
+            self,
+            text=f"{descendants} generations folded\n{preview}",
+            width=40,
+            justify="left",
+            anchor="w",
+            bg="gray30",
+            fg="white",
+        )
+        self.label.bind("<Button-1>", self.on_wanted_unfold)
+        self.label.grid(row=0, column=0)
+        self.tip = Hovertip(self.label, "Click to unfold")
+
+    def on_wanted_unfold(self, _event=None):
+        self.tree_view.controller.set_collapsed(self.generation.id, False)
+
+
 class GenerationTreeView:
     def __init__(self, parent_widget, root_generation):
         self.scroll_ratio = 1
@@ -254,6 +375,11 @@ class GenerationTreeView:
         self.root_generation_view = None
         self.controller = None
         self.single_generation_views = {}
+        # visibility of generations in the current viewport and zoom,
+        # filled in as they're asked about
+        self._visibility: Dict[UUID, bool] = {}
+        # generations with streamed text that isn't on their widget yet
+        self._views_behind: Set[UUID] = set()
 
     def create_widgets(self):
         self.scroll_ratio = 1
@@ -263,8 +389,8 @@ class GenerationTreeView:
             self.parent_widget,
             width=750,
             height=550,
-            yscrollcommand=self.vertical_bar.set,
-            xscrollcommand=self.horizontal_bar.set,
+            yscrollcommand=self._on_y_view_change,
+            xscrollcommand=self._on_x_view_change,
         )
         self.horizontal_bar["command"] = self.canvas.xview
         self.vertical_bar["command"] = self.canvas.yview
@@ -274,65 +400,64 @@ class GenerationTreeView:
         self, generation: Generation, x=50, y=50
     ) -> Tuple[SingleGenerationView, int]:
         """Draw a generation and its children into the tree canvas,
-        recursively, starting at given x and y values."""
-        single_generation_view = SingleGenerationView(self.canvas, self, generation)
-        self.single_generation_views[generation.id] = single_generation_view
-        single_generation_view.create_widgets()
-
-        identstr = "\t" * int(x / 400)
-        log.debug("%s %s %d %d", identstr, generation.id, x, y)
-        canvas_object_id = self.canvas.create_window(
-            x, y, anchor="nw", window=single_generation_view
-        )
-        single_generation_view.canvas_object_id = canvas_object_id
-        node_coords = self.canvas.coords(canvas_object_id)
-
-        # TODO winfo_height() is not working, not even with update()
-        # sprinkled around stuff. use 160 for now
-        current_node_height = 160
-
-        if not (generation.children):
-            complete_node_height = current_node_height
-        else:
-            complete_node_height = 0
-
-        for index, child_id in enumerate(generation.children):
-            child_generation = self.controller.generation_map[child_id]
-            child_view, child_height = self.draw(
-                child_generation,
-                x=x + 400,
-                y=y,
+        starting at given x and y values."""
+        store = self.controller.generation_map
+        with REGISTRY.histogram(
+            "ui_layout_seconds", "time placing generations on the canvas takes"
+        ).time():
+            placements, total_height = layout_tree(
+                store, store.indices[generation.id], x=x, y=y
             )
-            y += child_height
-            child_coords = self.canvas.coords(child_view.canvas_object_id)
-            child_view.parent_line_canvas_id = self.canvas.create_line(
-                node_coords[0] + 150,
-                node_coords[1],
-                *child_coords,
-                fill="green",
-                width=3,
+        log.debug("drawing %d generations", len(placements))
+
+        for placement in placements:
+            node = StoredGeneration(store, placement.index)
+            single_generation_view = SingleGenerationView(self.canvas, self, node)
+            self.single_generation_views[node.id] = single_generation_view
+            single_generation_view.create_widgets()
+            single_generation_view.canvas_object_id = self.canvas.create_window(
+                placement.x, placement.y, anchor="nw", window=single_generation_view
             )
-            complete_node_height += child_height
 
-            log.debug(
-                "%s |-> %s height=%d",
-                identstr,
-                child_id,
-                child_height,
-            )
-            log.debug(
-                "%s     (line x1=%d,y1=%d -> x2=%d,y2=%d)",
-                identstr,
-                node_coords[0] + 150,
-                node_coords[1],
-                child_coords[0],
-                child_coords[1],
-            )
+            if placement.parent_index != NO_INDEX:
+                parent_view = self.single_generation_views[
+                    store.ids[placement.parent_index]
+                ]
+                parent_x, parent_y = self.canvas.coords(parent_view.canvas_object_id)
+                single_generation_view.parent_line_canvas_id = self.canvas.create_line(
+                    parent_x + 150,
+                    parent_y,
+                    placement.x,
+                    placement.y,
+                    fill="green",
+                    width=3,
+                )
 
-        single_generation_view.configure_ui()
-        return single_generation_view, complete_node_height
+            if placement.folded:
+                # none of the descendants get widgets
+                folded_view = FoldedSubtreeView(self.canvas, self, node)
+                folded_view.create_widgets()
+                self.canvas.create_window(
+                    placement.x + NODE_X_SPACING,
+                    placement.y,
+                    anchor="nw",
+                    window=folded_view,
+                )
+                self.canvas.create_line(
+                    placement.x + 150,
+                    placement.y,
+                    placement.x + NODE_X_SPACING,
+                    placement.y,
+                    fill="gray",
+                    width=3,
+                    dash=(4, 4),
+                )
 
-    @timerlog("tree.redraw")
+        root_view = self.single_generation_views[generation.id]
+        root_view.configure_ui()
+        return root_view, total_height
+
+    @timed("ui_redraw_seconds", "time redrawing the whole tree takes")
     def redraw(self):
         old_cursor_x, old_cursor_y = self.canvas.canvasx(0), self.canvas.canvasy(0)
         old_scroll_ratio = self.scroll_ratio
@@ -344,6 +469,9 @@ class GenerationTreeView:
 
         # refresh the entire tree
         self.canvas.delete("all")
+        # new widgets are made from the whole text
+        self._views_behind.clear()
+        self._visibility.clear()
 
         # create it all
         self.create_widgets()
@@ -374,6 +502,49 @@ class GenerationTreeView:
     def on_any_zoom(self):
         self.canvas.configure(scrollregion=self.canvas.bbox("all"))
         self.root_generation_view.on_any_zoom(self.scroll_ratio)
+        self.on_viewport_change()
+
+    def _on_x_view_change(self, *args):
+        # tk calls this whenever the view moves, however it was moved
+        self.horizontal_bar.set(*args)
+        self.on_viewport_change()
+
+    def _on_y_view_change(self, *args):
+        self.vertical_bar.set(*args)
+        self.on_viewport_change()
+
+    def on_viewport_change(self):
+        self._visibility.clear()
+        for generation_id in list(self._views_behind):
+            if self.is_visible(generation_id):
+                self._sync_view(generation_id)
+
+    def is_visible(self, generation_id: UUID) -> bool:
+        visible = self._visibility.get(generation_id)
+        if visible is None:
+            visible = self._visibility[generation_id] = self._compute_visibility(
+                self.single_generation_views[generation_id]
+            )
+        return visible
+
+    def _compute_visibility(self, view: SingleGenerationView) -> bool:
+        if self.scroll_ratio < SOFT_HIDE_SCROLL_RATIO:
+            return False
+        bbox = self.canvas.bbox(view.canvas_object_id)
+        if not bbox:
+            return False
+
+        left, top = self.canvas.canvasx(0), self.canvas.canvasy(0)
+        right = left + self.canvas.winfo_width()
+        bottom = top + self.canvas.winfo_height()
+        x1, y1, x2, y2 = bbox
+        return x1 < right and x2 > left and y1 < bottom and y2 > top
+
+    def _sync_view(self, generation_id: UUID):
+        self._views_behind.discard(generation_id)
+        view = self.single_generation_views.get(generation_id)
+        if view:
+            view.sync_ui_text()
 
     def on_y_scroll_up(self, event):
         self.canvas.yview_scroll(-1, "units")
@@ -398,20 +569,58 @@ class GenerationTreeView:
         self.on_any_zoom()
 
     def on_incoming_token(self, generation_id, text):
-        self.single_generation_views[generation_id].append_ui_text(text)
+        view = self.single_generation_views.get(generation_id)
+        if view is None:
+            # inside a folded subtree
+            return
+        if self.is_visible(generation_id):
+            view.append_ui_text(text)
+        else:
+            # the model already has it, the widget catches up once seen
+            view.pending_ui_chunks.append(text)
+            self._views_behind.add(generation_id)
+
+    def on_finished_tokens(self, generation_id):
+        self._sync_view(generation_id)
+
+    def scroll_to(self, generation_id: UUID):
+        """Scroll the canvas so that the given generation is in view,
+        unfolding whatever it's in."""
+        if generation_id not in self.single_generation_views:
+            self.controller.unfold_ancestors(generation_id)
+        view = self.single_generation_views[generation_id]
+        x, y = self.canvas.coords(view.canvas_object_id)
+        region_x1, region_y1, region_x2, region_y2 = self.canvas.bbox("all")
+
+        # leave some margin so the node isn't glued to the corner
+        self.canvas.xview_moveto(max(x - region_x1 - 50, 0) / (region_x2 - region_x1))
+        self.canvas.yview_moveto(max(y - region_y1 - 50, 0) / (region_y2 - region_y1))
+        view.flash()
 
 
 class GenerationTreeController:
     def __init__(
-        self, window, root_generation: Generation, tree_view: GenerationTreeView
+        self,
+        window,
+        root_generation: Generation,
+        tree_view: GenerationTreeView,
+        store: Optional[GenerationStore] = None,
     ):
         self.window = window
-        self.root_generation = root_generation
         self.tree_view = tree_view
         self.database_path = None
-        self.generation_map = {root_generation.id: root_generation}
-
-    def prompt_from(self, node_id: str) -> None:
+        if store is None:
+            store = GenerationStore()
+            store.add(root_generation)
+        self.generation_map = store
+        # the view must draw from the store, not the generation it was given
+        self.root_generation = store[root_generation.id]
+        if tree_view:
+            tree_view.root_generation = self.root_generation
+
+    def prompt_from(self, node_id: str, texts: Optional[Dict[UUID, str]] = None) -> str:
+        """Build the prompt for a path in the tree. Projected generations
+        must have their full text given in texts."""
         current_node = node_id
         lines = []
 
@@ -419,10 +628,41 @@ class GenerationTreeController:
             if current_node is None:
                 break
             generation = self.generation_map[current_node]
-            lines.append(generation.text.strip())
+            if generation.is_projected:
+                text = texts[generation.id]
+            else:
+                text = generation.text
+            lines.append(text.strip())
             current_node = generation.parent
         return "".join(reversed(lines))
 
+    def with_prompt_from(self, node_id: str, callback) -> None:
+        """Call callback with the prompt for a path in the tree, fetching
+        the full text of projected generations from the db beforehand."""
+        projected_ids = []
+        current_node = node_id
+        while current_node is not None:
+            generation = self.generation_map[current_node]
+            if generation.is_projected:
+                projected_ids.append(generation.id)
+            current_node = generation.parent
+
+        if not projected_ids:
+            callback(self.prompt_from(node_id))
+            return
+
+        app.task.call(
+            app.db.get_texts,
+            functools.partial(self._on_fetched_prompt_texts, node_id, callback),
+            args=[projected_ids],
+        )
+
+    def _on_fetched_prompt_texts(self, node_id: str, callback, _reply_id, texts):
+        if isinstance(texts, TaskFailed):
+            self.window.report_task_failure("fetching prompt", texts)
+            return
+        callback(self.prompt_from(node_id, texts))
+
     def add_child(
         self,
         parent_node_id: str,
@@ -430,64 +670,113 @@ class GenerationTreeController:
         *,
         view_only: bool = False,
     ) -> "Generation":
-        new_child = Generation(
-            id=new_uuid(),
-            state=GenerationState.PENDING,
-            text=text,
-            parent=parent_node_id,
+        parent = self.generation_map[parent_node_id]
+        if parent.collapsed:
+            # the new child must be seen
+            parent.collapsed = False
+            app.task.cast(app.db.set_collapsed(parent.id, False))
+
+        new_child = self.generation_map.add(
+            Generation(
+                id=new_uuid(),
+                state=GenerationState.PENDING,
+                text=text or "",
+                parent=parent_node_id,
+            )
         )
-        self.generation_map[new_child.id] = new_child
-        self.generation_map[parent_node_id].children.append(new_child.id)
         if self.tree_view:
             self.tree_view.redraw()
+        self.update_stats()
         if not text:
-            prompt = self.prompt_from(parent_node_id)
-            log.debug("creating child with prompt %r", prompt)
-
-            # as the child needs some text in it, spawn a task
-            # in the background that generates it
-            app.task.call(
-                text_generator_process,
-                self.on_text_generation_reply,
-                args=[self.window.ctx.config.generation_settings, prompt],
-                as_pid=new_child.id,
+            self.with_prompt_from(
+                parent_node_id,
+                functools.partial(self._start_text_generation, new_child.id),
             )
 
         else:
             new_child.state = GenerationState.GENERATED
 
         if not view_only:
-            app.task.cast(app.db.insert_generation(new_child))
+            app.task.cast(app.db.insert_generation(new_child.snapshot()))
 
         return new_child
 
+    def _start_text_generation(self, generation_id: UUID, prompt: str):
+        log.debug("creating child with prompt %r", prompt)
+
+        # as the child needs some text in it, spawn a task
+        # in the background that generates it
+        app.task.call(
+            text_generator_process,
+            self.on_text_generation_reply,
+            args=[self.window.ctx.config.generation_settings, prompt],
+            as_pid=generation_id,
+            priority=Priority.STREAM,
+            timeout=GENERATION_TIMEOUT,
+            retries=GENERATION_RETRIES,
+        )
+
     def on_text_generation_reply(self, generation_id, data: Tuple[str, str]):
-        match data[0]:
-            case "new_incoming_token":
-                self.incoming_data(generation_id, data[1])
-            case "finished_tokens":
+        match data:
+            case TaskFailed():
+                self.window.report_task_failure("generation", data)
+                # keep whatever text did come in, so the node can be edited
+                # or have children generated from it again
+                self.finished_tokens(generation_id)
+            case ("new_incoming_token", token):
+                self.incoming_data(generation_id, token)
+            case ("finished_tokens", _):
                 self.finished_tokens(generation_id)
             case _:
                 raise AssertionError("invalid generation event %r", data[0])
 
     def incoming_data(self, generation_id, data: str):
-        self.generation_map[generation_id].text = (
-            self.generation_map[generation_id].text + data
-        )
+        # only joined into its text once something needs the whole of it
+        self.generation_map[generation_id].append_text(data)
+        self.generation_map[generation_id].count_generated_token()
         self.tree_view.on_incoming_token(generation_id, data)
 
     def finished_tokens(self, generation_id: UUID):
         generation = self.generation_map[generation_id]
         generation.state = GenerationState.GENERATED
-        self.tree_view.single_generation_views[generation.id].on_state_change()
-        app.task.cast(app.db.update_generation(generation))
+        self.tree_view.on_finished_tokens(generation.id)
+        view = self.tree_view.single_generation_views.get(generation.id)
+        if view:
+            view.on_state_change()
+        app.task.cast(app.db.update_generation(generation.snapshot()))
+        self.update_stats()
+
+    def set_collapsed(self, generation_id: UUID, collapsed: bool):
+        self.generation_map[generation_id].collapsed = collapsed
+        app.task.cast(app.db.set_collapsed(generation_id, collapsed))
+        if self.tree_view:
+            self.tree_view.redraw()
+
+    def unfold_ancestors(self, generation_id: UUID):
+        unfolded_any = False
+        current_node = self.generation_map[generation_id].parent
+        while current_node is not None:
+            generation = self.generation_map[current_node]
+            if generation.collapsed:
+                generation.collapsed = False
+                app.task.cast(app.db.set_collapsed(generation.id, False))
+                unfolded_any = True
+            current_node = generation.parent
+
+        if unfolded_any and self.tree_view:
+            self.tree_view.redraw()
+
+    def update_stats(self):
+        self.window.show_stats(self.generation_map.stats())
 
     def start(self):
         self.tree_view.create_widgets()
         self.tree_view.configure_ui()
 
     def serialize_from(self, generation_id):
-        data = self.prompt_from(generation_id)
+        self.with_prompt_from(generation_id, self._print_serialized)
+
+    def _print_serialized(self, data: str):
         print("serialized form:")
         print(data)
 
@@ -501,12 +790,12 @@ class GenerationTreeController:
         assert filepath.exists()
         app.task.call(app.db.open_on, args=(filepath,), callback=self._on_opened_db)
 
-    def _on_opened_db(self, *args):
-        self.window._generations = {}
+    def _on_opened_db(self, _reply_id, data):
+        if isinstance(data, TaskFailed):
+            self.window.report_task_failure("opening file", data)
+            return
         self.window.root_generation = None
-        app.task.call(
-            app.db.fetch_all_generations, callback=self.window.on_database_loading_event
-        )
+        self.window.load_generations()
 
 
 class RealUIWindow(tk.Tk):
@@ -525,10 +814,25 @@ class RealUIWindow(tk.Tk):
         menu_file.add_command(label="New", command=self.on_wanted_new)
         menu_file.add_command(label="Open...", command=self.on_wanted_open)
         menu_file.add_command(label="Save", command=self.on_wanted_save)
+        menu_file.add_command(label="Import...", command=self.on_wanted_import)
+        menu_file.add_command(label="Export...", command=self.on_wanted_export)
         menu_file.add_command(label="Close", command=self.on_wanted_close)
 
         menu.add_cascade(menu=menu_file, label="File")
+
+        menu_profile = tk.Menu(menu)
+        for mode in ProfileMode:
+            menu_profile.add_command(
+                label=f"Start {mode.value} profiling",
+                command=functools.partial(self.on_wanted_profile, mode),
+            )
+        menu_profile.add_command(label="Stop profiling", command=self.on_wanted_profile)
+        menu.add_cascade(menu=menu_profile, label="Profile")
         menu.add_command(label="Settings", command=self.on_wanted_view_settings)
+        menu.add_command(label="Search", command=self.on_wanted_search)
+        menu.add_command(label="Metrics", command=self.on_wanted_metrics)
+        menu.add_command(label="Memory", command=self.on_wanted_memory)
+        self.bind("<Control-Key-f>", lambda _event: self.on_wanted_search())
 
         self.error_text_variable = tk.StringVar()
         self.error_text_variable.set("")
@@ -537,86 +841,99 @@ class RealUIWindow(tk.Tk):
         self.error_text.grid(row=2, column=0)
         self.error_text.configure(fg="red")
 
+        self.status_text_variable = tk.StringVar()
+        self.status_text = tk.Label(self, textvariable=self.status_text_variable)
+        self.status_text.grid(row=3, column=0, sticky="w")
+
+        self.stats_text_variable = tk.StringVar()
+        self.stats_text = tk.Label(self, textvariable=self.stats_text_variable)
+        self.stats_text.grid(row=4, column=0, sticky="w")
+
         self.root_generation = Generation(
             id=new_uuid(),
             state=GenerationState.EDITING,
             text=lorem.paragraph(),
             parent=None,
         )
-        app.task.cast(app.db.insert_generation(self.root_generation))
+        app.task.cast(app.db.insert_generation(self.root_generation.snapshot()))
 
         self.tree = None
-        self._generations = {}
+        self.search_view = None
+        self.metrics_view = None
+        self._generations = GenerationStore()
+        self.memory_monitor = MemoryMonitor(
+            self,
+            lambda: self._generations,
+            ctx.config.memory_budgets,
+            ctx.config.memory_report_interval,
+        )
+        self.memory_monitor.start()
 
+        # the window gets painted before anything starts loading, loading
+        # replies would otherwise hold up its first paint
         if ctx.config.mock and ctx.config.mock_node_amount:
-            self._insert_mocked_data()
+            self.after_idle(self._insert_mocked_data)
         else:
             # ask db to load generations, we can only start drawing once we
             # have the entire DAG loaded
-            app.task.call(
-                app.db.fetch_all_generations, reply=self.on_database_loading_event
-            )
+            self.after_idle(self.load_generations)
 
-    def _on_inserted_mock_generation(self, generation):
-        self._mocked_generations.append(generation)
+    def load_generations(self):
+        self._generations = GenerationStore(bulk=True)
+        app.task.call(
+            app.db.fetch_all_generations,
+            callback=self.on_database_loading_event,
+            kwargs={"preview_length": self.ctx.config.preview_length},
+            priority=Priority.BULK,
+        )
 
     def _insert_mocked_data(self):
-        self._mocked_generations = [self.root_generation]
-        self._mocked_wanted_amount = int(self.ctx.config.mock_node_amount)
-        for _ in range(self._mocked_wanted_amount):
-            random_parent = random.choice(self._mocked_generations)
-            child = Generation(
-                id=new_uuid(),
-                state=GenerationState.EDITING,
-                text=lorem.paragraph(),
-                parent=random_parent.id,
-            )
-            app.task.call(
-                app.db.insert_generation,
-                args=[child],
-                callback=lambda _a, _b: self._on_inserted_mock_generation(child),
-            )
-
-        assert len(app.task.callbacks) >= self._mocked_wanted_amount
+        from .synthetic import insert_story_process
 
-        # we don't provide an `app.task` facility for waiting on message
-        # replies because this is the only time i think we actually need this,
-        # on the mock generator function.
-        #
-        # if its needed somewhere else, remove this comment
-        while True:
-            # wait until all dbs have completed their tasks
-            if len(self._mocked_generations) >= self._mocked_wanted_amount:
-                break
-            time.sleep(0.1)
-
-        # everyone is loaded by now, fetch and do it
         app.task.call(
-            app.db.fetch_all_generations, callback=self.on_database_loading_event
+            insert_story_process,
+            self.on_mock_event,
+            args=[app.db, int(self.ctx.config.mock_node_amount)],
+            kwargs={"parent_id": self.root_generation.id},
+            priority=Priority.BULK,
         )
 
+    def on_mock_event(self, _reply_id, data):
+        if isinstance(data, TaskFailed):
+            self.status_text_variable.set("")
+            self.report_task_failure("generating mock story", data)
+            return
+
+        match data[0]:
+            case "progress":
+                inserted, total = data[1], data[2]
+                self.status_text_variable.set(
+                    f"generating mock story... {inserted}/{total} generations"
+                )
+            case "done":
+                self.status_text_variable.set("")
+                self.load_generations()
+            case _:
+                raise AssertionError(f"unexpected message type {data[0]}")
+
     def on_database_loading_event(self, _reply_id, data):
+        if isinstance(data, TaskFailed):
+            self.report_task_failure("loading story", data)
+            return
+
         match data[0]:
             case "generation":
-                generation = data[1]
-                self._generations[generation.id] = generation
-            case "parent":
-                parent_id, child_id = UUID(data[1]), UUID(data[2])
-                self._generations[parent_id].children.append(
-                    self._generations[child_id].id
-                )
-                self._generations[child_id].parent = parent_id
+                self._generations.add(data[1])
             case "done":
+                self._generations.finish_bulk_load()
                 # find out who is the root generation
-                possible_root_generations = [
-                    g for g in self._generations.values() if not g.parent
-                ]
+                possible_root_ids = self._generations.root_ids()
 
-                if len(possible_root_generations) != 1:
+                if len(possible_root_ids) != 1:
                     raise AssertionError(
-                        f"expected 1 root generation, got {len(possible_root_generations)}"
+                        f"expected 1 root generation, got {len(possible_root_ids)}"
                     )
-                self.root_generation = possible_root_generations[0]
+                self.root_generation = self._generations[possible_root_ids[0]]
 
                 # time to load UI!
                 self.on_all_loaded_generations()
@@ -631,17 +948,12 @@ class RealUIWindow(tk.Tk):
         log.info("all generations are loaded, drawing UI")
         self.tree = GenerationTreeView(self, self.root_generation)
         self.tree_controller = GenerationTreeController(
-            self, self.root_generation, None
+            self, self.root_generation, self.tree, store=self._generations
         )
         self.tree.controller = self.tree_controller
-        self.tree_controller.tree_view = self.tree
-
-        # take all generations we got and load them in the controller
-        # so the view can use them
-        for generation in self._generations.values():
-            self.tree_controller.generation_map[generation.id] = generation
-
         self.tree_controller.start()
+        self.tree_controller.update_stats()
+        app.mark_startup("story_drawn")
 
     def on_wanted_new(self):
         wanted_filename = filedialog.asksaveasfilename(
@@ -692,10 +1004,136 @@ class RealUIWindow(tk.Tk):
         else:
             app.task.cast(app.db.save())
 
+    def on_wanted_import(self):
+        wanted_filename = filedialog.askopenfilename(
+            defaultextension=".jsonl",
+            filetypes=(("story as json lines", "*.jsonl"),),
+        )
+
+        if not wanted_filename:
+            return
+
+        from .importer import import_process
+
+        app.task.call(
+            import_process,
+            self.on_import_event,
+            args=[app.db, Path(wanted_filename)],
+            priority=Priority.BULK,
+        )
+
+    def on_import_event(self, _reply_id, data):
+        if isinstance(data, TaskFailed):
+            self.status_text_variable.set("")
+            self.report_task_failure("import", data)
+            return
+
+        match data[0]:
+            case "progress":
+                imported, fraction = data[1], data[2]
+                self.status_text_variable.set(
+                    f"importing... {imported} generations ({fraction:.0%})"
+                )
+            case "done":
+                self.status_text_variable.set(f"imported {data[1]} generations")
+                self.root_generation = None
+                self.load_generations()
+            case "error":
+                self.status_text_variable.set("")
+                self.error_text_variable.set(f"import failed: {data[1]}")
+            case _:
+                raise AssertionError(f"unexpected message type {data[0]}")
+
+    def on_wanted_export(self):
+        wanted_filename = filedialog.asksaveasfilename(
+            defaultextension=".md",
+            filetypes=(
+                ("markdown outline of the whole story", "*.md"),
+                ("every path as plain text", "*.txt"),
+                ("whole story as json lines", "*.jsonl"),
+            ),
+        )
+
+        if not wanted_filename:
+            return
+
+        from .export import ExportFormat, export_process
+
+        filepath = Path(wanted_filename)
+        app.task.call(
+            export_process,
+            self.on_export_event,
+            args=[app.db, filepath, ExportFormat.from_path(filepath)],
+            priority=Priority.BULK,
+        )
+
+    def on_export_event(self, _reply_id, data):
+        if isinstance(data, TaskFailed):
+            self.status_text_variable.set("")
+            self.report_task_failure("export", data)
+            return
+
+        match data[0]:
+            case "progress":
+                written, total = data[1], data[2]
+                self.status_text_variable.set(f"exporting... {written}/{total}")
+            case "done":
+                self.status_text_variable.set(f"exported {data[1]} generations")
+            case _:
+                raise AssertionError(f"unexpected message type {data[0]}")
+
     def on_wanted_close(self):
         self.destroy()
 
+    def on_wanted_search(self):
+        if self.search_view and self.search_view.toplevel.winfo_exists():
+            self.search_view.toplevel.lift()
+            self.search_view.entry.focus_set()
+            return
+
+        self.search_view = SearchView(self)
+        self.search_view.create_widgets(self)
+        self.search_view.toplevel.transient(self)
+
+    def on_wanted_profile(self, mode: Optional[ProfileMode] = None):
+        app.profiler.stop()
+        if mode:
+            app.profiler.start(mode)
+            self.status_text_variable.set(f"{mode.value} profiling...")
+        else:
+            self.status_text_variable.set(
+                f"wrote profiles to {app.profiler.directory.resolve()}"
+            )
+
+    def on_wanted_metrics(self):
+        if self.metrics_view and self.metrics_view.toplevel.winfo_exists():
+            self.metrics_view.toplevel.lift()
+            return
+
+        self.metrics_view = MetricsView(self)
+        self.metrics_view.create_widgets(self)
+
+    def on_wanted_memory(self):
+        self.status_text_variable.set("measuring memory...")
+        self.memory_monitor.collect(self.show_memory_report)
+
+    def show_memory_report(self, report: MemoryReport):
+        self.status_text_variable.set("")
+        toplevel = tk.Toplevel(self)
+        toplevel.title("synthnav memory")
+        text = tk.Text(toplevel, width=80, height=30, font="TkFixedFont")
+        text.grid(row=0, column=0, sticky="nswe")
+        toplevel.rowconfigure(0, weight=1)
+        toplevel.columnconfigure(0, weight=1)
+        text.insert("1.0", report.format())
+        warnings = report.over_budget(self.memory_monitor.budgets)
+        if warnings:
+            text.insert("1.0", "\n".join(warnings) + "\n\n")
+        text.configure(state=tk.DISABLED)
+
     def on_wanted_view_settings(self):
+        from .settings_view import SettingsView
+
         self.settings_view = SettingsView(self.ctx.config)
         self.settings_view.create_widgets(self)
 
@@ -710,6 +1148,17 @@ class RealUIWindow(tk.Tk):
     def finished_tokens(self, generation_id: UUID):
         self.tree_controller.finished_tokens(generation_id)
 
+    def show_stats(self, stats: TreeStats):
+        self.stats_text_variable.set(
+            f"{stats.generations} generations, {stats.leaves} leaves, "
+            f"depth {stats.max_depth}, {stats.total_chars} characters, "
+            f"{stats.generated_tokens} tokens generated"
+        )
+
+    def report_task_failure(self, what: str, failure: TaskFailed):
+        log.warning("%s failed: %s", what, failure)
+        self.error_text_variable.set(f"{what} failed: {failure!s}")
+
     def report_callback_exception(self, exc, val, tb):
         try:
             log.exception("shit happened: %r %r", exc, val)
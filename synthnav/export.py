@@ -0,0 +1,222 @@
+"""Stream a story out into a file.
+
+    python -m synthnav.export story.synthnav story.md --format markdown
+"""
+import abc
+import enum
+import json
+import asyncio
+import logging
+import argparse
+import itertools
+from pathlib import Path
+from uuid import UUID
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+from .database import Database
+from .generation import GenerationState
+from .tinytask import producer
+
+log = logging.getLogger(__name__)
+
+# how many nodes get their text fetched from the db at once
+EXPORT_CHUNK_SIZE = 512
+
+
+class ExportFormat(enum.Enum):
+    # every root-to-leaf path as the prompt it would make
+    PATHS = "paths"
+    # the entire tree, one generation per line, parents before children
+    JSONL = "jsonl"
+    # the entire tree as an outline
+    MARKDOWN = "markdown"
+
+    @classmethod
+    def from_path(cls, path: Path) -> "ExportFormat":
+        match path.suffix:
+            case ".jsonl":
+                return cls.JSONL
+            case ".md":
+                return cls.MARKDOWN
+            case _:
+                return cls.PATHS
+
+
+# (generation id, parent id, depth, is leaf)
+WalkEntry = Tuple[UUID, Optional[UUID], int, bool]
+
+
+def walk_tree(
+    children_of: Dict[UUID, List[UUID]], root_id: UUID
+) -> Iterator[WalkEntry]:
+    """Iterative depth-first (pre-order) walk through the tree."""
+    stack = [(root_id, None, 0)]
+    while stack:
+        generation_id, parent_id, depth = stack.pop()
+        children = children_of.get(generation_id, ())
+        yield generation_id, parent_id, depth, not children
+        stack.extend(
+            (child_id, generation_id, depth + 1) for child_id in reversed(children)
+        )
+
+
+def chunked_walk(
+    children_of: Dict[UUID, List[UUID]], root_ids: List[UUID]
+) -> Iterator[List[WalkEntry]]:
+    walk = itertools.chain.from_iterable(
+        walk_tree(children_of, root_id) for root_id in root_ids
+    )
+    while chunk := list(itertools.islice(walk, EXPORT_CHUNK_SIZE)):
+        yield chunk
+
+
+class TreeWriter(abc.ABC):
+    """Receives generations in depth-first order and writes them out,
+    keeping only the texts of the current path in memory."""
+
+    def __init__(self, output: TextIO):
+        self.output = output
+        self.prefix: List[str] = []
+
+    def write(
+        self,
+        generation_id: UUID,
+        parent_id: Optional[UUID],
+        depth: int,
+        is_leaf: bool,
+        state: GenerationState,
+        text: str,
+    ) -> None:
+        del self.prefix[depth:]
+        self.prefix.append(text)
+        self.write_generation(generation_id, parent_id, depth, is_leaf, state, text)
+
+    @abc.abstractmethod
+    def write_generation(self, generation_id, parent_id, depth, is_leaf, state, text):
+        pass
+
+
+class PathsWriter(TreeWriter):
+    SEPARATOR = "\n\n---\n\n"
+
+    def __init__(self, output: TextIO):
+        super().__init__(output)
+        self.wrote_any_path = False
+
+    def write_generation(self, generation_id, parent_id, depth, is_leaf, state, text):
+        if not is_leaf:
+            return
+
+        if self.wrote_any_path:
+            self.output.write(self.SEPARATOR)
+        self.wrote_any_path = True
+
+        # same shape as GenerationTreeController.prompt_from
+        for prefix_text in self.prefix:
+            self.output.write(prefix_text.strip())
+
+
+class JsonlWriter(TreeWriter):
+    def write_generation(self, generation_id, parent_id, depth, is_leaf, state, text):
+        record = {
+            "id": str(generation_id),
+            "parent": str(parent_id) if parent_id else None,
+            "state": state.name.lower(),
+            "text": text,
+        }
+        self.output.write(json.dumps(record))
+        self.output.write("\n")
+
+
+class MarkdownWriter(TreeWriter):
+    def __init__(self, output: TextIO):
+        super().__init__(output)
+        self.counters: List[int] = []
+
+    def write_generation(self, generation_id, parent_id, depth, is_leaf, state, text):
+        del self.counters[depth + 1 :]
+        if len(self.counters) <= depth:
+            self.counters.append(0)
+        self.counters[depth] += 1
+
+        outline = ".".join(str(counter) for counter in self.counters)
+        heading = "#" * min(depth + 1, 6)
+        self.output.write(f"{heading} {outline}\n\n{text.strip()}\n\n")
+
+
+WRITERS = {
+    ExportFormat.PATHS: PathsWriter,
+    ExportFormat.JSONL: JsonlWriter,
+    ExportFormat.MARKDOWN: MarkdownWriter,
+}
+
+
+async def export_story(
+    db: Database, output_path: Path, export_format: ExportFormat, progress=None
+) -> int:
+    """Export the story in the given database, returning how many
+    generations were written."""
+    root_ids, children_of = await db.fetch_children_map()
+    total = sum(len(children) for children in children_of.values()) + len(root_ids)
+
+    written = 0
+    with output_path.open("w", encoding="utf-8") as output:
+        writer = WRITERS[export_format](output)
+        for chunk in chunked_walk(children_of, root_ids):
+            nodes = await db.fetch_states_and_texts([entry[0] for entry in chunk])
+            for generation_id, parent_id, depth, is_leaf in chunk:
+                writer.write(
+                    generation_id, parent_id, depth, is_leaf, *nodes[generation_id]
+                )
+            written += len(chunk)
+            if progress:
+                progress(written, total)
+
+    return written
+
+
+@producer
+async def export_process(tt, db, output_path, export_format, from_pid):
+    def progress(written, total):
+        tt.send(from_pid, ("progress", written, total))
+
+    written = await export_story(db, output_path, export_format, progress)
+    tt.send(from_pid, ("done", written))
+    tt.finish(from_pid)
+
+
+async def export_story_file(
+    story_path: Path, output_path: Path, export_format: ExportFormat
+) -> int:
+    db = Database()
+    await db.init()
+    try:
+        # this only loads the story into memory, the file is never written to
+        await db.open_on(story_path)
+        return await export_story(db, output_path, export_format)
+    finally:
+        await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("story", type=Path)
+    parser.add_argument("output", type=Path)
+    parser.add_argument(
+        "--format",
+        choices=[export_format.value for export_format in ExportFormat],
+        help="defaults to guessing from the output file extension",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.format:
+        export_format = ExportFormat(args.format)
+    else:
+        export_format = ExportFormat.from_path(args.output)
+
+    written = asyncio.run(export_story_file(args.story, args.output, export_format))
+    log.info("exported %d generations to %s", written, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Stand-in for text-generation-webui's streaming api, for trying out
+generation without a model.
+
+    python -m synthnav.fake_server --port 5005 --tokens-per-second 30
+    env SERVER_ADDR=localhost:5005 ./start.py
+"""
+import json
+import random
+import asyncio
+import logging
+import argparse
+import websockets
+from http import HTTPStatus
+from dataclasses import dataclass
+from .synthetic import WORDS
+
+log = logging.getLogger(__name__)
+
+STREAM_PATH = "/api/v1/stream"
+
+# used when the request doesn't say how many tokens it wants
+DEFAULT_MAX_NEW_TOKENS = 200
+
+
+@dataclass
+class FakeServerSettings:
+    tokens_per_second: float = 20.0
+    # how long until the first token, like a model reading the prompt
+    first_token_delay: float = 0.5
+    # every delay is randomly this much shorter or longer, as a fraction
+    jitter: float = 0.25
+    # chance of a connection being refused before the handshake finishes
+    refuse_rate: float = 0.0
+    # chance of a generation being closed with an error midway through
+    drop_rate: float = 0.0
+    # chance of a generation going silent midway through, until the
+    # client gives up on it
+    stall_rate: float = 0.0
+    # generations streaming at the same time, text-generation-webui only
+    # does one at a time
+    max_concurrency: int = 1
+    # generations waiting for their turn before new connections get refused
+    max_queued: int = 16
+    # for failures and delays, tokens follow the seed of each request
+    seed: int = 0
+
+
+class FakeServer:
+    def __init__(self, settings: FakeServerSettings):
+        self.settings = settings
+        self.rng = random.Random(settings.seed)
+        self.semaphore = asyncio.Semaphore(settings.max_concurrency)
+        self.queued = 0
+        self.streaming = 0
+        self.finished = 0
+        self.failed = 0
+
+    def serve(self, host: str = "localhost", port: int = 5005):
+        """Start serving, as an async context manager."""
+        return websockets.serve(
+            self.handle, host, port, process_request=self.process_request
+        )
+
+    def _delay(self, seconds: float) -> float:
+        jitter = self.settings.jitter
+        return max(0.0, seconds * (1 + self.rng.uniform(-jitter, jitter)))
+
+    async def process_request(self, path, _request_headers):
+        if path != STREAM_PATH:
+            return HTTPStatus.NOT_FOUND, [], b"not found\n"
+        if self.rng.random() < self.settings.refuse_rate:
+            log.info("refusing connection (injected)")
+            self.failed += 1
+            return HTTPStatus.SERVICE_UNAVAILABLE, [], b"injected failure\n"
+        if self.queued >= self.settings.max_queued:
+            log.info("refusing connection, %d already queued", self.queued)
+            self.failed += 1
+            return HTTPStatus.SERVICE_UNAVAILABLE, [], b"too many requests\n"
+        return None
+
+    async def handle(self, websocket):
+        request = json.loads(await websocket.recv())
+        self.queued += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.queued -= 1
+
+        self.streaming += 1
+        try:
+            await self.stream(websocket, request)
+        finally:
+            self.streaming -= 1
+            self.semaphore.release()
+
+    async def stream(self, websocket, request):
+        settings = self.settings
+        token_rng = random.Random(request.get("seed", 0))
+        token_amount = request.get("max_new_tokens", DEFAULT_MAX_NEW_TOKENS)
+
+        failure = None
+        failure_chance = self.rng.random()
+        if failure_chance < settings.drop_rate:
+            failure = "drop"
+        elif failure_chance < settings.drop_rate + settings.stall_rate:
+            failure = "stall"
+        fail_at = self.rng.randrange(token_amount) if failure else None
+
+        await asyncio.sleep(self._delay(settings.first_token_delay))
+        for message_num in range(token_amount):
+            if message_num == fail_at:
+                self.failed += 1
+                if failure == "drop":
+                    log.info("dropping generation at token %d", message_num)
+                    await websocket.close(1011, "injected failure")
+                else:
+                    log.info("stalling generation at token %d", message_num)
+                    await websocket.wait_closed()
+                return
+
+            token = " " + token_rng.choice(WORDS)
+            await websocket.send(
+                json.dumps(
+                    {"event": "text_stream", "message_num": message_num, "text": token}
+                )
+            )
+            await asyncio.sleep(self._delay(1 / settings.tokens_per_second))
+
+        await websocket.send(
+            json.dumps({"event": "stream_end", "message_num": token_amount})
+        )
+        self.finished += 1
+
+
+async def run_forever(settings: FakeServerSettings, host: str, port: int):
+    server = FakeServer(settings)
+    async with server.serve(host, port):
+        log.info("fake generation server on ws://%s:%d%s", host, port, STREAM_PATH)
+        await asyncio.Future()
+
+
+def main():
+    defaults = FakeServerSettings()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5005)
+    parser.add_argument(
+        "--tokens-per-second", type=float, default=defaults.tokens_per_second
+    )
+    parser.add_argument(
+        "--first-token-delay", type=float, default=defaults.first_token_delay
+    )
+    parser.add_argument("--jitter", type=float, default=defaults.jitter)
+    parser.add_argument("--refuse-rate", type=float, default=defaults.refuse_rate)
+    parser.add_argument("--drop-rate", type=float, default=defaults.drop_rate)
+    parser.add_argument("--stall-rate", type=float, default=defaults.stall_rate)
+    parser.add_argument("--max-concurrency", type=int, default=defaults.max_concurrency)
+    parser.add_argument("--max-queued", type=int, default=defaults.max_queued)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    settings = FakeServerSettings(
+        tokens_per_second=args.tokens_per_second,
+        first_token_delay=args.first_token_delay,
+        jitter=args.jitter,
+        refuse_rate=args.refuse_rate,
+        drop_rate=args.drop_rate,
+        stall_rate=args.stall_rate,
+        max_concurrency=args.max_concurrency,
+        max_queued=args.max_queued,
+        seed=args.seed,
+    )
+    try:
+        asyncio.run(run_forever(settings, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
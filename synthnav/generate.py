@@ -4,20 +4,70 @@ import random
 import logging
 import string
 import os
-import websockets
-import random
+import time
+import functools
 import dataclasses
-from typing import Generator
-from .config import GenerationSettings
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncIterator, Generator, Optional
+from .metrics import REGISTRY
+from .recording import Recorder, Replayer
 from .tinytask import producer
 
+if TYPE_CHECKING:
+    from .generation_settings import GenerationSettings
+
 log = logging.getLogger(__name__)
 
 GENERATION_LOCK = asyncio.Lock()
 
+# deadline for an entire generation, including waiting for GENERATION_LOCK
+GENERATION_TIMEOUT = 300
+# retried only while the server can't be reached, never midway through
+GENERATION_RETRIES = 3
+
+
+@functools.cache
+def _recorder() -> Optional[Recorder]:
+    path = os.environ.get("RECORD_GENERATIONS")
+    return Recorder(Path(path)) if path else None
+
+
+@functools.cache
+def _replayer() -> Optional[Replayer]:
+    path = os.environ.get("REPLAY_GENERATIONS")
+    if not path:
+        return None
+    speed = float(os.environ.get("REPLAY_SPEED", 1))
+    return Replayer.from_path(Path(path), speed)
+
+
+async def stream_from_server(request: dict) -> AsyncIterator[str]:
+    # imported here so startup doesn't wait for it
+    import websockets
+
+    server = os.environ["SERVER_ADDR"]
+    url = f"ws://{server}/api/v1/stream"
+
+    log.debug("connecting to %r", url)
+    async with websockets.connect(url) as websocket:
+        log.debug("connected to %r", url)
+        await websocket.send(json.dumps(request))
+
+        while True:
+            incoming_data = await websocket.recv()
+            incoming_data = json.loads(incoming_data)
+
+            match incoming_data["event"]:
+                case "text_stream":
+                    content = incoming_data["text"]
+                    log.debug("got %r", content)
+                    yield content
+                case "stream_end":
+                    return
+
 
 async def generate_text(
-    input_prompt: str, *, settings: GenerationSettings, seed=-1
+    input_prompt: str, *, settings: "GenerationSettings", seed=-1
 ) -> Generator[str, None, None]:
     """From a given input prompt, spit out the tokens that compose the
     textual completion of that prompt."""
@@ -25,35 +75,59 @@ async def generate_text(
     if seed == -1:
         seed = random.randint(1, 2**31)
 
-    server = os.environ["SERVER_ADDR"]
+    settings_dict = dataclasses.asdict(settings)
     request = {
         **{
             "prompt": input_prompt,
             "seed": seed,
         },
-        **dataclasses.asdict(settings),
+        **settings_dict,
     }
-    url = f"ws://{server}/api/v1/stream"
-
-    result = input_prompt
 
+    requested_at = time.monotonic()
     async with GENERATION_LOCK:
-        log.debug("connecting to %r", url)
-        async with websockets.connect(url) as websocket:
-            log.debug("connected to %r", url)
-            await websocket.send(json.dumps(request))
-
-            while True:
-                incoming_data = await websocket.recv()
-                incoming_data = json.loads(incoming_data)
-
-                match incoming_data["event"]:
-                    case "text_stream":
-                        content = incoming_data["text"]
-                        log.debug("got %r", content)
-                        yield content
-                    case "stream_end":
-                        return
+        started_at = time.monotonic()
+        REGISTRY.histogram(
+            "generation_queue_wait_seconds",
+            "time generations wait for their turn on the server",
+        ).record(started_at - requested_at)
+
+        replayer = _replayer()
+        if replayer:
+            backend = "replay"
+            tokens = replayer.replay(input_prompt)
+        else:
+            backend = "server"
+            tokens = stream_from_server(request)
+
+        recorder = _recorder()
+        if recorder:
+            tokens = recorder.record(input_prompt, settings_dict, seed, tokens)
+
+        token_counter = REGISTRY.counter(
+            "generation_tokens", "tokens received", backend=backend
+        )
+        token_amount = 0
+        async for token in tokens:
+            if not token_amount:
+                first_token_at = time.monotonic()
+                REGISTRY.histogram(
+                    "generation_time_to_first_token_seconds",
+                    "time from the generation starting to its first token",
+                    backend=backend,
+                ).record(first_token_at - started_at)
+            token_amount += 1
+            token_counter.inc()
+            yield token
+
+        streaming_seconds = time.monotonic() - first_token_at if token_amount else 0
+        if token_amount > 1 and streaming_seconds > 0:
+            REGISTRY.histogram(
+                "generation_tokens_per_second",
+                "token rate of whole generations, after the first token",
+                resolution=0.01,
+                backend=backend,
+            ).record((token_amount - 1) / streaming_seconds)
 
     log.debug("reached end of stream, returning")
 
@@ -61,6 +135,6 @@ async def generate_text(
 @producer
 async def text_generator_process(tt, settings, prompt, from_pid):
     async for data in generate_text(prompt, settings=settings):
-        tt.send(from_pid, ("new_incoming_token", data))
+        await tt.put(from_pid, ("new_incoming_token", data))
     tt.send(from_pid, ("finished_tokens", None))
     tt.finish(from_pid)
@@ -1,6 +1,7 @@
 import enum
+from dataclasses import dataclass
 from uuid import UUID
-from typing import List
+from typing import List, Optional
 
 
 class GenerationState(enum.IntEnum):
@@ -9,22 +10,86 @@ class GenerationState(enum.IntEnum):
     EDITING = 2
 
 
+@dataclass(frozen=True, slots=True)
+class GenerationSnapshot:
+    """What a generation looked like at some version, safe to hand over to
+    another thread while the Generation it came from keeps changing."""
+
+    id: UUID
+    version: int
+    state: GenerationState
+    text: str
+    parent: Optional[UUID]
+    # tokens the model generated into it
+    tokens: int = 0
+
+
+class GenerationMixin:
+    """What Generation and GenerationStore facades have in common, built
+    on top of their attributes."""
+
+    __slots__ = ()
+
+    @property
+    def is_projected(self) -> bool:
+        return self.text is None
+
+    @property
+    def display_text(self) -> str:
+        if not self.is_projected:
+            return self.text
+        if self.text_length > len(self.preview):
+            return self.preview + "\N{HORIZONTAL ELLIPSIS}"
+        return self.preview
+
+    def snapshot(self) -> GenerationSnapshot:
+        """Take a snapshot to be written to the database, as a new version."""
+        assert not self.is_projected, "projected generations can't be written"
+        self.version += 1
+        return GenerationSnapshot(
+            id=self.id,
+            version=self.version,
+            state=self.state,
+            text=self.text,
+            parent=self.parent,
+            tokens=self.tokens,
+        )
+
+
 # Generation Model class
-class Generation:
+class Generation(GenerationMixin):
     def __init__(
         self,
         *,
         id: UUID,
         state: GenerationState,
-        text: str,
+        text: Optional[str],
         parent: UUID,
         children: List[UUID] = None,
+        preview: Optional[str] = None,
+        text_length: Optional[int] = None,
+        text_hash: Optional[str] = None,
+        version: int = 0,
+        collapsed: bool = False,
+        tokens: int = 0,
     ):
         self.id = id
         self.state = state
+        # None when loaded in projection mode, use Database.get_text to
+        # fetch it on demand
         self.text = text
         self.parent = parent
         self.children = children or []
+        self.preview = preview
+        self.text_length = len(text or "") if text_length is None else text_length
+        self.text_hash = text_hash
+        # bumped on every snapshot, the database drops writes of snapshots
+        # older than the one it already has
+        self.version = version
+        # whether its subtree is folded into a summary node in the tree view
+        self.collapsed = collapsed
+        # how many tokens the model generated into it
+        self.tokens = tokens
 
     def __repr__(self):
         return f"Generation<{self.id!s}>"
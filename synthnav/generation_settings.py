@@ -0,0 +1,67 @@
+"""Settings sent to the model with every prompt. Kept apart from config, as
+pydantic takes a while to import and isn't needed until generating or
+showing settings."""
+from typing import List
+from pydantic import Field
+from pydantic.dataclasses import dataclass as pyd_dataclass
+
+
+@pyd_dataclass
+class GenerationSettings:
+    """GPT model settings"""
+
+    max_new_tokens: int = Field(
+        description="Maximum amount of tokens generated by the model", ge=0, le=2048
+    )
+    do_sample: bool = Field(title="do sample")
+    temperature: float = Field(
+        description="Degree of randomness from the model", ge=0, le=2, increment=0.01
+    )
+    top_p: float = Field(
+        ge=0,
+        le=1,
+        increment=0.01,
+        description="Pick from the tokens whose probabilities add up to top_p",
+    )
+    typical_p: float = Field(title="typical_p", ge=0, le=1, increment=0.01)
+    repetition_penalty: float = Field(ge=1, le=1.5, increment=0.01)
+    top_k: int = Field(
+        ge=0, le=100, description="Pick from the first top_k tokens made by the model"
+    )
+    min_length: int = Field(
+        ge=0, le=2048, description="minimum amount of tokens in a generation"
+    )
+    no_repeat_ngram_size: int = Field(description="no_repeat_ngram_size", ge=0, le=20)
+    num_beams: int = Field(ge=1, le=20, description="num_beams")
+    penalty_alpha: int = Field(ge=0, le=5, description="penalty_alpha")
+    length_penalty: int = Field(ge=-5, le=5, description="length_penalty")
+    early_stopping: bool = Field(description="early_stopping")
+    add_bos_token: bool = Field(description="add_bos_token")
+    truncation_length: int = Field(ge=0, le=8192, description="truncation_length")
+    ban_eos_token: bool = Field(description="ban_eos_token")
+    skip_special_tokens: bool = Field(description="skip_special_tokens")
+    stopping_strings: List[str] = Field(description="stopping_strings")
+
+    @classmethod
+    def llama_defaults(cls):
+        """Specific to how I use LLaMa models"""
+        return cls(
+            max_new_tokens=100,
+            do_sample=True,
+            temperature=0.75,
+            top_p=0.73,
+            typical_p=1,
+            repetition_penalty=1.18,
+            top_k=40,
+            min_length=0,
+            no_repeat_ngram_size=0,
+            num_beams=1,
+            penalty_alpha=0,
+            length_penalty=1,
+            early_stopping=False,
+            add_bos_token=True,
+            truncation_length=2048,
+            ban_eos_token=False,
+            skip_special_tokens=True,
+            stopping_strings=[],
+        )
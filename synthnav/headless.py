@@ -0,0 +1,125 @@
+"""Run controllers without tk or an asyncio thread, for tests and
+benchmarks."""
+import asyncio
+import logging
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID, uuid4
+from dataclasses import dataclass
+from .config import Config
+from .context import app_context_var
+from .database import Database
+from .store import TreeStats
+from .tinytask import DEFAULT_MAILBOX_CAPACITY, Priority, TaskFailed, supervisor
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class SyncMailbox:
+    function: Callable[[UUID, Any], Any]
+    sent: int = 0
+    task: Optional[asyncio.Task] = None
+
+
+class SyncTinytaskManager:
+    """TinytaskManager stand-in that runs everything to completion before
+    returning, calling callbacks as soon as they get a message."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.mailboxes: Dict[UUID, SyncMailbox] = {}
+        # coroutines started from inside another one, run once it's done
+        self._pending: List[asyncio.Task] = []
+
+    def _run(self, coro):
+        if self.loop.is_running():
+            self._pending.append(self.loop.create_task(coro))
+            return
+
+        self.loop.run_until_complete(coro)
+        while self._pending:
+            pending, self._pending = self._pending, []
+            self.loop.run_until_complete(asyncio.gather(*pending))
+
+    def cast(self, coro):
+        self._run(coro)
+
+    def call(
+        self,
+        function,
+        callback=None,
+        *,
+        args=None,
+        kwargs=None,
+        as_pid: UUID = None,
+        priority: Priority = Priority.INTERACTIVE,
+        capacity: int = DEFAULT_MAILBOX_CAPACITY,
+        timeout: Optional[float] = None,
+        retries: int = 0,
+    ) -> UUID:
+        as_pid = as_pid or uuid4()
+        if callback:
+            self.mailboxes[as_pid] = SyncMailbox(callback)
+        self._run(
+            supervisor(
+                self,
+                function,
+                args or [],
+                kwargs or {},
+                as_pid,
+                timeout=timeout,
+                retries=retries,
+            )
+        )
+        return as_pid
+
+    def send(self, process_id: UUID, data):
+        mailbox = self.mailboxes.get(process_id)
+        if not mailbox:
+            log.warning("unknown pid %r", process_id)
+            return
+        mailbox.sent += 1
+        mailbox.function(process_id, data)
+
+    async def put(self, process_id: UUID, data):
+        self.send(process_id, data)
+
+    def finish(self, process_id: UUID):
+        self.mailboxes.pop(process_id, None)
+
+    def fail(self, process_id: UUID, failure: TaskFailed):
+        self.send(process_id, failure)
+        self.finish(process_id)
+
+    def sync_queue_depths(self) -> Dict[Priority, int]:
+        # messages are delivered as they're sent, nothing ever waits
+        return {priority: 0 for priority in Priority}
+
+
+class HeadlessApp:
+    """What controllers need from the application and the window, with an
+    in-memory database."""
+
+    def __init__(self, config: Optional[Config] = None):
+        self.loop = asyncio.new_event_loop()
+        self.task = SyncTinytaskManager(self.loop)
+        self.ctx = SimpleNamespace(config=config or Config(server_address=""))
+        self.db = Database(codec=self.ctx.config.storage_codec)
+        self.task.cast(self.db.init())
+
+        self.stats: Optional[TreeStats] = None
+        self.failures: List[TaskFailed] = []
+        self._context_token = app_context_var.set(self)
+
+    def show_stats(self, stats: TreeStats):
+        self.stats = stats
+
+    def report_task_failure(self, what: str, failure: TaskFailed):
+        log.warning("%s failed: %s", what, failure)
+        self.failures.append(failure)
+
+    def close(self):
+        self.task.cast(self.db.close())
+        self.loop.close()
+        app_context_var.reset(self._context_token)
@@ -0,0 +1,131 @@
+"""Import stories from JSON lines files, like the ones made by
+`synthnav.export` in the jsonl format."""
+import json
+import logging
+from pathlib import Path
+from uuid import UUID
+from typing import Iterator, List, Optional, Set, Tuple
+from .database import Database
+from .generation import Generation, GenerationState
+from .tinytask import producer
+
+log = logging.getLogger(__name__)
+
+# how many lines get parsed and inserted at once
+IMPORT_CHUNK_SIZE = 1000
+
+
+class StoryImportError(Exception):
+    pass
+
+
+class StoryValidator:
+    """Check that generations form a single tree, as they come in.
+
+    Parents must come before their children, so that validation only
+    needs to hold the ids that were already seen."""
+
+    def __init__(self):
+        self.seen_ids: Set[UUID] = set()
+        self.root_id: Optional[UUID] = None
+
+    def validate(self, generation: Generation, line_number: int) -> None:
+        if generation.id in self.seen_ids:
+            raise StoryImportError(
+                f"line {line_number}: duplicate generation {generation.id}"
+            )
+
+        if generation.parent is None:
+            if self.root_id is not None:
+                raise StoryImportError(
+                    f"line {line_number}: second root generation {generation.id}, "
+                    f"already have {self.root_id}"
+                )
+            self.root_id = generation.id
+        elif generation.parent not in self.seen_ids:
+            raise StoryImportError(
+                f"line {line_number}: parent {generation.parent} "
+                "does not exist or comes after its child"
+            )
+
+        self.seen_ids.add(generation.id)
+
+    def finish(self) -> None:
+        if self.root_id is None:
+            raise StoryImportError("story has no root generation")
+
+
+def parse_generation(line: bytes, line_number: int) -> Generation:
+    try:
+        record = json.loads(line)
+        parent = record.get("parent")
+        return Generation(
+            id=UUID(record["id"]),
+            state=GenerationState[record.get("state", "generated").upper()],
+            text=record["text"],
+            parent=UUID(parent) if parent else None,
+        )
+    except (ValueError, KeyError, TypeError, AttributeError) as error:
+        raise StoryImportError(f"line {line_number}: invalid record: {error!r}")
+
+
+def read_chunks(path: Path) -> Iterator[Tuple[int, List[Tuple[int, Generation]]]]:
+    """Parse the file IMPORT_CHUNK_SIZE lines at a time, yielding how far
+    into the file we are, and each generation with its line number."""
+    with path.open("rb") as fd:
+        chunk = []
+        line_number = 0
+        while line := fd.readline():
+            line_number += 1
+            if not line.strip():
+                continue
+
+            chunk.append((line_number, parse_generation(line, line_number)))
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                yield fd.tell(), chunk
+                chunk = []
+
+        if chunk:
+            yield fd.tell(), chunk
+
+
+async def import_story(db: Database, path: Path, progress=None) -> int:
+    """Replace the story in the database with the one in the given file,
+    in a single transaction. If anything in the file is invalid, the
+    current story is kept as-is."""
+    total_bytes = path.stat().st_size
+    validator = StoryValidator()
+    imported = 0
+
+    async with db.savepoint("import_story"):
+        await db.delete_all_generations()
+        for position, chunk in read_chunks(path):
+            for line_number, generation in chunk:
+                validator.validate(generation, line_number)
+            await db.insert_generations(
+                [generation.snapshot() for _, generation in chunk]
+            )
+            imported += len(chunk)
+            if progress:
+                progress(imported, position / total_bytes)
+        validator.finish()
+
+    await db.commit()
+    # the story isn't the one in the previously opened file anymore
+    db.path = None
+    return imported
+
+
+@producer
+async def import_process(tt, db, path, from_pid):
+    def progress(imported, fraction):
+        tt.send(from_pid, ("progress", imported, fraction))
+
+    try:
+        imported = await import_story(db, path, progress)
+    except StoryImportError as error:
+        log.warning("failed to import %s: %s", path, error)
+        tt.send(from_pid, ("error", str(error)))
+    else:
+        tt.send(from_pid, ("done", imported))
+    tt.finish(from_pid)
@@ -0,0 +1,179 @@
+"""Report what startup spends importing, from python's -X importtime.
+
+    python -m synthnav.importtime --runs 5 --depth 2
+
+Exits with 1 when startup imported something that's meant to be lazy.
+
+IMPORT_TIME_REPORT=1 python start.py runs the app as usual and reports
+everything it imported once it exits, see run_with_report."""
+import sys
+import json
+import argparse
+import subprocess
+from dataclasses import asdict, dataclass
+from typing import Dict, List
+
+# what the app imports on startup
+STARTUP_MODULE = "synthnav.main"
+
+# only needed once some feature gets used, startup must not import them
+LAZY_MODULES = (
+    "aiohttp",
+    "pydantic",
+    "websockets",
+    "tkfontchooser",
+    "synthnav.generation_settings",
+    "synthnav.settings_view",
+    "synthnav.synthetic",
+    "synthnav.export",
+    "synthnav.importer",
+)
+
+
+@dataclass
+class ImportTime:
+    module: str
+    # microseconds spent in the module itself, and with what it imported
+    self_us: int
+    cumulative_us: int
+
+
+def parse_importtime(output: str) -> List[ImportTime]:
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, module = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            # the header
+            continue
+        imports.append(ImportTime(module.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def measure(module: str = STARTUP_MODULE) -> List[ImportTime]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def imported_modules(module: str = STARTUP_MODULE) -> List[str]:
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import sys, {module}; print('\\n'.join(sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.split()
+
+
+def eagerly_imported(modules: List[str]) -> List[str]:
+    """Which of LAZY_MODULES got imported."""
+    return [lazy for lazy in LAZY_MODULES if lazy in modules]
+
+
+def by_package(imports: List[ImportTime], depth: int = 1) -> Dict[str, int]:
+    """Microseconds spent importing each package, down to depth dotted
+    names, without counting what they imported from other packages."""
+    packages: Dict[str, int] = {}
+    for entry in imports:
+        package = ".".join(entry.module.split(".")[:depth])
+        packages[package] = packages.get(package, 0) + entry.self_us
+    return packages
+
+
+def format_report(
+    imports: List[ImportTime], module: str, depth: int = 1, top: int = 20
+) -> List[str]:
+    total_us = sum(entry.self_us for entry in imports)
+    packages = sorted(by_package(imports, depth).items(), key=lambda item: -item[1])
+    return [f"importing {module} took {total_us / 1000:.1f}ms"] + [
+        f"  {package:<40} {package_us / 1000:>8.1f}ms {package_us / total_us:>6.1%}"
+        for package, package_us in packages[:top]
+    ]
+
+
+def run_with_report(script: str, args: List[str], depth: int = 1) -> int:
+    """Run a script under -X importtime, passing through everything else
+    it writes to stderr, and report what it imported once it exits.
+    Returns its exit code."""
+    process = subprocess.Popen(
+        [sys.executable, "-X", "importtime", script, *args],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    lines = []
+    while True:
+        try:
+            line = process.stderr.readline()
+        except KeyboardInterrupt:
+            # the app got it too, and is shutting down on its own
+            continue
+        if not line:
+            break
+        if line.startswith("import time:"):
+            lines.append(line)
+        else:
+            sys.stderr.write(line)
+    returncode = process.wait()
+    print("\n".join(format_report(parse_importtime("".join(lines)), script, depth)))
+    return returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default=STARTUP_MODULE)
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=5,
+        help="the fastest run is reported, earlier ones warm the disk cache",
+    )
+    parser.add_argument(
+        "--depth", type=int, default=1, help="how many dotted names packages have"
+    )
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    imports = min(runs, key=lambda run: sum(entry.self_us for entry in run))
+    total_us = sum(entry.self_us for entry in imports)
+    eager = eagerly_imported(imported_modules(args.module))
+
+    if args.json:
+        json.dump(
+            {
+                "module": args.module,
+                "total_us": total_us,
+                "packages": dict(
+                    sorted(
+                        by_package(imports, args.depth).items(),
+                        key=lambda item: -item[1],
+                    )
+                ),
+                "imports": [asdict(entry) for entry in imports],
+                "eagerly_imported": eager,
+            },
+            sys.stdout,
+            indent=2,
+        )
+        print()
+    else:
+        print("\n".join(format_report(imports, args.module, args.depth, args.top)))
+        for lazy in eager:
+            print(f"{lazy} is meant to be imported lazily, but startup imported it")
+
+    sys.exit(1 if eager else 0)
+
+
+if __name__ == "__main__":
+    main()
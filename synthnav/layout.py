@@ -0,0 +1,86 @@
+"""Where every generation goes on the tree canvas, computed without tk so
+it can be tested and benchmarked headless."""
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+from .store import NO_INDEX, GenerationStore
+
+# horizontal distance between a generation and its children
+NODE_X_SPACING = 400
+# TODO winfo_height() is not working, not even with update()
+# sprinkled around stuff. use 160 for now
+NODE_HEIGHT = 160
+
+
+@dataclass(frozen=True, slots=True)
+class NodePlacement:
+    index: int
+    parent_index: int
+    x: int
+    y: int
+    # has children, but they're folded into a summary node
+    folded: bool
+
+
+def layout_tree(
+    store: GenerationStore, root_index: int, *, x: int = 50, y: int = 50
+) -> Tuple[List[NodePlacement], int]:
+    """Place the subtree under root_index, parents before children. Each
+    generation is as tall as all of its children together, and is placed
+    level with its first child.
+
+    Returns the placements and the height of the whole subtree."""
+    first_children, next_siblings = store.first_children, store.next_siblings
+    collapsed = store.collapsed
+
+    # pre-order, without going into folded subtrees
+    order = []
+    stack = [root_index]
+    while stack:
+        index = stack.pop()
+        order.append(index)
+        if collapsed[index]:
+            continue
+        children = []
+        child_index = first_children[index]
+        while child_index != NO_INDEX:
+            children.append(child_index)
+            child_index = next_siblings[child_index]
+        stack.extend(reversed(children))
+
+    heights: Dict[int, int] = {}
+    for index in reversed(order):
+        child_index = first_children[index]
+        if child_index == NO_INDEX or collapsed[index]:
+            heights[index] = NODE_HEIGHT
+            continue
+        height = 0
+        while child_index != NO_INDEX:
+            height += heights[child_index]
+            child_index = next_siblings[child_index]
+        heights[index] = height
+
+    positions = {root_index: (x, y)}
+    placements = []
+    for index in order:
+        node_x, node_y = positions[index]
+        has_children = first_children[index] != NO_INDEX
+        placements.append(
+            NodePlacement(
+                index=index,
+                parent_index=NO_INDEX if index == root_index else store.parents[index],
+                x=node_x,
+                y=node_y,
+                folded=has_children and bool(collapsed[index]),
+            )
+        )
+        if collapsed[index]:
+            continue
+
+        child_y = node_y
+        child_index = first_children[index]
+        while child_index != NO_INDEX:
+            positions[child_index] = (node_x + NODE_X_SPACING, child_y)
+            child_y += heights[child_index]
+            child_index = next_siblings[child_index]
+
+    return placements, heights[root_index]
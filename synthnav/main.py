@@ -1,11 +1,9 @@
-import aiohttp
 import os
 import logging
 import asyncio
 from dataclasses import dataclass
 import tkinter as tk
 from tkinter import ttk
-from .generate import generate_text
 from .config import Config
 from .experiment_treetest import UIMockup
 from .experiment_asyncio import AsyncExperiment
@@ -53,6 +51,8 @@ class Window(tk.Tk):
         asyncio.create_task(self._generate(self.prompt_text.get()))
 
     async def _generate(self, prompt):
+        from .generate import generate_text
+
         assert prompt is not None
         async for incoming_response in generate_text(prompt):
             log.debug("incoming response: %r", incoming_response)
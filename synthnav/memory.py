@@ -0,0 +1,254 @@
+"""Where memory goes, split by subsystem, with budgets that warn when
+something grows past them.
+
+Python allocations are only split by module when tracemalloc is tracing
+(MEMORY_TRACE), as it makes every allocation slower."""
+import sys
+import logging
+import tracemalloc
+from pathlib import Path
+from dataclasses import dataclass, field, fields
+from typing import Callable, Dict, List, Optional, Tuple
+from .context import app
+from .metrics import REGISTRY
+from .store import GenerationStore
+from .tinytask import TaskFailed
+
+log = logging.getLogger(__name__)
+
+# how many frames tracemalloc keeps per allocation, only the innermost
+# one is used to find the module
+TRACEMALLOC_FRAMES = 1
+# how many modules reports list
+TOP_MODULES = 15
+
+
+@dataclass
+class MemoryBudgets:
+    """Limits past which reports warn, None for no limit."""
+
+    widgets: Optional[int] = 20_000
+    # characters kept in the undo stacks of text widgets
+    undo_chars: Optional[int] = 5_000_000
+    store_bytes: Optional[int] = None
+    sqlite_bytes: Optional[int] = None
+    traced_bytes: Optional[int] = None
+    queued_messages: Optional[int] = 10_000
+
+    @classmethod
+    def parse(cls, spec: str) -> "MemoryBudgets":
+        """Parse "name=limit,..." on top of the defaults, like
+        "widgets=5000,sqlite_bytes=1e9,undo_chars=none"."""
+        budgets = cls()
+        names = {budget.name for budget in fields(cls)}
+        for item in spec.split(","):
+            name, _, limit = item.strip().partition("=")
+            if name not in names:
+                raise ValueError(f"unknown memory budget {name!r}")
+            setattr(budgets, name, None if limit == "none" else int(float(limit)))
+        return budgets
+
+
+@dataclass
+class MemoryReport:
+    generations: int
+    store_bytes: int
+    sqlite_bytes: int
+    # widget class -> how many there are
+    widgets: Dict[str, int]
+    undo_chars: int
+    queued_messages: int
+    mailboxes: int
+    # only known when tracemalloc is tracing
+    traced_bytes: Optional[int] = None
+    by_module: List[Tuple[str, int]] = field(default_factory=list)
+    peak_rss_bytes: Optional[int] = None
+
+    @property
+    def widget_count(self) -> int:
+        return sum(self.widgets.values())
+
+    def over_budget(self, budgets: MemoryBudgets) -> List[str]:
+        values = {
+            "widgets": self.widget_count,
+            "undo_chars": self.undo_chars,
+            "store_bytes": self.store_bytes,
+            "sqlite_bytes": self.sqlite_bytes,
+            "traced_bytes": self.traced_bytes,
+            "queued_messages": self.queued_messages,
+        }
+        return [
+            f"{name} is {values[name]}, over its budget of {limit}"
+            for name, limit in (
+                (budget.name, getattr(budgets, budget.name))
+                for budget in fields(budgets)
+            )
+            if limit is not None and values[name] is not None and values[name] > limit
+        ]
+
+    def summary(self) -> List[str]:
+        return [
+            f"generations: {self.generations} ({megabytes(self.store_bytes)})",
+            f"sqlite: {megabytes(self.sqlite_bytes)}",
+            f"widgets: {self.widget_count}",
+            f"undo history: {self.undo_chars} characters",
+            f"queued messages: {self.queued_messages} in {self.mailboxes} mailboxes",
+        ]
+
+    def format(self) -> str:
+        lines = self.summary()
+        if self.peak_rss_bytes is not None:
+            lines.append(f"peak rss: {megabytes(self.peak_rss_bytes)}")
+        if self.traced_bytes is not None:
+            lines.append(f"python (traced): {megabytes(self.traced_bytes)}")
+            lines.extend(
+                f"  {module:<40} {megabytes(size):>10}"
+                for module, size in self.by_module
+            )
+        lines.append("widgets by class:")
+        lines.extend(
+            f"  {widget_class:<40} {count:>10}"
+            for widget_class, count in sorted(
+                self.widgets.items(), key=lambda item: -item[1]
+            )
+        )
+        return "\n".join(lines)
+
+
+def megabytes(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f}MB"
+
+
+def module_name(filename: str, modules_by_file: Dict[str, str]) -> str:
+    return modules_by_file.get(filename) or Path(filename).stem
+
+
+def traced_by_module(
+    limit: int = TOP_MODULES,
+) -> Tuple[Optional[int], List[Tuple[str, int]]]:
+    """Total traced memory and the modules that allocated the most of it,
+    if tracemalloc is tracing."""
+    if not tracemalloc.is_tracing():
+        return None, []
+
+    modules_by_file = {
+        getattr(module, "__file__", None): name
+        for name, module in list(sys.modules.items())
+    }
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__),)
+    )
+    by_module: Dict[str, int] = {}
+    for stat in snapshot.statistics("filename"):
+        name = module_name(stat.traceback[0].filename, modules_by_file)
+        by_module[name] = by_module.get(name, 0) + stat.size
+
+    top = sorted(by_module.items(), key=lambda item: -item[1])[:limit]
+    return sum(by_module.values()), top
+
+
+def count_widgets(root) -> Tuple[Dict[str, int], int]:
+    """Count widgets under root by class, and the characters in their undo
+    stacks."""
+    widgets: Dict[str, int] = {}
+    undo_chars = 0
+    stack = [root]
+    while stack:
+        widget = stack.pop()
+        widget_class = type(widget).__name__
+        widgets[widget_class] = widgets.get(widget_class, 0) + 1
+        undo_chars += getattr(widget, "undo_chars", 0)
+        stack.extend(widget.winfo_children())
+    return widgets, undo_chars
+
+
+def peak_rss_bytes() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        # not on windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryMonitor:
+    """Builds memory reports from the tk thread, every interval seconds if
+    given one, warning about anything over budget."""
+
+    def __init__(
+        self,
+        root,
+        store: Callable[[], GenerationStore],
+        budgets: MemoryBudgets,
+        interval: Optional[float] = None,
+    ):
+        self.root = root
+        self.store = store
+        self.budgets = budgets
+        self.interval = interval
+        self.last_report: Optional[MemoryReport] = None
+
+    def start(self):
+        if self.interval:
+            self.root.after(round(self.interval * 1000), self._collect_periodically)
+
+    def _collect_periodically(self):
+        self.collect(lambda report: log.info("memory: %s", ", ".join(report.summary())))
+        self.root.after(round(self.interval * 1000), self._collect_periodically)
+
+    def collect(self, callback: Optional[Callable[[MemoryReport], None]] = None):
+        """Build a report once the db says how big it is."""
+        app.task.call(
+            app.db.memory_used,
+            lambda _pid, data: self._on_sqlite_bytes(data, callback),
+        )
+
+    def _on_sqlite_bytes(self, data, callback):
+        if isinstance(data, TaskFailed):
+            log.warning("failed to get db size: %s", data)
+            data = 0
+
+        report = self.build_report(data)
+        self.last_report = report
+        for warning in report.over_budget(self.budgets):
+            log.warning("memory: %s", warning)
+            REGISTRY.counter(
+                "memory_budget_warnings", "memory reports that went over a budget"
+            ).inc()
+        if callback:
+            callback(report)
+
+    def build_report(self, sqlite_bytes: int) -> MemoryReport:
+        store = self.store()
+        widgets, undo_chars = count_widgets(self.root)
+        traced_bytes, by_module = traced_by_module()
+        report = MemoryReport(
+            generations=len(store),
+            store_bytes=store.memory_bytes(),
+            sqlite_bytes=sqlite_bytes,
+            widgets=widgets,
+            undo_chars=undo_chars,
+            queued_messages=sum(app.task.sync_queue_depths().values()),
+            mailboxes=len(app.task.mailboxes),
+            traced_bytes=traced_bytes,
+            by_module=by_module,
+            peak_rss_bytes=peak_rss_bytes(),
+        )
+
+        for subsystem, size in (
+            ("store", report.store_bytes),
+            ("sqlite", report.sqlite_bytes),
+            ("traced", report.traced_bytes),
+            ("peak_rss", report.peak_rss_bytes),
+        ):
+            if size is not None:
+                REGISTRY.gauge(
+                    "memory_bytes", "memory used, by subsystem", subsystem=subsystem
+                ).set(size)
+        REGISTRY.gauge("widgets", "tk widgets that exist").set(report.widget_count)
+        REGISTRY.gauge("undo_chars", "characters in text undo stacks").set(
+            report.undo_chars
+        )
+        return report
@@ -0,0 +1,310 @@
+"""In-process counters, gauges and histograms, shared by both threads.
+
+Everything registers itself in REGISTRY, which can be shown in the
+metrics window, or written out as JSON or Prometheus text."""
+import abc
+import json
+import math
+import time
+import asyncio
+import logging
+import functools
+import threading
+import contextlib
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# histogram buckets are exact up to 2**SUB_BUCKET_BITS units, then split
+# every power of two in 2**(SUB_BUCKET_BITS - 1) buckets, so values are
+# kept within ~3% of what was recorded no matter their magnitude
+SUB_BUCKET_BITS = 6
+
+# what a histogram of seconds can tell apart
+SECONDS_RESOLUTION = 1e-6
+
+# quantiles shown for histograms
+QUANTILES = (0.5, 0.9, 0.99)
+
+# prefix of every metric in prometheus text
+PROMETHEUS_PREFIX = "synthnav_"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def bucket_index(units: int) -> int:
+    if units < 2**SUB_BUCKET_BITS:
+        return units
+    exponent = units.bit_length() - SUB_BUCKET_BITS
+    half = 2 ** (SUB_BUCKET_BITS - 1)
+    return 2**SUB_BUCKET_BITS + (exponent - 1) * half + (units >> exponent) - half
+
+
+def bucket_bounds(index: int) -> Tuple[int, int]:
+    """Lowest and highest value (in units) that go in a bucket."""
+    if index < 2**SUB_BUCKET_BITS:
+        return index, index
+    half = 2 ** (SUB_BUCKET_BITS - 1)
+    exponent, top = divmod(index - 2**SUB_BUCKET_BITS, half)
+    exponent += 1
+    top += half
+    return top << exponent, ((top + 1) << exponent) - 1
+
+
+class Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def as_dict(self) -> Dict:
+        """What the metric is at, for reports."""
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def as_dict(self) -> Dict:
+        return {"value": self.value}
+
+
+class Gauge(Metric):
+    """Either set to a value, or read from a function when collected."""
+
+    kind = "gauge"
+
+    def __init__(self, *args, function: Optional[Callable[[], float]] = None):
+        super().__init__(*args)
+        self._value = 0
+        self.function = function
+
+    def set(self, value: float):
+        self._value = value
+
+    @property
+    def value(self) -> float:
+        return self.function() if self.function else self._value
+
+    def as_dict(self) -> Dict:
+        return {"value": self.value}
+
+
+class Histogram(Metric):
+    """Log-linear histogram in the style of HdrHistogram, recording values
+    at a fixed resolution with bounded relative error."""
+
+    kind = "histogram"
+
+    def __init__(self, *args, resolution: float = SECONDS_RESOLUTION):
+        super().__init__(*args)
+        self.resolution = resolution
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def record(self, value: float):
+        index = bucket_index(max(0, round(value / self.resolution)))
+        with self._lock:
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+            self.count += 1
+            self.total += value
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+
+    @contextlib.contextmanager
+    def time(self):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(time.monotonic() - start)
+
+    def quantile(self, quantile: float) -> float:
+        with self._lock:
+            if not self.count:
+                return 0.0
+            wanted = max(1, math.ceil(quantile * self.count))
+            seen = 0
+            for index in sorted(self.buckets):
+                seen += self.buckets[index]
+                if seen >= wanted:
+                    lowest, highest = bucket_bounds(index)
+                    value = (lowest + highest) / 2 * self.resolution
+                    return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def as_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.mean,
+            "min": self.min if self.count else 0.0,
+            "max": self.max if self.count else 0.0,
+            **{
+                f"p{quantile * 100:g}": self.quantile(quantile)
+                for quantile in QUANTILES
+            },
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[Tuple[str, Labels], Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, metric_class, name: str, help: str, labels: Dict, **kwargs):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = metric_class(name, help, key[1], **kwargs)
+                self._metrics[key] = metric
+        if not isinstance(metric, metric_class):
+            raise TypeError(f"{name} is a {metric.kind}, not a {metric_class.kind}")
+        return metric
+
+    def counter(self, name: str, help: str = "", **labels) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def gauge(
+        self,
+        name: str,
+        help: str = "",
+        *,
+        function: Optional[Callable[[], float]] = None,
+        **labels,
+    ) -> Gauge:
+        gauge = self._get(Gauge, name, help, labels)
+        if function:
+            gauge.function = function
+        return gauge
+
+    def histogram(
+        self,
+        name: str,
+        help: str = "",
+        *,
+        resolution: float = SECONDS_RESOLUTION,
+        **labels,
+    ) -> Histogram:
+        return self._get(Histogram, name, help, labels, resolution=resolution)
+
+    def collect(self) -> List[Metric]:
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda m: (m.name, m.labels))
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def to_json(self) -> Dict:
+        return {
+            "created_at": time.time(),
+            "metrics": [
+                {
+                    "name": metric.name,
+                    "kind": metric.kind,
+                    "labels": dict(metric.labels),
+                    **metric.as_dict(),
+                }
+                for metric in self.collect()
+            ],
+        }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        described = set()
+        for metric in self.collect():
+            name = PROMETHEUS_PREFIX + metric.name
+            if name not in described:
+                described.add(name)
+                kind = "summary" if metric.kind == "histogram" else metric.kind
+                if metric.help:
+                    lines.append(f"# HELP {name} {metric.help}")
+                lines.append(f"# TYPE {name} {kind}")
+
+            if isinstance(metric, Histogram):
+                for quantile in QUANTILES:
+                    labels = _prometheus_labels(
+                        metric.labels + (("quantile", str(quantile)),)
+                    )
+                    lines.append(f"{name}{labels} {metric.quantile(quantile)}")
+                labels = _prometheus_labels(metric.labels)
+                lines.append(f"{name}_sum{labels} {metric.total}")
+                lines.append(f"{name}_count{labels} {metric.count}")
+            else:
+                lines.append(
+                    f"{name}{_prometheus_labels(metric.labels)} {metric.value}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+def _prometheus_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"')) for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def timed(name: str, help: str = "", **labels):
+    """Record how long every call of the decorated function takes."""
+
+    def wrapper(function):
+        @functools.wraps(function)
+        def wrapped(*args, **kwargs):
+            with REGISTRY.histogram(name, help, **labels).time():
+                return function(*args, **kwargs)
+
+        return wrapped
+
+    return wrapper
+
+
+def write_metrics(path: Path, registry: MetricsRegistry = REGISTRY):
+    """Write metrics as Prometheus text if the file name ends in .prom,
+    else as JSON. The file is replaced at once, so readers never see it
+    half written."""
+    if path.suffix == ".prom":
+        content = registry.to_prometheus()
+    else:
+        content = json.dumps(registry.to_json(), indent=2)
+    temporary_path = path.with_name(path.name + ".tmp")
+    temporary_path.write_text(content)
+    temporary_path.replace(path)
+
+
+async def write_metrics_forever(path: Path, interval: float):
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                write_metrics(path)
+            except OSError:
+                log.exception("failed to write metrics to %s", path)
+    finally:
+        # one last time, for the tail end of the run
+        write_metrics(path)
@@ -0,0 +1,59 @@
+import logging
+import tkinter as tk
+from .metrics import QUANTILES, REGISTRY, Histogram
+
+log = logging.getLogger(__name__)
+
+METRICS_REFRESH_MS = 1000
+
+
+def format_value(name: str, value: float) -> str:
+    if name.endswith("_seconds"):
+        return f"{value * 1000:.1f}ms"
+    return f"{value:g}"
+
+
+class MetricsView:
+    """Window with every metric, refreshed while it's open."""
+
+    def __init__(self, window):
+        self.window = window
+
+    def create_widgets(self, *args, **kwargs):
+        self.toplevel = tk.Toplevel(*args, **kwargs)
+        self.toplevel.title("synthnav metrics")
+
+        self.text = tk.Text(self.toplevel, width=110, height=30, font="TkFixedFont")
+        self.text.grid(row=0, column=0, sticky="nswe")
+        self.toplevel.rowconfigure(0, weight=1)
+        self.toplevel.columnconfigure(0, weight=1)
+        self.refresh()
+
+    def refresh(self):
+        if not self.toplevel.winfo_exists():
+            return
+
+        lines = [
+            f"{'metric':<62} {'count':>8} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}"
+        ]
+        for metric in REGISTRY.collect():
+            labels = ",".join(f"{key}={value}" for key, value in metric.labels)
+            title = f"{metric.name}{{{labels}}}" if labels else metric.name
+            if isinstance(metric, Histogram):
+                values = [metric.quantile(quantile) for quantile in QUANTILES] + [
+                    metric.max if metric.count else 0
+                ]
+                formatted = " ".join(
+                    f"{format_value(metric.name, value):>9}" for value in values
+                )
+                lines.append(f"{title:<62} {metric.count:>8} {formatted}")
+            else:
+                lines.append(
+                    f"{title:<62} {format_value(metric.name, metric.value):>8}"
+                )
+
+        self.text.configure(state=tk.NORMAL)
+        self.text.delete("1.0", tk.END)
+        self.text.insert("1.0", "\n".join(lines))
+        self.text.configure(state=tk.DISABLED)
+        self.toplevel.after(METRICS_REFRESH_MS, self.refresh)
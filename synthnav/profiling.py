@@ -0,0 +1,164 @@
+"""Profile the tk and asyncio threads together.
+
+Deterministic profiling runs cProfile in each thread, and writes a
+pstats file per thread. Sampling looks at both threads' stacks from a
+separate thread, and writes a collapsed stack file per thread, which
+flamegraph tools can read."""
+import sys
+import enum
+import time
+import asyncio
+import cProfile
+import logging
+import threading
+import collections
+from pathlib import Path
+from typing import Callable, Counter, Dict, Optional
+from .tinytask import ASYNCIO_THREAD_NAME
+
+log = logging.getLogger(__name__)
+
+# how often the sampling profiler looks at stacks
+SAMPLE_INTERVAL = 0.005
+
+TK_THREAD_NAME = "tk"
+
+
+class ProfileMode(enum.Enum):
+    SAMPLING = "sampling"
+    DETERMINISTIC = "deterministic"
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{code.co_qualname}"
+
+
+def collapsed_stack(frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """Started and stopped from the tk thread, which must be the main
+    thread. The asyncio side is done in the loop's own thread."""
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        directory: Path,
+        label: Callable[[], str] = lambda: "",
+    ):
+        self.loop = loop
+        self.directory = directory
+        self.label = label
+        self.mode: Optional[ProfileMode] = None
+        self.started_at = 0.0
+
+        self._tk_profile: Optional[cProfile.Profile] = None
+        self._asyncio_profile: Optional[cProfile.Profile] = None
+
+        self._sampler: Optional[threading.Thread] = None
+        self._stop_sampling = threading.Event()
+        self._samples: Dict[str, Counter[str]] = {}
+
+    @property
+    def running(self) -> bool:
+        return self.mode is not None
+
+    def start(self, mode: ProfileMode):
+        assert threading.current_thread() is threading.main_thread()
+        if self.running:
+            log.warning("already profiling (%s)", self.mode.value)
+            return
+
+        log.info("start %s profiling", mode.value)
+        self.mode = mode
+        self.started_at = time.time()
+        match mode:
+            case ProfileMode.DETERMINISTIC:
+                self._tk_profile = cProfile.Profile()
+                self._asyncio_profile = cProfile.Profile()
+                self._tk_profile.enable()
+                # profiles only cover the thread they were enabled in
+                self.loop.call_soon_threadsafe(self._asyncio_profile.enable)
+            case ProfileMode.SAMPLING:
+                self._samples = {
+                    TK_THREAD_NAME: collections.Counter(),
+                    ASYNCIO_THREAD_NAME: collections.Counter(),
+                }
+                self._stop_sampling.clear()
+                self._sampler = threading.Thread(
+                    target=self._sample_forever, name="profiler", daemon=True
+                )
+                self._sampler.start()
+
+    def stop(self):
+        """Stop profiling and write its results. The asyncio thread's file
+        is written by that thread, soon after this returns."""
+        assert threading.current_thread() is threading.main_thread()
+        if not self.running:
+            return
+
+        mode, self.mode = self.mode, None
+        match mode:
+            case ProfileMode.DETERMINISTIC:
+                self._tk_profile.disable()
+                self._write_pstats(self._tk_profile, TK_THREAD_NAME)
+
+                asyncio_profile = self._asyncio_profile
+
+                def stop_in_loop():
+                    asyncio_profile.disable()
+                    self._write_pstats(asyncio_profile, ASYNCIO_THREAD_NAME)
+
+                self.loop.call_soon_threadsafe(stop_in_loop)
+                self._tk_profile = self._asyncio_profile = None
+            case ProfileMode.SAMPLING:
+                self._stop_sampling.set()
+                self._sampler.join()
+                self._sampler = None
+                for thread_name, samples in self._samples.items():
+                    self._write_collapsed(samples, thread_name)
+
+    def _path(self, thread_name: str, suffix: str) -> Path:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        timestamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started_at))
+        label = self.label()
+        parts = [timestamp, thread_name] + ([label] if label else [])
+        return self.directory / ("-".join(parts) + suffix)
+
+    def _write_pstats(self, profile: cProfile.Profile, thread_name: str):
+        path = self._path(thread_name, ".pstats")
+        profile.dump_stats(path)
+        log.info("wrote %s profile to %s", thread_name, path)
+
+    def _write_collapsed(self, samples: Counter[str], thread_name: str):
+        path = self._path(thread_name, ".collapsed")
+        with path.open("w", encoding="utf-8") as fd:
+            for stack, count in samples.most_common():
+                fd.write(f"{stack} {count}\n")
+        log.info("wrote %d %s samples to %s", sum(samples.values()), thread_name, path)
+
+    def _thread_idents(self) -> Dict[int, str]:
+        idents = {threading.main_thread().ident: TK_THREAD_NAME}
+        for thread in threading.enumerate():
+            if thread.name == ASYNCIO_THREAD_NAME:
+                idents[thread.ident] = ASYNCIO_THREAD_NAME
+        return idents
+
+    def _sample_forever(self):
+        idents = self._thread_idents()
+        while not self._stop_sampling.wait(SAMPLE_INTERVAL):
+            if len(idents) < len(self._samples):
+                # the asyncio thread may start after profiling did
+                idents = self._thread_idents()
+            frames = sys._current_frames()
+            for ident, thread_name in idents.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    self._samples[thread_name][collapsed_stack(frame)] += 1
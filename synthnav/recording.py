@@ -0,0 +1,135 @@
+"""Record generation streams with their timing, and play them back in
+place of the server.
+
+Recordings are JSON lines, gzipped when the file name ends in .gz, one
+generation per line."""
+import gzip
+import json
+import time
+import asyncio
+import logging
+import dataclasses
+from pathlib import Path
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List
+from .codec import text_hash
+
+log = logging.getLogger(__name__)
+
+
+class ReplayedFailure(ConnectionError):
+    """The recorded generation failed midway through."""
+
+
+@dataclass
+class GenerationRecording:
+    prompt_hash: str
+    prompt_length: int
+    settings: Dict
+    seed: int
+    # microseconds between each token and the one before it, the first one
+    # counting from when the generation was asked for
+    delays: List[int]
+    tokens: List[str]
+    # if the stream ended, instead of failing midway through
+    complete: bool
+
+
+def _open(path: Path, mode: str):
+    if path.suffix == ".gz":
+        return gzip.open(path, mode + "t")
+    return path.open(mode)
+
+
+def load_recordings(path: Path) -> List[GenerationRecording]:
+    with _open(path, "r") as fd:
+        return [GenerationRecording(**json.loads(line)) for line in fd if line.strip()]
+
+
+class Recorder:
+    def __init__(self, path: Path):
+        self.path = path
+
+    def write(self, recording: GenerationRecording):
+        with _open(self.path, "a") as fd:
+            fd.write(json.dumps(dataclasses.asdict(recording), separators=(",", ":")))
+            fd.write("\n")
+
+    def record(
+        self, prompt: str, settings: Dict, seed: int, tokens: AsyncIterator[str]
+    ) -> AsyncIterator[str]:
+        """Pass tokens through, writing them down once the stream is over,
+        be it by ending or by failing.
+
+        The first delay counts from this call, not from when the stream is
+        first iterated, so it includes connecting to the server."""
+        recording = GenerationRecording(
+            prompt_hash=text_hash(prompt),
+            prompt_length=len(prompt),
+            settings=settings,
+            seed=seed,
+            delays=[],
+            tokens=[],
+            complete=False,
+        )
+        return self._record(recording, time.monotonic(), tokens)
+
+    async def _record(
+        self,
+        recording: GenerationRecording,
+        last_timestamp: float,
+        tokens: AsyncIterator[str],
+    ) -> AsyncIterator[str]:
+        try:
+            async for token in tokens:
+                timestamp = time.monotonic()
+                recording.delays.append(round((timestamp - last_timestamp) * 1e6))
+                recording.tokens.append(token)
+                last_timestamp = timestamp
+                yield token
+            recording.complete = True
+        finally:
+            self.write(recording)
+
+
+class Replayer:
+    """Plays recordings back, picking the one for the same prompt if
+    there is one, or else the next one in the file.
+
+    A speed of 2 plays twice as fast, 0 plays as fast as possible."""
+
+    def __init__(self, recordings: List[GenerationRecording], speed: float = 1.0):
+        self.recordings = recordings
+        self.speed = speed
+        self.unplayed = list(range(len(recordings)))
+        if not recordings:
+            raise ValueError("no recordings to replay")
+
+    @classmethod
+    def from_path(cls, path: Path, speed: float = 1.0) -> "Replayer":
+        return cls(load_recordings(path), speed)
+
+    def pick(self, prompt: str) -> GenerationRecording:
+        if not self.unplayed:
+            # start over once everything played
+            self.unplayed = list(range(len(self.recordings)))
+
+        prompt_hash = text_hash(prompt)
+        position = next(
+            (
+                position
+                for position, index in enumerate(self.unplayed)
+                if self.recordings[index].prompt_hash == prompt_hash
+            ),
+            0,
+        )
+        return self.recordings[self.unplayed.pop(position)]
+
+    async def replay(self, prompt: str) -> AsyncIterator[str]:
+        recording = self.pick(prompt)
+        for delay, token in zip(recording.delays, recording.tokens):
+            # sleeping for 0 still lets other tasks run, like a real stream
+            await asyncio.sleep(delay / 1e6 / self.speed if self.speed else 0)
+            yield token
+        if not recording.complete:
+            raise ReplayedFailure("recorded generation failed here")
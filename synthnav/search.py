@@ -0,0 +1,99 @@
+import logging
+import tkinter as tk
+from uuid import UUID
+from typing import List
+from .context import app
+from .tinytask import TaskFailed
+
+log = logging.getLogger(__name__)
+
+# wait for the user to stop typing before hitting the db
+SEARCH_DEBOUNCE_MS = 150
+SEARCH_RESULT_LIMIT = 50
+
+
+class SearchView:
+    """Search box that finds generations by their text and scrolls the
+    tree to them."""
+
+    def __init__(self, window):
+        self.window = window
+        self.current_search_pid = None
+        self.pending_search = None
+        self.result_ids: List[UUID] = []
+
+    def create_widgets(self, *args, **kwargs):
+        self.toplevel = tk.Toplevel(*args, **kwargs)
+        self.toplevel.title("synthnav search")
+
+        self.query = tk.StringVar()
+        self.query.trace_add("write", self.on_query_change)
+        self.entry = tk.Entry(self.toplevel, textvariable=self.query, width=60)
+        self.entry.bind("<Key-Return>", self.on_wanted_select)
+        self.entry.bind("<Key-Down>", self.on_wanted_results_focus)
+
+        self.results = tk.Listbox(self.toplevel, width=80, height=15)
+        self.results.bind("<<ListboxSelect>>", self.on_wanted_select)
+
+        self.entry.grid(row=0, column=0, sticky="we")
+        self.results.grid(row=1, column=0, sticky="nswe")
+        self.entry.focus_set()
+
+    def on_query_change(self, *_args):
+        if self.pending_search:
+            self.toplevel.after_cancel(self.pending_search)
+        self.pending_search = self.toplevel.after(SEARCH_DEBOUNCE_MS, self.search)
+
+    def search(self):
+        self.pending_search = None
+        self.results.delete(0, tk.END)
+        self.result_ids = []
+
+        query = self.query.get()
+        if not query.strip():
+            self.current_search_pid = None
+            return
+
+        self.current_search_pid = app.task.call(
+            app.db.search,
+            self.on_search_event,
+            args=[query],
+            kwargs={"limit": SEARCH_RESULT_LIMIT},
+        )
+
+    def on_search_event(self, reply_id, data):
+        if reply_id != self.current_search_pid:
+            # results of an older query, user kept typing
+            return
+        if not self.toplevel.winfo_exists():
+            return
+        if isinstance(data, TaskFailed):
+            self.window.report_task_failure("search", data)
+            return
+
+        match data[0]:
+            case "hit":
+                generation_id, snippet = data[1], data[2]
+                self.result_ids.append(generation_id)
+                self.results.insert(tk.END, snippet.replace("\n", " "))
+            case "done":
+                log.debug("search got %d results", len(self.result_ids))
+            case _:
+                raise AssertionError(f"unexpected message type {data[0]}")
+
+    def on_wanted_results_focus(self, _event):
+        if self.result_ids:
+            self.results.focus_set()
+            self.results.selection_set(0)
+            self.results.event_generate("<<ListboxSelect>>")
+
+    def on_wanted_select(self, _event=None):
+        selection = self.results.curselection()
+        if not selection:
+            if not self.result_ids:
+                return
+            selection = (0,)
+
+        generation_id = self.result_ids[selection[0]]
+        if self.window.tree:
+            self.window.tree.scroll_to(generation_id)
@@ -0,0 +1,203 @@
+import logging
+from copy import deepcopy
+import tkinter as tk
+from tkinter import ttk
+from idlelib.tooltip import Hovertip
+from dataclasses import asdict, fields
+import tkfontchooser
+from .util.widgets import CustomText
+from .config import Config
+
+log = logging.getLogger(__name__)
+
+
+class SettingsView:
+    def __init__(self, config: Config):
+        self.current_readonly_config = config
+        self.view_config = deepcopy(config)
+
+    def create_widgets(self, *args, **kwargs):
+        self.toplevel = tk.Toplevel(*args, **kwargs)
+        self.toplevel.title("synthnav settings")
+
+        self.notebook = ttk.Notebook(self.toplevel)
+
+        self.general_settings = ttk.Frame(self.notebook)
+        self.create_general_settings_widgets()
+
+        self.interface_settings = ttk.Frame(self.notebook)
+        self.create_interface_settings_widgets()
+
+        self.generation_settings = ttk.Frame(self.notebook)
+        self.create_generation_settings_widgets()
+
+        self.notebook.add(self.general_settings, text="General")
+        self.notebook.add(self.interface_settings, text="Interface")
+        self.notebook.add(self.generation_settings, text="Generation")
+        self.notebook.pack()
+
+        self.buttons = tk.Frame(self.toplevel)
+        self.apply_button = ttk.Button(
+            self.buttons, text="Apply", state="disabled", command=self.on_wanted_apply
+        )
+        self.apply_button.grid(row=0, column=0)
+
+        self.cancel_button = tk.Button(
+            self.buttons, text="Cancel", command=self.on_wanted_cancel
+        )
+        self.cancel_button.grid(row=0, column=1)
+        self.buttons.pack()
+
+    def on_wanted_cancel(self):
+        self.toplevel.destroy()
+
+    def on_wanted_apply(self):
+        print("TODO")
+
+    def on_config_change(self):
+        if (
+            self.view_config.server_address
+            == self.current_readonly_config.server_address
+        ):
+            self.notebook.tab(0, text="General")
+        else:
+            self.notebook.tab(0, text="General*")
+
+        print("v", self.view_config.ui_settings)
+        print("c", self.current_readonly_config.ui_settings)
+
+        if self.view_config.ui_settings == self.current_readonly_config.ui_settings:
+            self.notebook.tab(1, text="Interface")
+        else:
+            self.notebook.tab(1, text="Interface*")
+
+        if (
+            self.view_config.generation_settings
+            == self.current_readonly_config.generation_settings
+        ):
+            self.notebook.tab(2, text="Generation")
+        else:
+            self.notebook.tab(2, text="Generation*")
+
+        if self.view_config == self.current_readonly_config:
+            self.apply_button.state(["disabled"])
+        else:
+            self.apply_button.state(["!disabled"])
+
+    def on_edited_general_settings_server_address(self, _event):
+        new_server_address = self.server_address.get("1.0", "end").strip()
+        log.debug("new addr: %r", new_server_address)
+        self.view_config.server_address = new_server_address
+        self.on_config_change()
+
+    def create_general_settings_widgets(self):
+        self.server_address = CustomText(
+            self.general_settings,
+            height=1,
+            width=50,
+            command=self.on_edited_general_settings_server_address,
+        )
+        self.server_address.insert(tk.END, self.current_readonly_config.server_address)
+
+        key_label = tk.Label(self.general_settings, text="textgen-webui address")
+        key_label.grid(row=0, column=0)
+        self.server_address.grid(row=0, column=1)
+
+    def create_interface_settings_widgets(self):
+        key_label = tk.Label(self.interface_settings, text="Font")
+
+        font_name, font_size = (
+            self.view_config.ui_settings.font_name,
+            self.view_config.ui_settings.font_size,
+        )
+        self.font_button = tk.Button(
+            self.interface_settings,
+            text=f"{font_name} {font_size}",
+            font=(font_name, font_size),
+            command=self.on_wanted_font_change,
+        )
+
+        key_label.grid(row=0, column=0)
+        self.font_button.grid(row=0, column=1)
+
+    def on_wanted_font_change(self):
+        font_name, font_size = (
+            self.view_config.ui_settings.font_name,
+            self.view_config.ui_settings.font_size,
+        )
+
+        font = tkfontchooser.askfont(self.toplevel, family=font_name, size=font_size)
+        if font:
+            font_name, font_size = font["family"], font["size"]
+            self.view_config.ui_settings.font_name = font_name
+            self.view_config.ui_settings.font_size = font_size
+            self.font_button.configure(
+                text=f"{font_name} {font_size}",
+                font=(font_name, font_size),
+            )
+            self.on_config_change()
+
+    def on_written_generation_field(self, field_name: str, *, type):
+        def handler():
+            value_widget = self.key_value_widgets[field_name]
+            match type:
+                case "bool":
+                    value = self.generation_settings.getvar(name=f"gen_{field_name}")
+                case "float":
+                    value = float(value_widget.get())
+                case "int":
+                    value = int(value_widget.get())
+                case _:
+                    raise AssertionError("invalid type " + repr(type))
+            setattr(self.view_config.generation_settings, field_name, value)
+            self.on_config_change()
+
+        return handler
+
+    def create_generation_settings_widgets(self):
+        # TODO refactor into single loop
+        self.key_value_widgets = {}
+        descriptions = {}
+
+        values = asdict(self.current_readonly_config.generation_settings)
+
+        for field in fields(self.current_readonly_config.generation_settings):
+            key = field.name
+            print(key, field.default.title)
+            print(field)
+            field_data = field.default
+            descriptions[key] = field_data.description
+
+            if field.type == bool:
+                self.key_value_widgets[key] = ttk.Checkbutton(
+                    self.generation_settings,
+                    variable=tk.BooleanVar(
+                        self.generation_settings, name=f"gen_{key}", value=values[key]
+                    ),
+                    onvalue=True,
+                    offvalue=False,
+                    command=self.on_written_generation_field(field.name, type="bool"),
+                )
+            elif field.type in (int, float):
+                # use Spinbox
+                entry = ttk.Spinbox(
+                    self.generation_settings,
+                    from_=field_data.ge,
+                    to=field_data.le,
+                    increment=field_data.extra.get("increment", 1),
+                    command=self.on_written_generation_field(
+                        field.name, type=str(field.type.__name__)
+                    ),
+                )
+                entry.set(values[key])
+                self.key_value_widgets[key] = entry
+
+        for index, key in enumerate(values.keys()):
+            value_widget = self.key_value_widgets.get(key)
+            if not value_widget:
+                continue
+
+            key_label = tk.Label(self.generation_settings, text=key)
+            key_label.grid(row=index, column=0)
+            key_tip = Hovertip(key_label, descriptions[key])
+            value_widget.grid(row=index, column=1)
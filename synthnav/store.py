@@ -0,0 +1,515 @@
+"""Compact in-memory representation of a whole story tree.
+
+Each generation is a row, with UUIDs interned into dense integer indices
+and the tree kept as parallel arrays (parent, first child, next sibling),
+so that big trees don't cost a python object and a list per node.
+
+Aggregates (subtree sizes, depths, character counts, ...) are kept up to
+date as generations are added or edited, so that nothing needs to walk
+the whole tree to know them."""
+import sys
+from array import array
+from dataclasses import dataclass
+from uuid import UUID
+from typing import Dict, Iterator, List, Optional, Set
+from .generation import Generation, GenerationMixin, GenerationState
+
+# index meaning "no such generation", like a root's parent
+NO_INDEX = -1
+
+# what a UUID object and the int inside it take
+UUID_SIZE = sys.getsizeof(UUID(int=2**127)) + sys.getsizeof(2**127)
+# what an (ascii) str takes besides its characters
+STR_OVERHEAD = sys.getsizeof("")
+
+
+@dataclass(frozen=True)
+class TreeStats:
+    generations: int
+    roots: int
+    leaves: int
+    # depth of the deepest generation, the root being at 0
+    max_depth: int
+    total_chars: int
+    # tokens the model generated into the story
+    generated_tokens: int
+
+
+class StoredGeneration(GenerationMixin):
+    """Generation facade over a GenerationStore row, so code that works
+    with Generation keeps working with the store.
+
+    Facades are created on access and are cheap to throw away. Two of them
+    are equal if they're about the same row."""
+
+    __slots__ = ("store", "index")
+
+    def __init__(self, store: "GenerationStore", index: int):
+        self.store = store
+        self.index = index
+
+    @property
+    def id(self) -> UUID:
+        return self.store.ids[self.index]
+
+    @property
+    def parent(self) -> Optional[UUID]:
+        parent_index = self.store.parents[self.index]
+        if parent_index == NO_INDEX:
+            return None
+        return self.store.ids[parent_index]
+
+    @property
+    def children(self) -> tuple:
+        """Read-only, use GenerationStore.add to add children."""
+        return tuple(
+            self.store.ids[child_index]
+            for child_index in self.store.children_indices(self.index)
+        )
+
+    @property
+    def state(self) -> GenerationState:
+        return GenerationState(self.store.states[self.index])
+
+    @state.setter
+    def state(self, state: GenerationState):
+        self.store.states[self.index] = state
+
+    @property
+    def text(self) -> Optional[str]:
+        return self.store.text(self.index)
+
+    @text.setter
+    def text(self, text: Optional[str]):
+        self.store.set_text(self.index, text)
+
+    @property
+    def is_projected(self) -> bool:
+        # without materializing text that's still streaming in
+        return self.store.texts[self.index] is None
+
+    def append_text(self, chunk: str) -> None:
+        self.store.append_text(self.index, chunk)
+
+    @property
+    def preview(self) -> Optional[str]:
+        return self.store.previews[self.index]
+
+    @preview.setter
+    def preview(self, preview: Optional[str]):
+        self.store.previews[self.index] = preview
+
+    @property
+    def text_length(self) -> int:
+        return self.store.text_lengths[self.index]
+
+    @property
+    def text_hash(self) -> Optional[str]:
+        return self.store.text_hashes[self.index]
+
+    @property
+    def version(self) -> int:
+        return self.store.versions[self.index]
+
+    @version.setter
+    def version(self, version: int):
+        self.store.versions[self.index] = version
+
+    @property
+    def collapsed(self) -> bool:
+        return bool(self.store.collapsed[self.index])
+
+    @collapsed.setter
+    def collapsed(self, collapsed: bool):
+        self.store.collapsed[self.index] = collapsed
+
+    @property
+    def depth(self) -> int:
+        return self.store.depths[self.index]
+
+    @property
+    def subtree_size(self) -> int:
+        """How many generations are in this one's subtree, itself included."""
+        return self.store.subtree_sizes[self.index]
+
+    @property
+    def subtree_height(self) -> int:
+        """How many levels there are below this generation."""
+        return self.store.subtree_heights[self.index]
+
+    @property
+    def subtree_chars(self) -> int:
+        self.store.settle()
+        return self.store.subtree_chars[self.index]
+
+    @property
+    def subtree_leaves(self) -> int:
+        return self.store.subtree_leaves[self.index]
+
+    @property
+    def path_chars(self) -> int:
+        """Characters from the root up to (and including) this generation,
+        roughly how long a prompt from it is."""
+        self.store.settle()
+        return self.store.path_chars[self.index]
+
+    @property
+    def tokens(self) -> int:
+        """Tokens the model generated into this generation."""
+        return self.store.tokens[self.index]
+
+    @property
+    def subtree_tokens(self) -> int:
+        self.store.settle()
+        return self.store.subtree_tokens[self.index]
+
+    def count_generated_token(self) -> None:
+        self.store.count_generated_token(self.index)
+
+    def __eq__(self, other):
+        if not isinstance(other, StoredGeneration):
+            return NotImplemented
+        return self.store is other.store and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))
+
+    def __repr__(self):
+        return f"Generation<{self.id!s}>"
+
+
+class GenerationStore:
+    """All generations of a story, indexable by their UUID like the dict
+    it replaces.
+
+    Adding a generation or changing its text updates the aggregates of its
+    ancestors, which is O(depth), and path_chars of its descendants.
+    Streamed text and tokens only update the generation they go into and
+    the store's totals, in O(1), and reach the aggregates of other
+    generations once settle() is called, which reading them does.
+    Stories loaded from the db come in no particular order, so when made
+    with bulk=True, per-generation aggregates are only computed once
+    finish_bulk_load is called."""
+
+    def __init__(self, *, bulk: bool = False):
+        self.ids: List[UUID] = []
+        self.indices: Dict[UUID, int] = {}
+
+        self.parents = array("i")
+        self.first_children = array("i")
+        # only used to append children in O(1) while keeping their order
+        self.last_children = array("i")
+        self.next_siblings = array("i")
+
+        self.states = array("b")
+        self.collapsed = array("b")
+        self.versions = array("q")
+        self.text_lengths = array("q")
+        self.texts: List[Optional[str]] = []
+        # text streaming into a generation, kept as chunks until it's needed
+        # as a whole so that every token doesn't copy the text so far
+        self.pending_chunks: Dict[int, List[str]] = {}
+        self.previews: List[Optional[str]] = []
+        self.text_hashes: List[Optional[str]] = []
+
+        self.incremental = not bulk
+        self.depths = array("i")
+        self.subtree_sizes = array("i")
+        self.subtree_heights = array("i")
+        self.subtree_chars = array("q")
+        self.subtree_leaves = array("i")
+        # characters from the root down to each generation
+        self.path_chars = array("q")
+        self.tokens = array("q")
+        self.subtree_tokens = array("q")
+        # index -> [chars, tokens] streamed into it that the aggregates of
+        # other generations don't include yet
+        self.unsettled: Dict[int, List[int]] = {}
+
+        self.root_indices: Set[int] = set()
+        self.leaf_count = 0
+        self.max_depth = 0
+        self.total_chars = 0
+        self.generated_tokens = 0
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, generation_id: UUID) -> bool:
+        return generation_id in self.indices
+
+    def __getitem__(self, generation_id: UUID) -> StoredGeneration:
+        return StoredGeneration(self, self.indices[generation_id])
+
+    def get(self, generation_id: UUID) -> Optional[StoredGeneration]:
+        index = self.indices.get(generation_id)
+        if index is None:
+            return None
+        return StoredGeneration(self, index)
+
+    def values(self) -> Iterator[StoredGeneration]:
+        for index in range(len(self.ids)):
+            yield StoredGeneration(self, index)
+
+    def intern(self, generation_id: UUID) -> int:
+        """Index of the given generation, making an empty row for it if
+        there's none, so that children can come in before their parents."""
+        index = self.indices.get(generation_id)
+        if index is not None:
+            return index
+
+        index = len(self.ids)
+        self.ids.append(generation_id)
+        self.indices[generation_id] = index
+        self.parents.append(NO_INDEX)
+        self.first_children.append(NO_INDEX)
+        self.last_children.append(NO_INDEX)
+        self.next_siblings.append(NO_INDEX)
+        self.states.append(GenerationState.PENDING)
+        self.collapsed.append(False)
+        self.versions.append(0)
+        self.text_lengths.append(0)
+        self.texts.append(None)
+        self.previews.append(None)
+        self.text_hashes.append(None)
+
+        self.depths.append(0)
+        self.subtree_sizes.append(1)
+        self.subtree_heights.append(0)
+        self.subtree_chars.append(0)
+        self.subtree_leaves.append(1)
+        self.path_chars.append(0)
+        self.tokens.append(0)
+        self.subtree_tokens.append(0)
+        self.root_indices.add(index)
+        self.leaf_count += 1
+        return index
+
+    def add(self, generation: Generation) -> StoredGeneration:
+        """Copy a generation into the store, as the last child of its
+        parent. Its own children are not copied."""
+        index = self.intern(generation.id)
+        self.states[index] = generation.state
+        self.collapsed[index] = generation.collapsed
+        self.versions[index] = generation.version
+        self.set_text_length(index, generation.text_length)
+        self.set_tokens(index, generation.tokens)
+        self.pending_chunks.pop(index, None)
+        self.texts[index] = generation.text
+        self.previews[index] = generation.preview
+        self.text_hashes[index] = generation.text_hash
+        if generation.parent is not None:
+            self.link(self.intern(generation.parent), index)
+        return StoredGeneration(self, index)
+
+    def link(self, parent_index: int, child_index: int) -> None:
+        assert self.parents[child_index] == NO_INDEX, "generation already has parent"
+        self.parents[child_index] = parent_index
+        self.root_indices.discard(child_index)
+        last_child = self.last_children[parent_index]
+        # the parent was a leaf itself until now
+        was_leaf = last_child == NO_INDEX
+        if was_leaf:
+            self.first_children[parent_index] = child_index
+            self.leaf_count -= 1
+        else:
+            self.next_siblings[last_child] = child_index
+        self.last_children[parent_index] = child_index
+
+        if not self.incremental:
+            return
+
+        depth_change = self.depths[parent_index] + 1 - self.depths[child_index]
+        path_change = self.path_chars[parent_index]
+        if depth_change or path_change:
+            for index in self.walk(child_index):
+                self.depths[index] += depth_change
+                self.path_chars[index] += path_change
+
+        size = self.subtree_sizes[child_index]
+        chars = self.subtree_chars[child_index]
+        tokens = self.subtree_tokens[child_index]
+        leaves = self.subtree_leaves[child_index] - was_leaf
+        height = self.subtree_heights[child_index] + 1
+        ancestor = parent_index
+        while ancestor != NO_INDEX:
+            self.subtree_sizes[ancestor] += size
+            self.subtree_chars[ancestor] += chars
+            self.subtree_tokens[ancestor] += tokens
+            self.subtree_leaves[ancestor] += leaves
+            if height > self.subtree_heights[ancestor]:
+                self.subtree_heights[ancestor] = height
+            height += 1
+            ancestor = self.parents[ancestor]
+
+        self.max_depth = max(
+            self.max_depth,
+            self.depths[child_index] + self.subtree_heights[child_index],
+        )
+
+    def text(self, index: int) -> Optional[str]:
+        chunks = self.pending_chunks.pop(index, None)
+        if chunks:
+            self.texts[index] = self.texts[index] + "".join(chunks)
+        return self.texts[index]
+
+    def set_text(self, index: int, text: Optional[str]) -> None:
+        self.pending_chunks.pop(index, None)
+        self.texts[index] = text
+        if text is not None:
+            self.set_text_length(index, len(text))
+
+    def append_text(self, index: int, chunk: str) -> None:
+        assert self.texts[index] is not None, "can't append to projected text"
+        self.pending_chunks.setdefault(index, []).append(chunk)
+        self.text_lengths[index] += len(chunk)
+        self.total_chars += len(chunk)
+        if self.incremental:
+            self.unsettled.setdefault(index, [0, 0])[0] += len(chunk)
+
+    def set_text_length(self, index: int, length: int) -> None:
+        change = length - self.text_lengths[index]
+        if not change:
+            return
+        self.text_lengths[index] = length
+        self.total_chars += change
+        if self.incremental:
+            self.propagate(index, change, 0)
+
+    def set_tokens(self, index: int, tokens: int) -> None:
+        change = tokens - self.tokens[index]
+        if not change:
+            return
+        self.tokens[index] = tokens
+        self.generated_tokens += change
+        if self.incremental:
+            self.propagate(index, 0, change)
+
+    def propagate(self, index: int, chars: int, tokens: int) -> None:
+        """Add chars and tokens that went into a generation to the
+        aggregates of its ancestors and descendants."""
+        if chars:
+            for descendant in self.walk(index):
+                self.path_chars[descendant] += chars
+        while index != NO_INDEX:
+            self.subtree_chars[index] += chars
+            self.subtree_tokens[index] += tokens
+            index = self.parents[index]
+
+    def settle(self) -> None:
+        """Bring aggregates up to date with what streamed in."""
+        for index, (chars, tokens) in self.unsettled.items():
+            self.propagate(index, chars, tokens)
+        self.unsettled.clear()
+
+    def finish_bulk_load(self) -> None:
+        """Compute every aggregate in a single pass, and keep them updated
+        from now on."""
+        for index in range(len(self.ids)):
+            self.subtree_sizes[index] = 1
+            self.subtree_heights[index] = 0
+            self.subtree_chars[index] = self.text_lengths[index]
+            self.subtree_tokens[index] = self.tokens[index]
+            is_leaf = self.first_children[index] == NO_INDEX
+            self.subtree_leaves[index] = is_leaf
+        # streamed in before, already counted in text_lengths and tokens
+        self.unsettled.clear()
+
+        self.max_depth = 0
+        for root_index in self.root_indices:
+            order = list(self.walk(root_index))
+            self.depths[root_index] = 0
+            self.path_chars[root_index] = self.text_lengths[root_index]
+            for index in order[1:]:
+                parent_index = self.parents[index]
+                self.depths[index] = self.depths[parent_index] + 1
+                self.path_chars[index] = (
+                    self.path_chars[parent_index] + self.text_lengths[index]
+                )
+                self.max_depth = max(self.max_depth, self.depths[index])
+
+            # children come after their parents in a pre-order walk, so
+            # going backwards means every child is done before its parent
+            for index in reversed(order[1:]):
+                parent_index = self.parents[index]
+                self.subtree_sizes[parent_index] += self.subtree_sizes[index]
+                self.subtree_chars[parent_index] += self.subtree_chars[index]
+                self.subtree_tokens[parent_index] += self.subtree_tokens[index]
+                self.subtree_leaves[parent_index] += self.subtree_leaves[index]
+                self.subtree_heights[parent_index] = max(
+                    self.subtree_heights[parent_index],
+                    self.subtree_heights[index] + 1,
+                )
+
+        self.incremental = True
+
+    def count_generated_token(self, index: int) -> None:
+        self.tokens[index] += 1
+        self.generated_tokens += 1
+        if self.incremental:
+            self.unsettled.setdefault(index, [0, 0])[1] += 1
+
+    def stats(self) -> TreeStats:
+        return TreeStats(
+            generations=len(self.ids),
+            roots=len(self.root_indices),
+            leaves=self.leaf_count,
+            max_depth=self.max_depth,
+            total_chars=self.total_chars,
+            generated_tokens=self.generated_tokens,
+        )
+
+    def memory_bytes(self) -> int:
+        """Estimate of the memory the store takes, without going through
+        every generation."""
+        arrays = (
+            self.parents,
+            self.first_children,
+            self.last_children,
+            self.next_siblings,
+            self.states,
+            self.collapsed,
+            self.versions,
+            self.text_lengths,
+            self.depths,
+            self.subtree_sizes,
+            self.subtree_heights,
+            self.subtree_chars,
+            self.subtree_leaves,
+            self.path_chars,
+            self.tokens,
+            self.subtree_tokens,
+        )
+        lists = (self.ids, self.texts, self.previews, self.text_hashes)
+        return (
+            sum(len(values) * values.itemsize for values in arrays)
+            + sum(sys.getsizeof(values) for values in lists)
+            + sys.getsizeof(self.indices)
+            + len(self.ids) * UUID_SIZE
+            + self.total_chars
+            + len(self.ids) * STR_OVERHEAD
+        )
+
+    def children_indices(self, index: int) -> Iterator[int]:
+        child_index = self.first_children[index]
+        while child_index != NO_INDEX:
+            yield child_index
+            child_index = self.next_siblings[child_index]
+
+    def root_ids(self) -> List[UUID]:
+        return [self.ids[index] for index in self.root_indices]
+
+    def walk(self, root_index: int = 0) -> Iterator[int]:
+        """Indices of the subtree under root_index, depth-first (pre-order)."""
+        first_children, next_siblings = self.first_children, self.next_siblings
+        yield root_index
+        stack = [first_children[root_index]]
+        while stack:
+            index = stack.pop()
+            if index == NO_INDEX:
+                continue
+            yield index
+            # the sibling goes first, so it's only visited after the
+            # entire subtree of this generation
+            stack.append(next_siblings[index])
+            stack.append(first_children[index])
@@ -0,0 +1,236 @@
+"""Write made-up stories of any size and shape, for load testing.
+
+    python -m synthnav.synthetic story.synthnav --nodes 100000 --seed 1 \\
+        --branching 0:1,1:6,2:2,3:1 --max-depth 500 --text-words 60 20
+"""
+import random
+import asyncio
+import logging
+import argparse
+from collections import deque
+from pathlib import Path
+from uuid import UUID
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+from .codec import Codec
+from .database import Database
+from .generation import Generation, GenerationState
+from .tinytask import producer
+
+log = logging.getLogger(__name__)
+
+# how many generations get inserted at once
+INSERT_CHUNK_SIZE = 1000
+
+WORDS = (
+    "the a she he they it was were had looked walked said into from over "
+    "under night morning door window house forest river sword letter king "
+    "queen stranger old young quiet loud slowly quickly never always again"
+).split()
+
+
+def parse_branching(spec: str) -> Dict[int, float]:
+    """Parse "children:weight,..." into a children -> weight mapping."""
+    branching = {}
+    for item in spec.split(","):
+        children, _, weight = item.partition(":")
+        branching[int(children)] = float(weight or 1)
+    if not branching or any(c < 0 or w < 0 for c, w in branching.items()):
+        raise ValueError(f"invalid branching {spec!r}")
+    if not any(children > 0 and weight > 0 for children, weight in branching.items()):
+        raise ValueError(f"branching {spec!r} never has children")
+    return branching
+
+
+@dataclass
+class StoryShape:
+    # how likely a generation is to get each amount of children
+    branching: Dict[int, float] = field(
+        default_factory=lambda: {0: 1, 1: 6, 2: 2, 3: 1}
+    )
+    # generations this deep never get children, None for no limit
+    max_depth: Optional[int] = None
+    # words per generation, normally distributed (mean, standard deviation)
+    text_words: Tuple[float, float] = (60, 20)
+
+
+def generate_story(
+    node_amount: int,
+    shape: Optional[StoryShape] = None,
+    *,
+    seed: int = 0,
+    parent_id: Optional[UUID] = None,
+) -> Iterator[Generation]:
+    """Generate a story breadth-first, so parents always come before their
+    children. The same seed and shape always give the same story.
+
+    When parent_id is given, the story's root is made a child of it."""
+    shape = shape or StoryShape()
+    if shape.max_depth == 0 and node_amount > 1:
+        raise ValueError("a story with a max depth of 0 can only have 1 generation")
+
+    rng = random.Random(seed)
+    child_amounts = list(shape.branching)
+    child_weights = list(shape.branching.values())
+    words_mean, words_deviation = shape.text_words
+
+    def new_generation(parent: Optional[UUID]) -> Generation:
+        words = max(1, round(rng.gauss(words_mean, words_deviation)))
+        return Generation(
+            id=UUID(int=rng.getrandbits(128), version=4),
+            state=GenerationState.GENERATED,
+            text=" ".join(rng.choices(WORDS, k=words)),
+            parent=parent,
+        )
+
+    def can_have_children(depth: int) -> bool:
+        return shape.max_depth is None or depth < shape.max_depth
+
+    root = new_generation(parent_id)
+    yield root
+    generated = 1
+
+    # (id, depth) of generations that may still get children, and of
+    # every one of those, to pick from if the story dies out early
+    queue = deque([(root.id, 0)])
+    branchable: List[Tuple[UUID, int]] = [(root.id, 0)]
+    while generated < node_amount:
+        if queue:
+            generation_id, depth = queue.popleft()
+            children = rng.choices(child_amounts, child_weights)[0]
+        else:
+            generation_id, depth = rng.choice(branchable)
+            children = 1
+
+        for _ in range(min(children, node_amount - generated)):
+            child = new_generation(generation_id)
+            yield child
+            generated += 1
+            if can_have_children(depth + 1):
+                queue.append((child.id, depth + 1))
+                branchable.append((child.id, depth + 1))
+
+
+async def insert_story(
+    db: Database,
+    node_amount: int,
+    shape: Optional[StoryShape] = None,
+    *,
+    seed: int = 0,
+    parent_id: Optional[UUID] = None,
+    progress=None,
+) -> int:
+    """Insert a generated story into the database, INSERT_CHUNK_SIZE
+    generations at a time."""
+    inserted = 0
+    chunk = []
+
+    async def flush():
+        nonlocal inserted
+        await db.insert_generations([generation.snapshot() for generation in chunk])
+        inserted += len(chunk)
+        chunk.clear()
+        if progress:
+            progress(inserted, node_amount)
+
+    for generation in generate_story(
+        node_amount, shape, seed=seed, parent_id=parent_id
+    ):
+        chunk.append(generation)
+        if len(chunk) >= INSERT_CHUNK_SIZE:
+            await flush()
+            # bulk inserts don't train the dictionary on their own, do it
+            # once there's some text to learn from
+            if inserted == INSERT_CHUNK_SIZE and db.codec == Codec.ZLIB_DICT:
+                if db.zdict is None:
+                    await db.train_codec_dictionary()
+    if chunk:
+        await flush()
+
+    await db.commit()
+    return inserted
+
+
+@producer
+async def insert_story_process(tt, db, node_amount, from_pid, **kwargs):
+    def progress(inserted, total):
+        tt.send(from_pid, ("progress", inserted, total))
+
+    inserted = await insert_story(db, node_amount, progress=progress, **kwargs)
+    tt.send(from_pid, ("done", inserted))
+    tt.finish(from_pid)
+
+
+async def write_story_file(
+    path: Path,
+    node_amount: int,
+    shape: Optional[StoryShape] = None,
+    *,
+    seed: int = 0,
+    codec: Codec = Codec.RAW,
+) -> int:
+    def progress(inserted, total):
+        if inserted % (INSERT_CHUNK_SIZE * 100) == 0:
+            log.info("%d/%d generations", inserted, total)
+
+    db = Database(codec=codec)
+    await db.init()
+    try:
+        inserted = await insert_story(
+            db, node_amount, shape, seed=seed, progress=progress
+        )
+        await db.open_on(path, new=True, wipe_memory=False)
+        return inserted
+    finally:
+        await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("story", type=Path)
+    parser.add_argument("--nodes", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--branching",
+        type=parse_branching,
+        default=StoryShape().branching,
+        help='weights of how many children a generation gets, like "0:1,1:6,2:2"',
+    )
+    parser.add_argument("--max-depth", type=int)
+    parser.add_argument(
+        "--text-words",
+        type=float,
+        nargs=2,
+        metavar=("MEAN", "STDDEV"),
+        default=StoryShape().text_words,
+    )
+    parser.add_argument(
+        "--codec",
+        choices=[codec.name.lower().replace("_", "-") for codec in Codec],
+        default="raw",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.story.exists():
+        parser.error(f"{args.story} already exists")
+
+    shape = StoryShape(
+        branching=args.branching,
+        max_depth=args.max_depth,
+        text_words=tuple(args.text_words),
+    )
+    inserted = asyncio.run(
+        write_story_file(
+            args.story,
+            args.nodes,
+            shape,
+            seed=args.seed,
+            codec=Codec.from_name(args.codec),
+        )
+    )
+    log.info("wrote %d generations to %s", inserted, args.story)
+
+
+if __name__ == "__main__":
+    main()
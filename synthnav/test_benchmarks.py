@@ -0,0 +1,8 @@
+from .benchmarks.hotpaths import BENCHMARKS, run_benchmarks
+from .benchmarks.trees import Shape
+
+
+def test_hotpaths_run_headless():
+    results = run_benchmarks(Shape.RANDOM, 50, 0, list(BENCHMARKS))
+    assert [result.benchmark for result in results] == list(BENCHMARKS)
+    assert all(result.operations > 0 for result in results)
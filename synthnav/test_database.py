@@ -0,0 +1,276 @@
+import asyncio
+import sqlite3
+from uuid import uuid4 as new_uuid
+
+import lorem
+import pytest
+
+from .codec import Codec
+from . import database
+from .database import Database
+from .generation import Generation, GenerationState
+
+
+@pytest.mark.parametrize("codec", list(Codec))
+async def test_codec_roundtrip(tmp_path, codec):
+    db = Database(codec=codec)
+    await db.init()
+    root = Generation(
+        id=new_uuid(),
+        state=GenerationState.GENERATED,
+        text=lorem.paragraph(),
+        parent=None,
+    )
+    await db.insert_generation(root.snapshot())
+    texts = {root.id: root.text}
+    for _ in range(10):
+        child = Generation(
+            id=new_uuid(),
+            state=GenerationState.GENERATED,
+            # repeated across children, for the dictionary to pick up
+            text=lorem.paragraph() + " and the dragon slept under the mountain",
+            parent=root.id,
+        )
+        await db.insert_generation(child.snapshot())
+        texts[child.id] = child.text
+    await db.train_codec_dictionary()
+    assert (db.zdict is not None) == (codec == Codec.ZLIB_DICT)
+    async with db.db.execute("select count(*) from codec_dictionary") as cursor:
+        (dictionaries,) = await cursor.fetchone()
+    assert dictionaries == (codec == Codec.ZLIB_DICT)
+
+    path = tmp_path / "story.synthnav"
+    await db.open_on(path, new=True, wipe_memory=False)
+    await db.open_on(path)
+    loaded = {g.id: g.text async for g in db.iter_generations()}
+    await db.close()
+
+    assert loaded == texts
+
+
+async def test_preview_projection():
+    db = Database(codec=Codec.ZLIB)
+    await db.init()
+    text = lorem.text()
+    root = Generation(
+        id=new_uuid(),
+        state=GenerationState.GENERATED,
+        text=text,
+        parent=None,
+    )
+    await db.insert_generation(root.snapshot())
+
+    (loaded,) = [g async for g in db.iter_generations(preview_length=20)]
+    assert loaded.is_projected
+    assert loaded.preview == text[:20]
+    assert loaded.text_length == len(text)
+    assert await db.get_text(root.id) == text
+    await db.close()
+
+
+class MessageCollector:
+    def __init__(self):
+        self.messages = []
+
+    def send(self, _pid, data):
+        self.messages.append(data)
+
+    async def put(self, pid, data):
+        self.send(pid, data)
+
+    def finish(self, _pid):
+        pass
+
+
+async def test_search_follows_edits():
+    db = Database(codec=Codec.ZLIB)
+    await db.init()
+    generation = Generation(
+        id=new_uuid(),
+        state=GenerationState.GENERATED,
+        text="the dragon slept under the mountain " * 4,
+        parent=None,
+    )
+    await db.insert_generation(generation.snapshot())
+
+    tt = MessageCollector()
+    await db.search(tt, None, "drag")
+    assert [m[:2] for m in tt.messages] == [("hit", generation.id), ("done",)]
+    assert "[dragon]" in tt.messages[0][2]
+
+    generation.text = "the knight slept under the mountain"
+    await db.update_generation(generation.snapshot())
+    tt = MessageCollector()
+    await db.search(tt, None, "dragon")
+    assert tt.messages == [("done",)]
+    await db.close()
+
+
+async def test_search_ranks_every_match():
+    db = Database()
+    await db.init()
+    best = Generation(
+        id=new_uuid(),
+        state=GenerationState.GENERATED,
+        text="dragon dragon dragon",
+        parent=None,
+    )
+    await db.insert_generation(best.snapshot())
+    # newer, worse matches
+    await db.insert_generations(
+        [
+            Generation(
+                id=new_uuid(),
+                state=GenerationState.GENERATED,
+                text="a dragon " + lorem.paragraph(),
+                parent=best.id,
+            ).snapshot()
+            for _ in range(1500)
+        ]
+    )
+
+    tt = MessageCollector()
+    await db.search(tt, None, "dragon", limit=1)
+    assert [m[:2] for m in tt.messages] == [("hit", best.id), ("done",)]
+
+    await db.delete_all_generations()
+    tt = MessageCollector()
+    await db.search(tt, None, "dragon")
+    assert tt.messages == [("done",)]
+    await db.close()
+
+
+async def test_story_files_can_be_written_without_the_app(tmp_path):
+    db = Database()
+    await db.init()
+    path = tmp_path / "story.synthnav"
+    await db.open_on(path, new=True, wipe_memory=False)
+    await db.close()
+
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "insert into generations (id, state, codec, data) values (?, 0, 0, ?)",
+            (str(new_uuid()), "written by a script"),
+        )
+        connection.execute("update generations set data = 'edited'")
+        connection.execute("delete from generations")
+
+
+async def test_search_index_keeps_no_copy_of_text(tmp_path):
+    db = Database(codec=Codec.ZLIB)
+    await db.init()
+    generation = Generation(
+        id=new_uuid(),
+        state=GenerationState.GENERATED,
+        text="the dragon slept under the mountain " * 50,
+        parent=None,
+    )
+    await db.insert_generation(generation.snapshot())
+    path = tmp_path / "story.synthnav"
+    await db.open_on(path, new=True, wipe_memory=False)
+    await db.close()
+
+    with sqlite3.connect(path) as connection:
+        tables = {
+            name for (name,) in connection.execute("select name from sqlite_master")
+        }
+        ((data,),) = connection.execute("select data from generations")
+    assert "generations_fts_content" not in tables
+    assert len(data) < len(generation.text)
+
+
+async def test_stale_writes_are_dropped():
+    db = Database()
+    await db.init()
+    generation = Generation(
+        id=new_uuid(),
+        state=GenerationState.PENDING,
+        text="",
+        parent=None,
+    )
+    await db.insert_generation(generation.snapshot())
+
+    generation.text = "once upon"
+    stale = generation.snapshot()
+    generation.text = "once upon a time"
+    generation.state = GenerationState.GENERATED
+    latest = generation.snapshot()
+
+    assert await db.update_generation(latest)
+    assert not await db.update_generation(stale)
+
+    (loaded,) = [g async for g in db.iter_generations()]
+    assert loaded.text == "once upon a time"
+    assert loaded.version == latest.version
+    await db.close()
+
+
+async def test_fold_state_is_persisted(tmp_path):
+    db = Database()
+    await db.init()
+    generation = Generation(
+        id=new_uuid(),
+        state=GenerationState.GENERATED,
+        text="root",
+        parent=None,
+    )
+    await db.insert_generation(generation.snapshot())
+    await db.set_collapsed(generation.id, True)
+
+    path = tmp_path / "story.synthnav"
+    await db.open_on(path, new=True, wipe_memory=False)
+    await db.open_on(path)
+    (loaded,) = [g async for g in db.iter_generations()]
+    assert loaded.collapsed
+    await db.close()
+
+
+async def test_generated_tokens_are_persisted():
+    db = Database()
+    await db.init()
+    generation = Generation(
+        id=new_uuid(),
+        state=GenerationState.GENERATED,
+        text="root",
+        parent=None,
+    )
+    await db.insert_generation(generation.snapshot())
+    generation.tokens = 7
+    await db.update_generation(generation.snapshot())
+
+    (loaded,) = [g async for g in db.iter_generations()]
+    assert loaded.tokens == 7
+    await db.close()
+
+
+async def test_flush_waits_for_insert_that_trains_the_dictionary(monkeypatch):
+    monkeypatch.setattr(database, "DICTIONARY_TRAINING_THRESHOLD", 3)
+    db = Database(codec=Codec.ZLIB_DICT)
+    await db.init()
+    flushes = []
+    train_codec_dictionary = db.train_codec_dictionary
+
+    async def train_then_flush():
+        await train_codec_dictionary()
+        # the insert that trained the dictionary is still running
+        flush = asyncio.create_task(db.flush())
+        await asyncio.sleep(0)
+        flushes.append((flush, flush.done()))
+
+    async def insert_generations():
+        for _ in range(3):
+            generation = Generation(
+                id=new_uuid(),
+                state=GenerationState.GENERATED,
+                text=lorem.paragraph() + " and the dragon slept under the mountain",
+                parent=None,
+            )
+            await db.insert_generation(generation.snapshot())
+
+    monkeypatch.setattr(db, "train_codec_dictionary", train_then_flush)
+    await asyncio.create_task(insert_generations())
+
+    ((flush, flushed_early),) = flushes
+    assert not flushed_early
+    await flush
+    await db.close()
@@ -0,0 +1,144 @@
+import json
+from uuid import uuid4 as new_uuid
+
+import pytest
+
+from .database import Database
+from .export import ExportFormat, TreeWriter, export_story, export_story_file
+from .generation import Generation, GenerationState
+from .importer import StoryImportError, import_story
+
+
+async def _insert(db, text, parent=None):
+    generation = Generation(
+        id=new_uuid(),
+        state=GenerationState.GENERATED,
+        text=text,
+        parent=parent.id if parent else None,
+    )
+    await db.insert_generation(generation.snapshot())
+    return generation
+
+
+async def _story(tmp_path):
+    db = Database()
+    await db.init()
+    root = await _insert(db, "once")
+    left = await _insert(db, " upon", root)
+    await _insert(db, " a time", left)
+    await _insert(db, " a dream", left)
+    await _insert(db, " more", root)
+    path = tmp_path / "story.synthnav"
+    await db.open_on(path, new=True, wipe_memory=False)
+    return db, path
+
+
+async def test_export_paths(tmp_path):
+    db, _ = await _story(tmp_path)
+    output = tmp_path / "paths.txt"
+    assert await export_story(db, output, ExportFormat.PATHS) == 5
+    await db.close()
+    assert output.read_text().split("\n\n---\n\n") == [
+        "onceupona time",
+        "onceupona dream",
+        "oncemore",
+    ]
+
+
+async def test_export_is_utf8(tmp_path):
+    db = Database()
+    await db.init()
+    await _insert(db, "the dragon's hoard: ドラゴン — 🐉")
+    output = tmp_path / "story.md"
+    await export_story(db, output, ExportFormat.MARKDOWN)
+    await db.close()
+    assert "ドラゴン — 🐉" in output.read_bytes().decode("utf-8")
+
+
+async def test_export_empty_story(tmp_path):
+    db = Database()
+    await db.init()
+    assert await db.fetch_children_map() == ([], {})
+    output = tmp_path / "paths.txt"
+    assert await export_story(db, output, ExportFormat.PATHS) == 0
+    await db.close()
+    assert output.read_text() == ""
+
+
+async def test_export_story_with_several_roots(tmp_path):
+    db = Database()
+    await db.init()
+    first = await _insert(db, "once")
+    await _insert(db, " upon", first)
+    second = await _insert(db, "twice")
+    root_ids, _children_of = await db.fetch_children_map()
+    assert root_ids == [first.id, second.id]
+
+    output = tmp_path / "paths.txt"
+    assert await export_story(db, output, ExportFormat.PATHS) == 3
+    await db.close()
+    assert output.read_text().split("\n\n---\n\n") == ["onceupon", "twice"]
+
+
+def test_incomplete_writers_fail_early():
+    class ForgotToWrite(TreeWriter):
+        pass
+
+    with pytest.raises(TypeError):
+        ForgotToWrite(None)
+
+
+async def test_export_file_jsonl(tmp_path):
+    db, story_path = await _story(tmp_path)
+    await db.close()
+    output = tmp_path / "story.jsonl"
+    await export_story_file(story_path, output, ExportFormat.from_path(output))
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [record["text"] for record in records] == [
+        "once",
+        " upon",
+        " a time",
+        " a dream",
+        " more",
+    ]
+    # parents always come before their children
+    seen = set()
+    for record in records:
+        assert record["parent"] is None or record["parent"] in seen
+        seen.add(record["id"])
+
+
+async def test_import_roundtrip(tmp_path):
+    db, _ = await _story(tmp_path)
+    exported = tmp_path / "story.jsonl"
+    await export_story(db, exported, ExportFormat.JSONL)
+
+    other_db = Database()
+    await other_db.init()
+    await _insert(other_db, "to be replaced")
+    assert await import_story(other_db, exported) == 5
+
+    reexported = tmp_path / "reexported.jsonl"
+    await export_story(other_db, reexported, ExportFormat.JSONL)
+    assert reexported.read_text() == exported.read_text()
+    await db.close()
+    await other_db.close()
+
+
+async def test_import_keeps_story_on_invalid_file(tmp_path):
+    db = Database()
+    await db.init()
+    root = await _insert(db, "original")
+    broken = tmp_path / "broken.jsonl"
+    broken.write_text(
+        json.dumps({"id": str(new_uuid()), "parent": None, "text": "new root"})
+        + "\n"
+        + json.dumps({"id": str(new_uuid()), "parent": str(new_uuid()), "text": "?"})
+        + "\n"
+    )
+
+    with pytest.raises(StoryImportError, match="line 2"):
+        await import_story(db, broken)
+
+    assert [g.id async for g in db.iter_generations()] == [root.id]
+    await db.close()
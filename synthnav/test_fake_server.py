@@ -0,0 +1,39 @@
+import pytest
+import websockets
+
+from .generation_settings import GenerationSettings
+from .fake_server import FakeServer, FakeServerSettings
+from .generate import generate_text
+
+FAST = dict(tokens_per_second=10_000, first_token_delay=0, jitter=0)
+
+
+async def _generate(monkeypatch, server, max_new_tokens=20):
+    async with server.serve("localhost", 0) as ws_server:
+        port = ws_server.sockets[0].getsockname()[1]
+        monkeypatch.setenv("SERVER_ADDR", f"localhost:{port}")
+        settings = GenerationSettings.llama_defaults()
+        settings.max_new_tokens = max_new_tokens
+        return [
+            token async for token in generate_text("prompt", settings=settings, seed=7)
+        ]
+
+
+async def test_streams_requested_tokens(monkeypatch):
+    server = FakeServer(FakeServerSettings(**FAST))
+    tokens = await _generate(monkeypatch, server)
+    assert len(tokens) == 20
+    # same seed, same tokens
+    assert await _generate(monkeypatch, server) == tokens
+    assert server.finished == 2
+
+
+async def test_injected_failures(monkeypatch):
+    server = FakeServer(FakeServerSettings(**FAST, refuse_rate=1))
+    with pytest.raises(websockets.InvalidStatusCode):
+        await _generate(monkeypatch, server)
+
+    server = FakeServer(FakeServerSettings(**FAST, drop_rate=1))
+    with pytest.raises(websockets.ConnectionClosedError):
+        await _generate(monkeypatch, server)
+    assert server.failed == 1
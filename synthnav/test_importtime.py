@@ -0,0 +1,46 @@
+from .importtime import (
+    STARTUP_MODULE,
+    by_package,
+    eagerly_imported,
+    imported_modules,
+    parse_importtime,
+    run_with_report,
+)
+
+OUTPUT = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     zlib
+import time:       300 |        420 |   json.decoder
+import time:       200 |        620 | json
+import time:        50 |         50 | synthnav.codec
+"""
+
+
+def test_parse_and_group_by_package():
+    imports = parse_importtime(OUTPUT)
+    assert [entry.module for entry in imports] == [
+        "zlib",
+        "json.decoder",
+        "json",
+        "synthnav.codec",
+    ]
+    assert imports[2].cumulative_us == 620
+    assert by_package(imports) == {"zlib": 120, "json": 500, "synthnav": 50}
+    assert by_package(imports, depth=2)["json.decoder"] == 300
+
+
+def test_startup_leaves_lazy_modules_alone():
+    assert eagerly_imported(imported_modules(STARTUP_MODULE)) == []
+
+
+def test_report_on_a_normal_run(tmp_path, capsys):
+    script = tmp_path / "script.py"
+    script.write_text(
+        "import sys, json\nprint('running', file=sys.stderr)\nsys.exit(3)\n"
+    )
+    assert run_with_report(str(script), []) == 3
+
+    output = capsys.readouterr()
+    assert output.err == "running\n"
+    assert output.out.startswith(f"importing {script} took")
+    assert "json" in output.out
@@ -0,0 +1,51 @@
+from uuid import uuid4 as new_uuid
+
+from .generation import Generation, GenerationState
+from .layout import NODE_HEIGHT, NODE_X_SPACING, layout_tree
+from .store import NO_INDEX, GenerationStore
+
+
+def _add(store, parent=None):
+    return store.add(
+        Generation(
+            id=new_uuid(),
+            state=GenerationState.GENERATED,
+            text="text",
+            parent=parent.id if parent else None,
+        )
+    )
+
+
+def test_children_stack_under_their_parent():
+    store = GenerationStore()
+    root = _add(store)
+    first = _add(store, root)
+    first_child = _add(store, first)
+    _add(store, first)
+    second = _add(store, root)
+
+    placements, height = layout_tree(store, root.index, x=0, y=0)
+    positions = {
+        placement.index: (placement.x, placement.y) for placement in placements
+    }
+
+    assert height == 3 * NODE_HEIGHT
+    assert placements[0].parent_index == NO_INDEX
+    assert positions[root.index] == (0, 0)
+    assert positions[first.index] == (NODE_X_SPACING, 0)
+    assert positions[first_child.index] == (2 * NODE_X_SPACING, 0)
+    assert positions[second.index] == (NODE_X_SPACING, 2 * NODE_HEIGHT)
+
+
+def test_folded_subtrees_are_not_laid_out():
+    store = GenerationStore()
+    root = _add(store)
+    folded = _add(store, root)
+    for _ in range(10):
+        _add(store, folded)
+    folded.collapsed = True
+
+    placements, height = layout_tree(store, root.index)
+    assert [placement.index for placement in placements] == [root.index, folded.index]
+    assert placements[1].folded
+    assert height == NODE_HEIGHT
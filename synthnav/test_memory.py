@@ -0,0 +1,89 @@
+import pytest
+
+from .memory import MemoryBudgets, MemoryMonitor, count_widgets
+from .metrics import REGISTRY
+from .store import GenerationStore
+from .synthetic import generate_story, insert_story
+from .util.widgets import CustomText
+
+
+class FakeWidget:
+    def __init__(self, *children, undo_chars=None):
+        self.children = children
+        if undo_chars is not None:
+            self.undo_chars = undo_chars
+
+    def winfo_children(self):
+        return list(self.children)
+
+
+class FakeText(FakeWidget):
+    pass
+
+
+def test_budgets_parse_on_top_of_defaults():
+    budgets = MemoryBudgets.parse("widgets=5000, sqlite_bytes=1e9,undo_chars=none")
+    assert budgets.widgets == 5000
+    assert budgets.sqlite_bytes == 1_000_000_000
+    assert budgets.undo_chars is None
+    assert budgets.queued_messages == MemoryBudgets().queued_messages
+
+    with pytest.raises(ValueError):
+        MemoryBudgets.parse("widgetz=5")
+
+
+def test_widgets_are_counted_by_class():
+    root = FakeWidget(
+        FakeWidget(FakeText(undo_chars=10), FakeText(undo_chars=5)),
+        FakeText(undo_chars=1),
+    )
+    widgets, undo_chars = count_widgets(root)
+    assert widgets == {"FakeWidget": 2, "FakeText": 3}
+    assert undo_chars == 16
+
+
+def test_undo_chars_count_edits_made_by_tk(tk_root):
+    text = CustomText(tk_root)
+    text.insert("1.0", "hello")
+    # like typing and undoing, which tk does on the tcl side
+    tk_root.tk.call(text._w, "insert", "end", " world")
+    tk_root.tk.call(text._w, "delete", "1.0", "1.2")
+    assert text.undo_chars == len("hello") + len(" world") + 2
+    tk_root.tk.call(text._w, "edit", "undo")
+    assert text.undo_chars > len("hello") + len(" world") + 2
+
+    text.edit_reset()
+    assert text.undo_chars == 0
+    text.destroy()
+    assert not tk_root.tk.call("info", "procs", text._w)
+
+
+def test_store_estimate_grows_with_text():
+    store = GenerationStore()
+    empty = store.memory_bytes()
+    for generation in generate_story(200, seed=1):
+        store.add(generation)
+    assert store.memory_bytes() > empty + store.total_chars
+
+
+def test_report_warns_over_budget(app):
+    app.task.cast(insert_story(app.db, 200, seed=1))
+    store = GenerationStore()
+    for generation in generate_story(200, seed=1):
+        store.add(generation)
+
+    root = FakeWidget(*(FakeWidget() for _ in range(10)))
+    monitor = MemoryMonitor(root, lambda: store, MemoryBudgets(widgets=5))
+    reports = []
+    monitor.collect(reports.append)
+
+    (report,) = reports
+    assert report.generations == 200
+    assert report.widget_count == 11
+    assert report.sqlite_bytes > 0
+    assert report.queued_messages == 0
+    (warning,) = report.over_budget(monitor.budgets)
+    assert warning.startswith("widgets is 11")
+    assert REGISTRY.gauge("memory_bytes", subsystem="sqlite").value == (
+        report.sqlite_bytes
+    )
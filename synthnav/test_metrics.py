@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from .metrics import (
+    Metric,
+    MetricsRegistry,
+    bucket_bounds,
+    bucket_index,
+    write_metrics,
+)
+
+
+def test_buckets_cover_every_value_once():
+    previous_highest = -1
+    for index in range(bucket_index(10**9)):
+        lowest, highest = bucket_bounds(index)
+        assert lowest == previous_highest + 1
+        assert bucket_index(lowest) == bucket_index(highest) == index
+        previous_highest = highest
+
+
+def test_histogram_quantiles():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds")
+    for millisecond in range(1, 1001):
+        histogram.record(millisecond / 1000)
+
+    assert histogram.count == 1000
+    assert histogram.min == 0.001
+    assert histogram.max == 1.0
+    assert histogram.quantile(0.5) == pytest.approx(0.5, rel=0.03)
+    assert histogram.quantile(0.99) == pytest.approx(0.99, rel=0.03)
+
+
+def test_registry_export(tmp_path):
+    registry = MetricsRegistry()
+    registry.counter("tokens", "tokens received", backend="replay").inc(3)
+    registry.gauge("depth", function=lambda: 7, priority="bulk")
+    registry.histogram("wait_seconds").record(0.25)
+    with pytest.raises(TypeError):
+        registry.gauge("tokens", backend="replay")
+
+    text = registry.to_prometheus()
+    assert "# TYPE synthnav_tokens counter" in text
+    assert 'synthnav_tokens{backend="replay"} 3' in text
+    assert 'synthnav_depth{priority="bulk"} 7' in text
+    assert 'synthnav_wait_seconds{quantile="0.5"} 0.25' in text
+    assert "synthnav_wait_seconds_count 1" in text
+
+    write_metrics(tmp_path / "metrics.json", registry)
+    metrics = json.loads((tmp_path / "metrics.json").read_text())["metrics"]
+    assert {metric["name"]: metric["kind"] for metric in metrics} == {
+        "depth": "gauge",
+        "tokens": "counter",
+        "wait_seconds": "histogram",
+    }
+
+
+def test_incomplete_metrics_fail_early():
+    class ForgotToReport(Metric):
+        kind = "forgotten"
+
+    with pytest.raises(TypeError):
+        ForgotToReport("forgotten", "never reported", ())
@@ -0,0 +1,43 @@
+import time
+import pstats
+import asyncio
+
+from .profiling import Profiler, ProfileMode
+
+
+def busy_tk_work(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        sum(range(1000))
+
+
+async def busy_asyncio_work(seconds):
+    busy_tk_work(seconds)
+
+
+def _profile(loop_thread, tmp_path, mode):
+    profiler = Profiler(loop_thread, tmp_path, lambda: "10gen")
+    profiler.start(mode)
+    future = asyncio.run_coroutine_threadsafe(busy_asyncio_work(0.1), loop_thread)
+    busy_tk_work(0.1)
+    future.result()
+    profiler.stop()
+    # the asyncio thread writes its own file
+    asyncio.run_coroutine_threadsafe(asyncio.sleep(0), loop_thread).result()
+    return {path.name.split("-")[2]: path for path in tmp_path.iterdir()}
+
+
+def test_deterministic_profile_covers_both_threads(loop_thread, tmp_path):
+    paths = _profile(loop_thread, tmp_path, ProfileMode.DETERMINISTIC)
+    assert set(paths) == {"tk", "asyncio"}
+    for path in paths.values():
+        assert path.name.endswith("-10gen.pstats")
+        functions = {name for _file, _line, name in pstats.Stats(str(path)).stats}
+        assert "busy_tk_work" in functions
+
+
+def test_sampling_profile_covers_both_threads(loop_thread, tmp_path):
+    paths = _profile(loop_thread, tmp_path, ProfileMode.SAMPLING)
+    assert set(paths) == {"tk", "asyncio"}
+    assert "test_profiling:busy_asyncio_work" in paths["asyncio"].read_text()
+    assert "test_profiling:busy_tk_work" in paths["tk"].read_text()
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from .recording import Recorder, Replayer, ReplayedFailure, load_recordings
+
+
+async def _stream(tokens, delay=0.01, fail=False):
+    for token in tokens:
+        await asyncio.sleep(delay)
+        yield token
+    if fail:
+        raise ConnectionError("server went away")
+
+
+async def _record(recorder, prompt, stream):
+    return [token async for token in recorder.record(prompt, {}, 1, stream)]
+
+
+@pytest.mark.parametrize("filename", ["recordings.jsonl", "recordings.jsonl.gz"])
+async def test_record_and_replay(tmp_path, filename):
+    recorder = Recorder(tmp_path / filename)
+    await _record(recorder, "first", _stream(["a", "b", "c"]))
+    await _record(recorder, "second", _stream(["d", "e"]))
+
+    recordings = load_recordings(tmp_path / filename)
+    assert [recording.tokens for recording in recordings] == [
+        ["a", "b", "c"],
+        ["d", "e"],
+    ]
+    assert all(delay >= 10_000 for delay in recordings[0].delays)
+
+    replayer = Replayer(recordings, speed=0)
+    # the recording of the same prompt plays first, then the next unplayed one
+    assert [token async for token in replayer.replay("second")] == ["d", "e"]
+    assert [token async for token in replayer.replay("unknown")] == ["a", "b", "c"]
+
+
+async def test_first_delay_counts_from_the_request(tmp_path):
+    recorder = Recorder(tmp_path / "recordings.jsonl")
+    tokens = recorder.record("prompt", {}, 1, _stream(["a", "b"], delay=0))
+    # like connecting to the server before the stream is iterated
+    await asyncio.sleep(0.05)
+    assert [token async for token in tokens] == ["a", "b"]
+
+    (recording,) = load_recordings(tmp_path / "recordings.jsonl")
+    assert recording.delays[0] >= 50_000
+    assert recording.delays[1] < 50_000
+
+
+async def test_replay_keeps_timing_and_failures(tmp_path):
+    recorder = Recorder(tmp_path / "recordings.jsonl")
+    with pytest.raises(ConnectionError):
+        await _record(recorder, "prompt", _stream(["a", "b"], delay=0.05, fail=True))
+
+    (recording,) = load_recordings(tmp_path / "recordings.jsonl")
+    assert not recording.complete
+
+    replayer = Replayer([recording], speed=2)
+    start = asyncio.get_running_loop().time()
+    tokens = []
+    with pytest.raises(ReplayedFailure):
+        async for token in replayer.replay("prompt"):
+            tokens.append(token)
+    assert tokens == ["a", "b"]
+    assert asyncio.get_running_loop().time() - start >= 0.05
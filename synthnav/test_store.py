@@ -0,0 +1,200 @@
+from uuid import uuid4 as new_uuid
+
+from .generation import Generation, GenerationState
+from .store import GenerationStore
+from .benchmarks.store import build_dict, build_store, walk_dict
+from .benchmarks.trees import Shape, tree_shape
+
+
+def _generation(parent=None, text="text"):
+    return Generation(
+        id=new_uuid(),
+        state=GenerationState.GENERATED,
+        text=text,
+        parent=parent.id if parent else None,
+    )
+
+
+def test_facade_reads_and_writes_rows():
+    store = GenerationStore()
+    root = store.add(_generation())
+    first = store.add(_generation(root))
+    second = store.add(_generation(root))
+
+    assert root.children == (first.id, second.id)
+    assert first.parent == root.id
+    assert store[first.id] == first
+    assert store.root_ids() == [root.id]
+
+    first.text = "longer text"
+    first.state = GenerationState.EDITING
+    assert store[first.id].text == "longer text"
+    assert store[first.id].text_length == len("longer text")
+    assert store[first.id].state == GenerationState.EDITING
+
+    snapshot = first.snapshot()
+    assert snapshot.version == store[first.id].version == 1
+
+
+def test_children_before_parents():
+    store = GenerationStore()
+    parent = _generation()
+    child = _generation(parent)
+    store.add(child)
+    store.add(parent)
+
+    assert store[parent.id].children == (child.id,)
+    assert store[parent.id].text == parent.text
+
+
+def test_walk_matches_dict_of_generations():
+    shape = tree_shape(Shape.RANDOM, 500, seed=1)
+    generation_map = build_dict(shape)
+    store = build_store(shape)
+
+    root_id = shape[0][0]
+    expected = []
+    stack = [root_id]
+    while stack:
+        generation_id = stack.pop()
+        expected.append(generation_id)
+        stack.extend(reversed(generation_map[generation_id].children))
+
+    assert [store.ids[index] for index in store.walk()] == expected
+    assert walk_dict(generation_map, root_id) == len(shape)
+
+
+def _aggregates_by_id(store):
+    store.settle()
+    return {
+        generation_id: (
+            store.depths[index],
+            store.subtree_sizes[index],
+            store.subtree_heights[index],
+            store.subtree_chars[index],
+            store.subtree_leaves[index],
+            store.path_chars[index],
+            store.subtree_tokens[index],
+        )
+        for generation_id, index in store.indices.items()
+    }
+
+
+def test_incremental_aggregates_match_bulk_load():
+    shape = tree_shape(Shape.RANDOM, 300, seed=2)
+    incremental = build_store(shape)
+
+    bulk = GenerationStore(bulk=True)
+    # children before their parents, like rows can come from the db
+    for generation_id, parent_id in reversed(shape):
+        bulk.add(
+            Generation(
+                id=generation_id,
+                state=GenerationState.GENERATED,
+                text="",
+                parent=parent_id,
+            )
+        )
+    bulk.finish_bulk_load()
+
+    for store in (incremental, bulk):
+        root = store[shape[0][0]]
+        root.text = "abc"
+        store[shape[-1][0]].text = "de"
+        store[shape[-1][0]].count_generated_token()
+
+    assert _aggregates_by_id(incremental) == _aggregates_by_id(bulk)
+    assert incremental.stats() == bulk.stats()
+
+    stats = incremental.stats()
+    assert stats.generations == 300
+    assert stats.roots == 1
+    assert stats.total_chars == 5
+    assert incremental[shape[0][0]].subtree_size == 300
+    assert incremental[shape[0][0]].subtree_chars == 5
+    assert stats.max_depth == max(incremental.depths)
+    assert stats.leaves == sum(1 for size in incremental.subtree_sizes if size == 1)
+    assert incremental[shape[0][0]].subtree_leaves == stats.leaves
+    assert incremental[shape[0][0]].subtree_tokens == stats.generated_tokens == 1
+
+
+def test_path_chars():
+    store = GenerationStore()
+    root = store.add(_generation(text="abc"))
+    child = store.add(_generation(root, text="de"))
+    assert child.path_chars == 5
+    assert child.depth == 1
+    assert root.subtree_height == 1
+
+    root.text = "abcd"
+    assert child.path_chars == 6
+
+
+def test_aggregates_when_children_come_first():
+    store = GenerationStore()
+    root = _generation(text="abc")
+    child = _generation(root, text="de")
+    grandchildren = [_generation(child, text="f") for _ in range(2)]
+    for generation in (*grandchildren, child, root):
+        store.add(generation)
+
+    assert store[grandchildren[0].id].path_chars == 6
+    assert store[root.id].subtree_leaves == 2
+    assert store[child.id].subtree_leaves == 2
+    assert store.stats().leaves == 2
+
+
+def test_generated_tokens_add_up_the_tree():
+    store = GenerationStore()
+    root = store.add(_generation())
+    child = store.add(_generation(root))
+    for _ in range(3):
+        child.count_generated_token()
+
+    assert child.tokens == 3
+    assert root.tokens == 0
+    assert root.subtree_tokens == 3
+    assert child.snapshot().tokens == 3
+    assert store.stats().generated_tokens == 3
+
+    reloaded = GenerationStore()
+    reloaded.add(_generation(text="r"))
+    loaded = Generation(
+        id=new_uuid(), state=GenerationState.GENERATED, text="t", parent=None, tokens=5
+    )
+    assert reloaded.add(loaded).subtree_tokens == 5
+    assert reloaded.stats().generated_tokens == 5
+
+
+def test_streamed_text_settles_into_aggregates_when_read():
+    store = GenerationStore()
+    root = store.add(_generation(text="abc"))
+    child = store.add(_generation(root, text=""))
+    for token in ("de", "f"):
+        child.append_text(token)
+        child.count_generated_token()
+
+    assert store.stats().total_chars == 6
+    assert store.stats().generated_tokens == 2
+    assert store.unsettled
+    assert root.subtree_chars == 6
+    assert root.subtree_tokens == 2
+    assert child.path_chars == 6
+    assert not store.unsettled
+
+
+def test_streamed_text_is_joined_once_needed():
+    store = GenerationStore()
+    root = store.add(_generation(text="once"))
+    for token in (" upon", " a", " time"):
+        root.append_text(token)
+
+    assert store.pending_chunks
+    assert root.text_length == len("once upon a time")
+    assert not root.is_projected
+    assert store.pending_chunks
+    assert root.text == "once upon a time"
+    assert not store.pending_chunks
+
+    root.append_text(".")
+    assert root.snapshot().text == "once upon a time."
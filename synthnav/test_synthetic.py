@@ -0,0 +1,38 @@
+from .database import Database
+from .store import GenerationStore
+from .synthetic import StoryShape, generate_story, parse_branching, write_story_file
+
+
+def test_same_seed_same_story():
+    first = [(g.id, g.parent, g.text) for g in generate_story(500, seed=3)]
+    second = [(g.id, g.parent, g.text) for g in generate_story(500, seed=3)]
+    other = [(g.id, g.parent, g.text) for g in generate_story(500, seed=4)]
+    assert first == second
+    assert first != other
+
+
+def test_story_follows_its_shape():
+    shape = StoryShape(branching=parse_branching("0:5,1:1,4:1"), max_depth=3)
+    store = GenerationStore()
+    for generation in generate_story(100, shape):
+        store.add(generation)
+
+    # even if most generations don't get children, the story keeps growing
+    assert len(store) == 100
+    stats = store.stats()
+    assert stats.roots == 1
+    assert stats.max_depth == 3
+
+
+async def test_write_story_file(tmp_path):
+    path = tmp_path / "story.synthnav"
+    assert await write_story_file(path, 2500, seed=1) == 2500
+
+    db = Database()
+    await db.init()
+    await db.open_on(path)
+    generations = [generation async for generation in db.iter_generations()]
+    await db.close()
+
+    expected = list(generate_story(2500, seed=1))
+    assert {g.id: g.text for g in generations} == {g.id: g.text for g in expected}
@@ -0,0 +1,356 @@
+import sys
+import sqlite3
+import time
+import threading
+import queue
+import asyncio
+import tkinter as tk
+import _tkinter
+from uuid import uuid4 as new_uuid
+
+import pytest
+
+from .experiment_asyncio import MESSAGE_SLICE_BUDGET, TkAsyncApplication
+from .experiment_treetest import UIMockup
+from .generation import Generation, GenerationState
+from .metrics import REGISTRY
+from . import tinytask
+from .tinytask import (
+    Mailbox,
+    Priority,
+    TaskFailed,
+    TaskTimedOut,
+    TinytaskManager,
+    producer,
+)
+
+
+@pytest.fixture(name="tk_app")
+def tk_app_fixture():
+    application = TkAsyncApplication()
+    # a tcl interpreter is enough to run the message loop, no display needed
+    application.thread_unsafe_tk = tk.Tcl()
+    return application
+
+
+def register(tk_app, pid, function, priority=Priority.INTERACTIVE):
+    tk_app.task.register(pid, function, priority=priority)
+
+
+def pump(tcl):
+    while tcl.dooneevent(_tkinter.ALL_EVENTS | _tkinter.DONT_WAIT):
+        pass
+
+
+def test_messages_are_processed_in_slices(tk_app):
+    processed = []
+
+    def slow_callback(_pid, data):
+        time.sleep(MESSAGE_SLICE_BUDGET / 4)
+        processed.append(data)
+
+    register(tk_app, "bulk", slow_callback)
+    for index in range(20):
+        tk_app.task.send("bulk", index)
+
+    tk_app.process_tk_message()
+    assert 0 < len(processed) < 20
+    assert tk_app.message_queue_metrics()["depth"]["interactive"] == 20 - len(processed)
+
+    pump(tk_app.thread_unsafe_tk)
+    assert processed == list(range(20))
+    assert tk_app.message_metrics.yielded_slices > 0
+
+
+def test_interactive_messages_go_first(tk_app):
+    processed = []
+    register(tk_app, "bulk", lambda _pid, data: processed.append(data), Priority.BULK)
+    register(tk_app, "reply", lambda _pid, data: processed.append(data))
+
+    tk_app.task.send("bulk", "loaded 1")
+    tk_app.task.send("bulk", "loaded 2")
+    tk_app.task.send("reply", "clicked")
+    tk_app.process_tk_message()
+    assert processed == ["clicked", "loaded 1", "loaded 2"]
+
+
+def test_messages_wake_tk_through_the_socket_pair(tk_app):
+    processed = []
+    register(tk_app, "reply", lambda _pid, data: processed.append(data))
+    tk_app.task.send("reply", "clicked")
+    if not hasattr(tk_app.thread_unsafe_tk.tk, "createfilehandler"):
+        pytest.skip("tk can't watch file descriptors here")
+    tk_app.thread_unsafe_tk.tk.createfilehandler(
+        tk_app._wakeup_reader.fileno(), tk.READABLE, tk_app._on_wakeup
+    )
+    pump(tk_app.thread_unsafe_tk)
+    assert processed == ["clicked"]
+
+    tk_app.thread_unsafe_tk.tk.deletefilehandler(tk_app._wakeup_reader.fileno())
+    tk_app._wakeup_reader.close()
+    tk_app._wakeup_writer.close()
+    # messages from asyncio can still come in while it shuts down
+    tk_app.task.send("reply", "late")
+
+
+def test_put_waits_for_tk_consumer(loop_thread):
+    tt = TinytaskManager(loop_thread, lambda: None)
+    received = []
+    mailbox = tt.register(
+        "stream", lambda _pid, data: received.append(data), capacity=2
+    )
+
+    async def fast_producer():
+        for index in range(5):
+            await tt.put("stream", index)
+
+    future = asyncio.run_coroutine_threadsafe(fast_producer(), loop_thread)
+    time.sleep(0.05)
+    assert not future.done()
+    assert mailbox.depth == 2
+
+    while not future.done() or not tt.sync_queue.empty():
+        try:
+            _priority, _sequence, mailbox, data = tt.get_sync_message()
+        except queue.Empty:
+            time.sleep(0.001)
+            continue
+        mailbox.deliver(data)
+
+    future.result()
+    assert received == list(range(5))
+
+
+def test_async_to_async_messages(loop_thread):
+    tt = TinytaskManager(loop_thread, lambda: None)
+    received = []
+
+    async def on_message(_pid, data):
+        await asyncio.sleep(0)
+        received.append(data)
+
+    async def scenario():
+        mailbox = tt.register("pid", on_message)
+        for index in range(3):
+            tt.send("pid", index)
+        tt.finish("pid")
+        await mailbox.consumer_task
+
+    asyncio.run_coroutine_threadsafe(scenario(), loop_thread).result(timeout=5)
+    assert received == [0, 1, 2]
+
+
+def call_and_collect(tt, function, **kwargs):
+    """Call function and deliver everything it sends until it finishes."""
+    received = []
+    pid = tt.call(function, lambda _pid, data: received.append(data), **kwargs)
+    deadline = time.monotonic() + 5
+    while pid in tt.mailboxes or not tt.sync_queue.empty():
+        assert time.monotonic() < deadline
+        try:
+            _priority, _sequence, mailbox, data = tt.get_sync_message()
+        except queue.Empty:
+            time.sleep(0.001)
+            continue
+        mailbox.deliver(data)
+    return received
+
+
+@pytest.fixture(name="fast_retries")
+def fast_retries_fixture(monkeypatch):
+    monkeypatch.setattr(tinytask, "RETRY_BASE_DELAY", 0.001)
+
+
+def test_retries_until_first_message(loop_thread, fast_retries):
+    tt = TinytaskManager(loop_thread, lambda: None)
+    attempts = []
+
+    @producer
+    async def flaky_connect(tt, from_pid):
+        attempts.append(from_pid)
+        if len(attempts) < 3:
+            raise ConnectionRefusedError()
+        tt.send(from_pid, ("token", "hi"))
+        tt.finish(from_pid)
+
+    assert call_and_collect(tt, flaky_connect, retries=3) == [("token", "hi")]
+    assert len(attempts) == 3
+
+
+def test_no_retry_once_streaming(loop_thread, fast_retries):
+    tt = TinytaskManager(loop_thread, lambda: None)
+    attempts = []
+
+    @producer
+    async def broken_stream(tt, from_pid):
+        attempts.append(from_pid)
+        tt.send(from_pid, ("token", "hi"))
+        raise ConnectionResetError()
+
+    token, failure = call_and_collect(tt, broken_stream, retries=3)
+    assert token == ("token", "hi")
+    assert isinstance(failure, TaskFailed)
+    assert isinstance(failure.error, ConnectionResetError)
+    assert failure.attempts == len(attempts) == 1
+
+
+def test_deadline(loop_thread):
+    tt = TinytaskManager(loop_thread, lambda: None)
+
+    async def never_replies():
+        await asyncio.sleep(60)
+
+    (failure,) = call_and_collect(tt, never_replies, timeout=0.01)
+    assert isinstance(failure, TaskTimedOut)
+
+
+def test_own_timeouts_are_failures_not_deadlines(loop_thread, fast_retries):
+    tt = TinytaskManager(loop_thread, lambda: None)
+    attempts = []
+
+    async def connect_times_out():
+        attempts.append(None)
+        raise TimeoutError()
+
+    (failure,) = call_and_collect(tt, connect_times_out, timeout=5, retries=2)
+    assert type(failure) is TaskFailed
+    assert isinstance(failure.error, TimeoutError)
+    assert len(attempts) == 3
+
+
+def test_sweep_orphaned_mailboxes(loop_thread):
+    tt = TinytaskManager(loop_thread, lambda: None)
+
+    @producer
+    async def forgets_to_finish(tt, from_pid):
+        tt.send(from_pid, "done")
+
+    pid = tt.call(forgets_to_finish, lambda _pid, _data: None)
+    tt.register("not called", lambda _pid, _data: None)
+    deadline = time.monotonic() + 5
+    while not tt.mailboxes[pid].task or not tt.mailboxes[pid].task.done():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+    assert tt.sweep() == 1
+    assert list(tt.mailboxes) == ["not called"]
+
+
+class CountingUIMockup(UIMockup):
+    async def close_connections(self):
+        async with self.db.db.execute("select count(*) from generations") as cursor:
+            (self.generations_at_close,) = await cursor.fetchone()
+        await super().close_connections()
+
+
+def test_shutdown_cancels_streams_and_flushes_writes(loop_thread):
+    application = CountingUIMockup()
+    application.thread_unsafe_loop = loop_thread
+    application.task = TinytaskManager(loop_thread, lambda: None)
+    asyncio.run_coroutine_threadsafe(application.db.init(), loop_thread).result()
+
+    @producer
+    async def endless_stream(tt, from_pid):
+        while True:
+            await tt.put(from_pid, ("new_incoming_token", "hi"))
+            await asyncio.sleep(0.01)
+
+    application.task.call(endless_stream, lambda _pid, _data: None)
+    for _ in range(3):
+        generation = Generation(
+            id=new_uuid(), state=GenerationState.GENERATED, text="hi", parent=None
+        )
+        application.task.cast(application.db.insert_generation(generation.snapshot()))
+
+    start = time.monotonic()
+    asyncio.run_coroutine_threadsafe(
+        application._shutdown_asyncio(), loop_thread
+    ).result(timeout=10)
+
+    assert time.monotonic() - start < 1
+    assert not application.task.call_tasks
+    assert application.generations_at_close == 3
+    assert application.db.db is None
+    assert REGISTRY.gauge("shutdown_seconds", phase="cancel_calls").value < 1
+
+
+def test_shutdown_saves_open_story(loop_thread, tmp_path, caplog):
+    application = UIMockup()
+    application.thread_unsafe_loop = loop_thread
+    application.task = TinytaskManager(loop_thread, lambda: None)
+    path = tmp_path / "story.synthnav"
+
+    def run(coro):
+        return asyncio.run_coroutine_threadsafe(coro, loop_thread).result(timeout=10)
+
+    def insert_generation():
+        generation = Generation(
+            id=new_uuid(), state=GenerationState.GENERATED, text="hi", parent=None
+        )
+        run(application.db.insert_generation(generation.snapshot()))
+
+    run(application.db.init())
+    insert_generation()
+    run(application.checkpoint())
+    assert "changes are lost" in caplog.text
+
+    run(application.db.open_on(path, new=True, wipe_memory=False))
+    assert not application.db.unsaved_changes
+    insert_generation()
+    run(application._shutdown_asyncio())
+
+    with sqlite3.connect(path) as story:
+        ((generations,),) = story.execute("select count(*) from generations")
+    assert generations == 2
+
+
+def test_sweep_while_registering(loop_thread):
+    tt = TinytaskManager(loop_thread, lambda: None)
+
+    class RegisteringTask:
+        """Registers a mailbox when sweep looks at it, like a call coming
+        in from the tk thread halfway through a sweep."""
+
+        def done(self):
+            tt.register(new_uuid(), lambda _pid, _data: None)
+            return True
+
+    for _ in range(3):
+        pid = new_uuid()
+        tt.register(pid, lambda _pid, _data: None)
+        tt.mailboxes[pid].task = RegisteringTask()
+
+    assert tt.sweep() == 3
+    assert len(tt.mailboxes) == 3
+
+
+def test_incomplete_mailboxes_fail_early():
+    class ForgotToEnqueue(Mailbox):
+        pass
+
+    with pytest.raises(TypeError):
+        ForgotToEnqueue(None, "pid", print, originating_thread_name="tk")
+
+
+def test_queue_depth_with_concurrent_senders():
+    # switch threads as often as possible, to interleave the senders
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        tt = TinytaskManager(None, lambda: None)
+        tt.register("tk", lambda _pid, _data: None)
+
+        def send_many():
+            for index in range(5000):
+                tt.send("tk", index)
+
+        senders = [threading.Thread(target=send_many) for _ in range(4)]
+        for sender in senders:
+            sender.start()
+        for sender in senders:
+            sender.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert tt.sync_queue_depths()[Priority.INTERACTIVE] == 4 * 5000
+    assert len(tt._sync_enqueued_at) == 4 * 5000
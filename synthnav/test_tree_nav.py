@@ -17,9 +17,8 @@ def test_add_child(tree):
     child_count_before = len(tree.root.children)
     tree.controller.tree_view.root_generation_view.add_button.invoke()
     child_count_after = len(tree.root.children)
-    assert id(tree.root) == id(
-        tree.controller.tree_view.root_generation_view.generation
-    )
+    # both are facades over the same row of the generation store
+    assert tree.root == tree.controller.tree_view.root_generation_view.generation
     assert child_count_after == child_count_before + 1
 
 
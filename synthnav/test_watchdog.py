@@ -0,0 +1,54 @@
+import time
+import tkinter as tk
+import _tkinter
+
+from .watchdog import StallWatchdog
+
+INTERVAL = 0.02
+THRESHOLD = 0.1
+
+
+def wait_for_stall(watchdog, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not watchdog.stalls and time.monotonic() < deadline:
+        time.sleep(INTERVAL)
+
+
+def blocking_producer():
+    time.sleep(THRESHOLD * 3)
+
+
+def test_asyncio_stall_is_caught_with_its_stack(loop_thread):
+    watchdog = StallWatchdog(THRESHOLD, INTERVAL)
+    watchdog.watch_asyncio(loop_thread)
+    watchdog.start()
+    try:
+        time.sleep(INTERVAL * 3)
+        loop_thread.call_soon_threadsafe(blocking_producer)
+        wait_for_stall(watchdog)
+    finally:
+        watchdog.stop()
+
+    (stall,) = watchdog.stalls
+    assert stall.thread_name == "asyncio"
+    assert "blocking_producer" in stall.stack
+    assert THRESHOLD * 2 < stall.seconds < THRESHOLD * 5
+
+
+def test_tk_stall_is_caught():
+    tcl = tk.Tcl()
+    watchdog = StallWatchdog(THRESHOLD, INTERVAL)
+    watchdog.watch_tk(tcl)
+    watchdog.start()
+    tcl.after(round(INTERVAL * 3000), blocking_producer)
+    try:
+        deadline = time.monotonic() + 2
+        while not watchdog.stalls and time.monotonic() < deadline:
+            tcl.dooneevent(_tkinter.ALL_EVENTS | _tkinter.DONT_WAIT)
+            time.sleep(0.001)
+    finally:
+        watchdog.stop()
+
+    (stall,) = watchdog.stalls
+    assert stall.thread_name == "tk"
+    assert "blocking_producer" in stall.stack
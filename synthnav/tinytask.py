@@ -1,14 +1,37 @@
+import abc
+import enum
+import time
+import random
 import inspect
 import asyncio
 import logging
+import itertools
+import functools
 import threading
 import queue
-from typing import Any
 from dataclasses import dataclass
+from typing import Any, Callable, Dict, Generic, List, Optional, Set, TypeVar
 from uuid import UUID, uuid4
+from .metrics import REGISTRY
 
 log = logging.getLogger(__name__)
 
+# how many messages can be waiting on a mailbox before producers that use
+# TinytaskManager.put have to wait for its consumer to catch up
+DEFAULT_MAILBOX_CAPACITY = 1024
+
+ASYNCIO_THREAD_NAME = "asyncio"
+
+# retries wait for RETRY_BASE_DELAY * 2^attempt seconds, half of that
+# being random jitter so that many failing calls don't retry in lockstep
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+
+# how often mailboxes whose task ended without calling finish() get removed
+SWEEP_INTERVAL = 30
+
+T = TypeVar("T")
+
 
 def producer(function):
     function.__tt_is_producer = True
@@ -23,35 +46,225 @@ class ProcessID(UUID):
     pass
 
 
-@dataclass
-class Callback:
-    originating_thread_name: str
-    function: Any
+class Priority(enum.IntEnum):
+    """Order in which messages for the tk thread are processed. Messages
+    for the same callback always keep their order."""
 
+    # replies to something the user is waiting on
+    INTERACTIVE = 0
+    # token streams
+    STREAM = 1
+    # loading, importing, exporting
+    BULK = 2
 
-async def reply_with_returnvalue(tt, reply_to, coro):
-    try:
-        tt.send(reply_to, await coro)
+
+@dataclass(frozen=True)
+class TaskFailed:
+    """Last message a callback gets when the call behind it failed,
+    after any retries it had."""
+
+    process_id: UUID
+    error: BaseException
+    attempts: int
+
+    def __str__(self):
+        return f"{self.error!r} (after {self.attempts} attempt(s))"
+
+
+@dataclass(frozen=True)
+class TaskTimedOut(TaskFailed):
+    """The call went past its deadline."""
+
+    def __str__(self):
+        return f"timed out after {self.attempts} attempt(s)"
+
+
+def retry_delay(attempt: int) -> float:
+    delay = min(RETRY_BASE_DELAY * 2**attempt, RETRY_MAX_DELAY)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class Mailbox(abc.ABC, Generic[T]):
+    """Holds the messages sent to a single pid until its callback
+    consumes them.
+
+    Capacity is enforced on TinytaskManager.put, which waits (in the
+    asyncio thread) until the consumer catches up. TinytaskManager.send
+    never waits, and so ignores capacity."""
+
+    def __init__(
+        self,
+        manager: "TinytaskManager",
+        process_id: ProcessID,
+        function: Callable[[ProcessID, T], Any],
+        *,
+        originating_thread_name: str,
+        priority: Priority = Priority.INTERACTIVE,
+        capacity: int = DEFAULT_MAILBOX_CAPACITY,
+    ):
+        self.manager = manager
+        self.process_id = process_id
+        self.function = function
+        self.originating_thread_name = originating_thread_name
+        self.priority = priority
+        self.capacity = capacity
+
+        # each counter is only written to by a single thread (sent by the
+        # sender, consumed by the consumer), their difference is how many
+        # messages are in the mailbox
+        self.sent = 0
+        self.consumed = 0
+        # the supervised task that sends to this mailbox, if any
+        self.task: Optional[asyncio.Task] = None
+        self._producer_waiting = False
+        self._space_available = asyncio.Event()
+
+    @property
+    def depth(self) -> int:
+        return self.sent - self.consumed
+
+    async def put(self, data: T) -> None:
+        while self.depth >= self.capacity:
+            self._space_available.clear()
+            self._producer_waiting = True
+            # the consumer may have caught up before it could see the flag
+            if self.depth < self.capacity:
+                break
+            await self._space_available.wait()
+        self._producer_waiting = False
+        self.put_nowait(data)
+
+    def put_nowait(self, data: T) -> None:
+        self.sent += 1
+        self._enqueue(data)
+
+    @abc.abstractmethod
+    def _enqueue(self, data: T) -> None:
+        pass
+
+    def _on_consumed(self) -> None:
+        self.consumed += 1
+        if self._producer_waiting:
+            self.manager.loop.call_soon_threadsafe(self._space_available.set)
+
+    def close(self) -> None:
+        pass
+
+
+class TkMailbox(Mailbox[T]):
+    """Mailbox whose callback runs in the tk thread. Its messages go
+    through the manager's shared sync_queue."""
+
+    def _enqueue(self, data: T) -> None:
+        self.manager._put_sync_message(self, data)
+
+    def deliver(self, data: T) -> None:
+        try:
+            self.function(self.process_id, data)
+        finally:
+            self._on_consumed()
+
+
+_MAILBOX_CLOSED = object()
+
+
+class AsyncMailbox(Mailbox[T]):
+    """Mailbox whose callback runs in the asyncio thread, consumed in
+    order by a single task for as long as the mailbox is open."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queue = asyncio.Queue()
+        self.consumer_task = None
+
+    def _enqueue(self, data: T) -> None:
+        if threading.current_thread().name != ASYNCIO_THREAD_NAME:
+            self.manager.loop.call_soon_threadsafe(self._enqueue, data)
+            return
+
+        self.queue.put_nowait(data)
+        if self.consumer_task is None:
+            self.consumer_task = asyncio.create_task(self._consume())
+
+    async def _consume(self):
+        while True:
+            data = await self.queue.get()
+            if data is _MAILBOX_CLOSED:
+                break
+            try:
+                result = self.function(self.process_id, data)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                log.exception("failed to process message for %r", self.process_id)
+            finally:
+                self._on_consumed()
+
+    def close(self) -> None:
+        # let the consumer go through what is already in the mailbox
+        if self.consumer_task is not None:
+            self._enqueue(_MAILBOX_CLOSED)
+
+
+async def _run_once(tt, function, args, kwargs, reply_to, is_producer):
+    if is_producer:
+        await function(tt, *args, **kwargs, from_pid=reply_to)
+    else:
+        tt.send(reply_to, await function(*args, **kwargs))
         tt.finish(reply_to)
-    except:
-        log.exception("failed to call %r %r", reply_to, coro)
 
 
-async def spawner(tt, function, args, kwargs, reply_to):
+async def supervisor(
+    tt, function, args, kwargs, reply_to, *, timeout=None, retries: int = 0
+):
+    """Run a call to completion, retrying it on errors and sending
+    TaskFailed to its callback if it can't.
+
+    Calls are only retried if they did not send any message yet, so that
+    it's safe to retry the connection phase of a producer, but not to
+    replay what it already streamed."""
+    is_producer = getattr(function, "__tt_is_producer", False)
+    mailbox = tt.mailboxes.get(reply_to)
+    if mailbox:
+        mailbox.task = asyncio.current_task()
+
+    attempts = 0
+    deadline = asyncio.timeout(timeout)
     try:
-        try:
-            is_producer = getattr(function, "__tt_is_producer")
-        except AttributeError:
-            is_producer = False
+        async with deadline:
+            while True:
+                attempts += 1
+                try:
+                    await _run_once(tt, function, args, kwargs, reply_to, is_producer)
+                    return
+                except Exception as error:
+                    sent_anything = mailbox is not None and mailbox.sent > 0
+                    if attempts > retries or sent_anything:
+                        raise
 
-        if is_producer:
-            coroutine = function(tt, *args, **kwargs, from_pid=reply_to)
-            asyncio.create_task(coroutine)
-        else:
-            coroutine = function(*args, **kwargs)
-            asyncio.create_task(reply_with_returnvalue(tt, reply_to, coroutine))
-    except:
+                    delay = retry_delay(attempts)
+                    log.warning(
+                        "call %r failed (%r), retrying in %.2fs (attempt %d/%d)",
+                        function,
+                        error,
+                        delay,
+                        attempts,
+                        retries + 1,
+                    )
+                    await asyncio.sleep(delay)
+    except TimeoutError as error:
+        if not deadline.expired():
+            # the callee's own timeout, like a connection timing out
+            log.exception(
+                "failed to call %r %r %r %r", function, args, kwargs, reply_to
+            )
+            tt.fail(reply_to, TaskFailed(reply_to, error, attempts))
+            return
+        log.warning("call %r timed out after %r seconds", function, timeout)
+        tt.fail(reply_to, TaskTimedOut(reply_to, error, attempts))
+    except Exception as error:
         log.exception("failed to call %r %r %r %r", function, args, kwargs, reply_to)
+        tt.fail(reply_to, TaskFailed(reply_to, error, attempts))
 
 
 async def coroutine_wrapper(coro):
@@ -61,16 +274,31 @@ async def coroutine_wrapper(coro):
         log.exception("failed to call %r", coro)
 
 
-async def spawn_task(coro):
-    asyncio.create_task(coro)
-
-
 class TinytaskManager:
     def __init__(self, loop, sync_message_notifier):
         self.loop = loop
-        self.callbacks = {}
+        self.mailboxes: Dict[UUID, Mailbox] = {}
         self.sync_message_notifier = sync_message_notifier
-        self.sync_queue = queue.Queue()
+        self.sync_queue = queue.PriorityQueue()
+        self._sync_sequence = itertools.count()
+        # their difference is the queue depth. messages are dequeued only by
+        # the tk thread, but sent from both threads, so sending takes
+        # _sync_lock
+        self._sync_lock = threading.Lock()
+        self._sync_enqueued = {priority: 0 for priority in Priority}
+        self._sync_dequeued = {priority: 0 for priority in Priority}
+        # sequence -> when a message was queued, to measure how long it
+        # takes for the tk thread to get it
+        self._sync_enqueued_at: Dict[int, float] = {}
+        # tasks running a call(), casts aren't in here
+        self.call_tasks: Set[asyncio.Task] = set()
+        for priority in Priority:
+            REGISTRY.gauge(
+                "tk_queue_depth",
+                "messages waiting for the tk thread",
+                function=functools.partial(self._sync_queue_depth, priority),
+                priority=priority.name.lower(),
+            )
 
     def cast(self, coro):
         """Run a coroutine in the asyncio loop without waiting for reply."""
@@ -85,43 +313,145 @@ class TinytaskManager:
         args=None,
         kwargs=None,
         as_pid: UUID = None,
+        priority: Priority = Priority.INTERACTIVE,
+        capacity: int = DEFAULT_MAILBOX_CAPACITY,
+        timeout: Optional[float] = None,
+        retries: int = 0,
     ) -> ConnectionID:
+        """Run function in the asyncio loop, sending its return value (or
+        everything it sends, if it's a producer) to callback.
+
+        If it doesn't complete within timeout seconds, or fails after being
+        retried `retries` times, callback gets a TaskFailed message."""
         args = args or []
         kwargs = kwargs or {}
 
         as_pid = as_pid or uuid4()
         if callback:
-            self.callbacks[as_pid] = Callback(threading.current_thread().name, callback)
+            self.register(as_pid, callback, priority=priority, capacity=capacity)
         asyncio.run_coroutine_threadsafe(
-            spawner(self, function, args, kwargs, as_pid), self.loop
+            self._tracked_call(
+                supervisor(
+                    self,
+                    function,
+                    args,
+                    kwargs,
+                    as_pid,
+                    timeout=timeout,
+                    retries=retries,
+                )
+            ),
+            self.loop,
         )
         return as_pid
 
+    async def _tracked_call(self, coro):
+        task = asyncio.current_task()
+        self.call_tasks.add(task)
+        try:
+            await coro
+        finally:
+            self.call_tasks.discard(task)
+
+    def cancel_calls(self) -> List[asyncio.Task]:
+        """Cancel every running call, like generation streams, returning
+        their tasks. Must be called from the asyncio thread."""
+        tasks = list(self.call_tasks)
+        for task in tasks:
+            task.cancel()
+        return tasks
+
+    def register(self, process_id: ProcessID, callback, **kwargs) -> Mailbox:
+        """Create the mailbox where messages to process_id go, its callback
+        runs in the thread register was called from."""
+        thread_name = threading.current_thread().name
+        if thread_name == ASYNCIO_THREAD_NAME:
+            mailbox_class = AsyncMailbox
+        else:
+            mailbox_class = TkMailbox
+
+        mailbox = mailbox_class(
+            self, process_id, callback, originating_thread_name=thread_name, **kwargs
+        )
+        self.mailboxes[process_id] = mailbox
+        return mailbox
+
     def send(self, process_id: ProcessID, data):
-        callback = self.callbacks.get(process_id)
-        if not callback:
+        """Send a message without waiting, even if the mailbox is full."""
+        mailbox = self.mailboxes.get(process_id)
+        if not mailbox:
             log.warning("unknown pid %r", process_id)
             return
+        mailbox.put_nowait(data)
 
-        current_thread_name = threading.current_thread().name
+    async def put(self, process_id: ProcessID, data):
+        """Send a message, waiting for room in the mailbox if it's full.
 
-        if (
-            current_thread_name == "asyncio"
-            and callback.originating_thread_name == "asyncio"
-        ):
-            # async-to-async, just await the callback
-            asyncio.run(callback.function(process_id, data))
+        Must be called from the asyncio thread, and is what producers of
+        many messages should use."""
+        mailbox = self.mailboxes.get(process_id)
+        if not mailbox:
+            log.warning("unknown pid %r", process_id)
             return
+        await mailbox.put(data)
 
-        if callback.originating_thread_name == "asyncio":
-            # callback is from asyncio, schedule it to the loop
-            asyncio.run_coroutine_threadsafe(
-                spawn_task(callback.function, process_id, data), self.loop
-            )
-        else:
-            # callback is from tk thread, push to it
-            self.sync_queue.put((callback.function, [process_id, data]))
-            self.sync_message_notifier()
+    def _put_sync_message(self, mailbox: TkMailbox, data):
+        with self._sync_lock:
+            self._sync_enqueued[mailbox.priority] += 1
+            sequence = next(self._sync_sequence)
+            self._sync_enqueued_at[sequence] = time.monotonic()
+        self.sync_queue.put((mailbox.priority, sequence, mailbox, data))
+        self.sync_message_notifier()
+
+    def get_sync_message(self):
+        """Get the next message for the tk thread, raises queue.Empty if
+        there are none."""
+        message = self.sync_queue.get_nowait()
+        priority, sequence = message[0], message[1]
+        self._sync_dequeued[priority] += 1
+        enqueued_at = self._sync_enqueued_at.pop(sequence, None)
+        if enqueued_at is not None:
+            REGISTRY.histogram(
+                "tk_message_latency_seconds",
+                "time from a message being sent to the tk thread getting it",
+                priority=priority.name.lower(),
+            ).record(time.monotonic() - enqueued_at)
+        return message
+
+    def _sync_queue_depth(self, priority: Priority) -> int:
+        return self._sync_enqueued[priority] - self._sync_dequeued[priority]
+
+    def sync_queue_depths(self) -> Dict[Priority, int]:
+        return {priority: self._sync_queue_depth(priority) for priority in Priority}
 
     def finish(self, id: UUID):
-        self.callbacks.pop(id, None)
+        mailbox = self.mailboxes.pop(id, None)
+        if mailbox:
+            mailbox.close()
+
+    def fail(self, process_id: UUID, failure: TaskFailed):
+        """Send failure as the last message to process_id."""
+        self.send(process_id, failure)
+        self.finish(process_id)
+
+    def sweep(self) -> int:
+        """Remove mailboxes whose task is gone but never called finish(),
+        returning how many were removed."""
+        # mailboxes get registered from the tk thread while this runs
+        orphaned = [
+            process_id
+            for process_id, mailbox in list(self.mailboxes.items())
+            if mailbox.task is not None and mailbox.task.done()
+        ]
+        for process_id in orphaned:
+            log.warning("removing orphaned mailbox %r", process_id)
+            self.finish(process_id)
+        return len(orphaned)
+
+    async def sweep_forever(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            try:
+                self.sweep()
+            except Exception:
+                log.exception("failed to sweep mailboxes")
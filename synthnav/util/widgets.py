@@ -1,5 +1,27 @@
 import tkinter as tk
 
+# stands in for a text widget's command, counting the characters edits
+# insert or delete. delete and replace take any number of ranges, so they
+# are counted by how many characters the widget has before and after
+TEXT_PROXY = """
+proc %(widget)s {command args} {
+    set before 0
+    set after 0
+    if {$command in {delete replace}} {
+        set before [%(original)s count -chars 1.0 end]
+    }
+    set result [%(original)s $command {*}$args]
+    if {$command in {delete replace}} {
+        set after [%(original)s count -chars 1.0 end]
+    }
+    if {$command in {insert delete replace}
+            || ($command eq "edit" && [lindex $args 0] eq "reset")} {
+        %(count_edit)s $command $before $after {*}$args
+    }
+    return $result
+}
+"""
+
 
 class CustomText(tk.Text):
     def __init__(self, *args, **kwargs):
@@ -17,6 +39,24 @@ class CustomText(tk.Text):
             kwargs["autoseparators"] = True
 
         super().__init__(*args, **kwargs)
+        # characters inserted or deleted since the undo stack was last
+        # cleared, roughly how big the undo stack is
+        self.undo_chars = 0
+        # typing, pasting and undoing call the tcl widget command without
+        # going through python, so a tcl proc put in its place counts edits
+        # once the widget made them. tcl errors go through untouched, tk's
+        # own bindings catch some of them
+        self._original_command = self._w + "_original"
+        self.tk.call("rename", self._w, self._original_command)
+        self.tk.eval(
+            TEXT_PROXY
+            % {
+                "widget": self._w,
+                "original": self._original_command,
+                "count_edit": self.register(self._count_edit),
+            }
+        )
+
         if self.event_callback:
             self.bind("<<Modified>>", self._handle_modified_event)
             self.edit_modified(0)
@@ -24,6 +64,25 @@ class CustomText(tk.Text):
         if auto_select:
             self.bind("<Control-Key-a>", self._handle_select_all)
 
+    def _count_edit(self, command, chars_before, chars_after, *args):
+        if command == "insert":
+            # index chars ?tags chars tags ...?
+            self.undo_chars += sum(map(len, args[1::2]))
+        elif command in ("delete", "replace"):
+            inserted = sum(map(len, args[2::2])) if command == "replace" else 0
+            deleted = int(chars_before) + inserted - int(chars_after)
+            self.undo_chars += deleted + inserted
+        else:
+            # edit reset
+            self.undo_chars = 0
+
+    def destroy(self):
+        # tk deletes the widget command with the widget, not the proc in
+        # its place
+        if self.tk.call("info", "procs", self._w):
+            self.tk.call("rename", self._w, "")
+        super().destroy()
+
     def _handle_modified_event(self, event):
         self.event_callback(event)
         self.edit_modified(0)
@@ -0,0 +1,158 @@
+"""Find out which thread froze the UI, and where.
+
+Both loops run a heartbeat, and a watchdog thread checks on them. When a
+heartbeat is late by more than the threshold, the watchdog takes the
+stuck thread's stack while it's still stuck, and records how long the
+stall lasted once the heartbeat comes back."""
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+import collections
+from dataclasses import dataclass
+from typing import Deque, List, Optional
+from .metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+# how often each loop beats
+HEARTBEAT_INTERVAL = 0.1
+# how late a heartbeat can be before it's a stall
+DEFAULT_STALL_THRESHOLD = 0.25
+# how many stalls are kept around for inspection
+MAX_RECORDED_STALLS = 50
+
+
+def format_thread_stack(ident: int) -> Optional[str]:
+    frame = sys._current_frames().get(ident)
+    if frame is None:
+        return None
+    return "".join(traceback.format_stack(frame))
+
+
+@dataclass
+class Stall:
+    thread_name: str
+    # wall clock time of the last heartbeat before the stall
+    started_at: float
+    # how long the thread went without a heartbeat, 0 while still stalled
+    seconds: float
+    stack: str
+
+
+class Heartbeat:
+    def __init__(self, thread_name: str, interval: float):
+        self.thread_name = thread_name
+        self.interval = interval
+        self.ident: Optional[int] = None
+        self.last_beat = 0.0
+        self.stall: Optional[Stall] = None
+        self._lag = REGISTRY.histogram(
+            "loop_lag_seconds",
+            "how late loops run a callback scheduled on them",
+            thread=thread_name,
+        )
+
+    @property
+    def started(self) -> bool:
+        return self.ident is not None
+
+    def beat(self):
+        now = time.monotonic()
+        if self.ident is None:
+            self.ident = threading.get_ident()
+        else:
+            self._lag.record(max(0.0, now - self.last_beat - self.interval))
+        self.last_beat = now
+
+
+class StallWatchdog:
+    def __init__(
+        self,
+        threshold: float = DEFAULT_STALL_THRESHOLD,
+        interval: float = HEARTBEAT_INTERVAL,
+    ):
+        self.threshold = threshold
+        self.interval = interval
+        self.heartbeats: List[Heartbeat] = []
+        self.stalls: Deque[Stall] = collections.deque(maxlen=MAX_RECORDED_STALLS)
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def watch_asyncio(self, loop: asyncio.AbstractEventLoop, name: str = "asyncio"):
+        heartbeat = Heartbeat(name, self.interval)
+        self.heartbeats.append(heartbeat)
+
+        def beat():
+            heartbeat.beat()
+            if not self._stopped.is_set():
+                loop.call_later(self.interval, beat)
+
+        loop.call_soon_threadsafe(beat)
+
+    def watch_tk(self, widget, name: str = "tk"):
+        """Must be called from the tk thread."""
+        heartbeat = Heartbeat(name, self.interval)
+        self.heartbeats.append(heartbeat)
+
+        def beat():
+            heartbeat.beat()
+            if not self._stopped.is_set():
+                widget.after(round(self.interval * 1000), beat)
+
+        beat()
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._watch_forever, name="watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _watch_forever(self):
+        while not self._stopped.wait(self.interval / 2):
+            for heartbeat in self.heartbeats:
+                if heartbeat.started:
+                    self.check(heartbeat)
+
+    def check(self, heartbeat: Heartbeat):
+        silent_for = time.monotonic() - heartbeat.last_beat
+        if heartbeat.stall is None:
+            if silent_for < self.interval + self.threshold:
+                return
+            stack = format_thread_stack(heartbeat.ident) or "(no stack)"
+            heartbeat.stall = Stall(
+                thread_name=heartbeat.thread_name,
+                started_at=time.time() - silent_for,
+                seconds=0.0,
+                stack=stack,
+            )
+            log.warning(
+                "%s thread stalled for %.0fms, at:\n%s",
+                heartbeat.thread_name,
+                silent_for * 1000,
+                stack,
+            )
+        elif silent_for < self.interval + self.threshold:
+            # beating again, silent_for is since the first beat after the stall
+            stall, heartbeat.stall = heartbeat.stall, None
+            stall.seconds = time.time() - silent_for - stall.started_at
+            self.stalls.append(stall)
+            REGISTRY.histogram(
+                "stall_seconds",
+                "how long loops went without running anything else",
+                thread=stall.thread_name,
+            ).record(stall.seconds)
+            log.warning(
+                "%s thread recovered after a %.0fms stall",
+                stall.thread_name,
+                stall.seconds * 1000,
+            )